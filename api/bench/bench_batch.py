@@ -0,0 +1,89 @@
+"""Benchmark batched completion (libs/batch.py) against answering the same prompts one at a time.
+
+Prompts of varied length are answered in three modes:
+
+    serial    one generate() call per prompt, as a sequence of WebSocket turns would
+    unsorted  padded batches in input order
+    bucketed  padded batches sorted by length, as /chat/batch does
+
+    python bench/bench_batch.py Qwen/Qwen2.5-0.5B-Instruct --prompts 64 --max-new-tokens 32
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from libs.batch import BATCH_SIZE, MAX_BATCH_TOKENS, _generate_batch, length_buckets
+from libs.model_loader import apply_cpu_settings, load_model
+
+WORDS = "the quick brown fox jumps over a lazy dog while seven wizards quietly judge boxing matches".split()
+
+
+def make_prompts(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    return [
+        "Summarize in one sentence: " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 200)))
+        for _ in range(count)
+    ]
+
+
+def encode(tokenizer, prompts: list) -> list:
+    sequences = []
+    for prompt in prompts:
+        text = tokenizer.apply_chat_template([{"role": "user", "content": prompt}], tokenize=False, add_generation_prompt=True)
+        sequences.append(tokenizer(text, add_special_tokens=False)["input_ids"])
+    return sequences
+
+
+def run(mode: str, tokenizer, model, sequences: list, args) -> dict:
+    if mode == "serial":
+        batches = [[index] for index in range(len(sequences))]
+    elif mode == "unsorted":
+        batches = [list(range(i, min(i + args.batch_size, len(sequences)))) for i in range(0, len(sequences), args.batch_size)]
+    else:
+        batches = length_buckets([len(ids) for ids in sequences], args.max_new_tokens, args.batch_size, args.max_batch_tokens)
+
+    padded, generated = 0, 0
+    start = time.perf_counter()
+    for batch in batches:
+        width = max(len(sequences[index]) for index in batch)
+        padded += sum(width - len(sequences[index]) for index in batch)
+        generated += sum(count for _, count in _generate_batch(model, tokenizer, [sequences[index] for index in batch], args.max_new_tokens))
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": mode,
+        "prompts": len(sequences),
+        "batches": len(batches),
+        "padding_tokens": padded,
+        "completion_tokens": generated,
+        "elapsed_s": round(elapsed, 2),
+        "prompts_per_sec": round(len(sequences) / elapsed, 2),
+        "tokens_per_sec": round(generated / elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("model")
+    parser.add_argument("--profile", default="auto")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--prompts", type=int, default=64)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--max-batch-tokens", type=int, default=MAX_BATCH_TOKENS)
+    parser.add_argument("--modes", nargs="+", default=["serial", "unsorted", "bucketed"])
+    args = parser.parse_args()
+
+    apply_cpu_settings(args.threads, None)
+    tokenizer, model = load_model(args.model, args.profile)
+    sequences = encode(tokenizer, make_prompts(args.prompts))
+    for mode in args.modes:
+        print(json.dumps(run(mode, tokenizer, model, sequences, args)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Benchmark bulk export and import throughput (rows/sec) on a large synthetic history.
+
+Seeds a throwaway SQLite file with one user owning --rooms rooms and --conversations turns,
+exports it to NDJSON with libs.bulk, then imports that file into a second empty database.
+Peak RSS is reported to check that both directions run in constant memory.
+
+    python bench/bench_bulk.py --conversations 1000000 --rooms 1000
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from schemas.models import Base, ChatRoom, Conversation, Message, UserAccount
+from libs.bulk import Importer, export_ndjson
+from libs.storage import LocalDriver
+
+SEED_BATCH = 10000
+
+
+def make_session_factory(path: str):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def seed(session_factory, rooms: int, conversations: int):
+    session = session_factory()
+    session.add(UserAccount(username="bench", password="x"))
+    room_ids = [uuid.uuid4() for _ in range(rooms)]
+    session.add_all(ChatRoom(id=room_id, roomName=f"room-{i}", username="bench") for i, room_id in enumerate(room_ids))
+    session.commit()
+    now = datetime.utcnow()
+    for start in range(0, conversations, SEED_BATCH):
+        count = min(SEED_BATCH, conversations - start)
+        session.execute(insert(Conversation), [
+            {"id": start + i + 1, "chatRoom_id": room_ids[(start + i) % rooms], "query": f"question {start + i}",
+             "responseMessage": f"answer {start + i} " * 8, "timestamp": now}
+            for i in range(count)
+        ])
+        session.execute(insert(Message), [
+            {"conversation_id": start + i + 1, "senderUsername": "bench", "rating": None} for i in range(count)
+        ])
+        session.commit()
+    session.close()
+
+
+def max_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(rooms: int, conversations: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        source = make_session_factory(os.path.join(tmp, "source.db"))
+        start = time.perf_counter()
+        seed(source, rooms, conversations)
+        seeded = time.perf_counter() - start
+        rss_after_seed = max_rss_mb()
+
+        export_path = os.path.join(tmp, "export.ndjson")
+        session = source()
+        start = time.perf_counter()
+        with open(export_path, "wb") as out:
+            for line in export_ndjson(session, "bench"):
+                out.write(line)
+        export_s = time.perf_counter() - start
+        session.close()
+        rss_after_export = max_rss_mb()
+
+        target = make_session_factory(os.path.join(tmp, "target.db"))
+        session = target()
+        session.add(UserAccount(username="bench", password="x"))
+        session.commit()
+        importer = Importer(session, "bench", storage=LocalDriver(os.path.join(tmp, "documents")))
+        start = time.perf_counter()
+        with open(export_path, "rb") as f:
+            for line in f:
+                importer.feed(line)
+        summary = importer.finish()
+        import_s = time.perf_counter() - start
+        session.close()
+
+        return {
+            "rooms": rooms,
+            "conversations": conversations,
+            "seed_s": round(seeded, 2),
+            "export_bytes": os.path.getsize(export_path),
+            "export_s": round(export_s, 2),
+            "export_rows_per_sec": round(conversations / export_s, 1),
+            "import_s": round(import_s, 2),
+            "import_rows_per_sec": round(conversations / import_s, 1),
+            "imported": summary.get("conversations", 0),
+            "max_rss_mb": {
+                "after_seed": round(rss_after_seed, 1),
+                "after_export": round(rss_after_export, 1),
+                "after_import": round(max_rss_mb(), 1),
+            },
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rooms", type=int, default=1000)
+    parser.add_argument("--conversations", type=int, default=1000000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.rooms, args.conversations)))
+
+
+if __name__ == "__main__":
+    main()
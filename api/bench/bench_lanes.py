@@ -0,0 +1,135 @@
+"""Benchmark interactive time-to-first-token while background generations load the CPU.
+
+Runs the same interactive turns in three modes:
+
+    idle    no background work
+    shared  background generations on plain threads, competing freely with the turns
+    lanes   background generations in the background lane (libs/scheduler.py), paused at
+            token boundaries while a turn is generating
+
+and reports TTFT percentiles for the turns plus background token throughput.
+
+    python bench/bench_lanes.py Qwen/Qwen2.5-0.5B-Instruct --background-jobs 2 --turns 10
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from libs.model_loader import apply_cpu_settings, load_model
+from libs.scheduler import BACKGROUND, INTERACTIVE, GenerationScheduler, pause_criteria
+
+BACKGROUND_PROMPT = "Summarize the history of computing in great detail, decade by decade."
+INTERACTIVE_PROMPT = "What is the capital of France? Answer in one sentence."
+
+
+def encode(tokenizer, model, prompt: str):
+    text = tokenizer.apply_chat_template([{"role": "user", "content": prompt}], tokenize=False, add_generation_prompt=True)
+    return tokenizer(text, return_tensors="pt", add_special_tokens=False).to(model.device)
+
+
+def background_job(model, inputs, max_new_tokens: int, stop: threading.Event, counter: dict, criteria=None):
+    import torch
+    while not stop.is_set():
+        with torch.inference_mode():
+            output = model.generate(
+                **inputs, max_new_tokens=max_new_tokens, do_sample=False,
+                stopping_criteria=[criteria] if criteria is not None else None,
+            )
+        counter["tokens"] += int(output.shape[-1] - inputs["input_ids"].shape[-1])
+
+
+def interactive_turn(tokenizer, model, inputs, max_new_tokens: int, scheduler: GenerationScheduler) -> float:
+    import torch
+    from transformers import TextIteratorStreamer
+
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+    def generate():
+        with scheduler.running(INTERACTIVE), torch.inference_mode():
+            model.generate(**inputs, streamer=streamer, max_new_tokens=max_new_tokens, do_sample=False)
+
+    start = time.perf_counter()
+    thread = threading.Thread(target=generate)
+    thread.start()
+    ttft = None
+    for text in streamer:
+        if ttft is None and text:
+            ttft = time.perf_counter() - start
+    thread.join()
+    return ttft if ttft is not None else time.perf_counter() - start
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run(mode: str, tokenizer, model, args) -> dict:
+    scheduler  = GenerationScheduler()
+    stop       = threading.Event()
+    counter    = {"tokens": 0}
+    background = encode(tokenizer, model, BACKGROUND_PROMPT)
+    threads, futures = [], []
+    for _ in range(args.background_jobs if mode != "idle" else 0):
+        if mode == "shared":
+            thread = threading.Thread(target=background_job, args=(model, background, args.background_tokens, stop, counter))
+            thread.start()
+            threads.append(thread)
+        else:
+            criteria = pause_criteria(scheduler, BACKGROUND)
+            futures.append(scheduler.submit(BACKGROUND, background_job, model, background, args.background_tokens, stop, counter, criteria))
+    time.sleep(args.warmup)
+
+    interactive = encode(tokenizer, model, INTERACTIVE_PROMPT)
+    start  = time.perf_counter()
+    ttfts  = []
+    for _ in range(args.turns):
+        ttfts.append(interactive_turn(tokenizer, model, interactive, args.max_new_tokens, scheduler))
+        time.sleep(args.think_time)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+    for future in futures:
+        future.result()
+    scheduler.shutdown()
+    return {
+        "mode": mode,
+        "background_jobs": args.background_jobs if mode != "idle" else 0,
+        "turns": args.turns,
+        "ttft_p50_s": round(statistics.median(ttfts), 3),
+        "ttft_p95_s": round(percentile(ttfts, 95), 3),
+        "ttft_max_s": round(max(ttfts), 3),
+        "background_tokens_per_sec": round(counter["tokens"] / elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("model")
+    parser.add_argument("--profile", default="auto")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--background-jobs", type=int, default=2)
+    parser.add_argument("--background-tokens", type=int, default=256)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--think-time", type=float, default=0.5, help="pause between interactive turns")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of background load before the first turn")
+    parser.add_argument("--modes", nargs="+", default=["idle", "shared", "lanes"])
+    args = parser.parse_args()
+
+    apply_cpu_settings(args.threads, None)
+    tokenizer, model = load_model(args.model, args.profile)
+    for mode in args.modes:
+        print(json.dumps(run(mode, tokenizer, model, args)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark model load profiles: load time, resident memory and tokens/sec.
+
+Each profile is measured in a fresh subprocess so load time and memory are not
+skewed by models loaded earlier in the run.
+
+    python bench/bench_load_profiles.py Qwen/Qwen2.5-0.5B-Instruct --profiles auto bf16 int8 --compile
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def resident_memory_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run_profile(args):
+    import torch
+    from libs.model_loader import load_model, apply_cpu_settings
+
+    apply_cpu_settings(args.threads, args.affinity)
+    rss_before = resident_memory_mb()
+    start = time.perf_counter()
+    tokenizer, model = load_model(args.model, args.profile, args.compile)
+    load_time = time.perf_counter() - start
+
+    messages = [{"role": "user", "content": args.prompt}]
+    text   = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    inputs = tokenizer(text=text, return_tensors="pt").to(model.device)
+
+    results = []
+    with torch.inference_mode():
+        # The first run includes compilation when --compile is set, so report it separately
+        for run in range(args.runs + 1):
+            start  = time.perf_counter()
+            output = model.generate(**inputs, max_new_tokens=args.max_new_tokens, do_sample=False)
+            elapsed = time.perf_counter() - start
+            new_tokens = output.shape[-1] - inputs["input_ids"].shape[-1]
+            results.append(new_tokens / elapsed if elapsed > 0 else 0.0)
+
+    print(json.dumps({
+        "model": args.model,
+        "profile": args.profile,
+        "compiled": bool(args.compile),
+        "threads": torch.get_num_threads(),
+        "load_time_s": round(load_time, 3),
+        "rss_mb": round(resident_memory_mb() - rss_before, 1),
+        "warmup_tokens_per_sec": round(results[0], 2),
+        "tokens_per_sec": round(sum(results[1:]) / max(1, len(results) - 1), 2),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("model")
+    parser.add_argument("--profiles", nargs="+", default=["auto", "bf16", "int8"])
+    parser.add_argument("--profile", help=argparse.SUPPRESS)
+    parser.add_argument("--compile", action="store_true", help="also measure each profile with torch.compile")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--affinity", default=None, help='CPU list such as "0-3"')
+    parser.add_argument("--prompt", default="Write a short paragraph about the ocean.")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.profile:
+        run_profile(args)
+        return
+
+    for profile in args.profiles:
+        for compile_model in ([False, True] if args.compile else [False]):
+            cmd = [
+                sys.executable, __file__, args.model,
+                "--profile", profile,
+                "--prompt", args.prompt,
+                "--max-new-tokens", str(args.max_new_tokens),
+                "--runs", str(args.runs),
+            ]
+            if compile_model:
+                cmd.append("--compile")
+            if args.threads:
+                cmd += ["--threads", str(args.threads)]
+            if args.affinity:
+                cmd += ["--affinity", args.affinity]
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+            if result.returncode != 0 or not lines:
+                print(json.dumps({"profile": profile, "compiled": compile_model, "error": result.stderr.strip()[-500:]}))
+            else:
+                print(lines[-1])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Benchmark conversation persistence: per-turn commits vs the write-behind queue.
+
+Simulates concurrent sockets each persisting chat turns (insert conversation,
+store the response, insert the message) against a throwaway SQLite file.
+
+    python bench/bench_persistence.py --sockets 32 --turns 50
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from schemas.models import Base, ChatRoom, Conversation, Message, UserAccount
+from libs.persistence import WriteBehindQueue
+
+
+def make_session_factory(path: str):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    commits = {"count": 0}
+
+    @event.listens_for(engine, "commit")
+    def count_commit(conn):
+        commits["count"] += 1
+
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine), commits
+
+
+def seed(session_factory, sockets: int):
+    session = session_factory()
+    session.add(UserAccount(username="bench", password="x"))
+    rooms = [ChatRoom(id=uuid.uuid4(), roomName=f"room-{i}", username="bench") for i in range(sockets)]
+    session.add_all(rooms)
+    session.commit()
+    room_ids = [room.id for room in rooms]
+    session.close()
+    return room_ids
+
+
+def direct_turn(session_factory, room_id, i):
+    # Mirrors the original websocket_endpoint: three commits per turn
+    session = session_factory()
+    convo = Conversation(chatRoom_id=room_id, query=f"question {i}", responseMessage="")
+    session.add(convo)
+    session.commit()
+    session.refresh(convo)
+    convo.responseMessage = f"answer {i}"
+    session.commit()
+    session.add(Message(conversation_id=convo.id, senderUsername="bench", rating=None))
+    session.commit()
+    session.close()
+
+
+def write_behind_turn(queue: WriteBehindQueue, room_id, i):
+    convo_id = queue.insert_conversation(room_id, f"question {i}").result()
+    queue.complete_conversation(convo_id, f"answer {i}", "bench").result()
+
+
+def run(mode: str, sockets: int, turns: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        session_factory, commits = make_session_factory(os.path.join(tmp, "bench.db"))
+        room_ids = seed(session_factory, sockets)
+        commits["count"] = 0
+        queue = WriteBehindQueue(session_factory=session_factory) if mode == "write-behind" else None
+
+        def worker(room_id):
+            for i in range(turns):
+                if queue is None:
+                    direct_turn(session_factory, room_id, i)
+                else:
+                    write_behind_turn(queue, room_id, i)
+
+        threads = [threading.Thread(target=worker, args=(room_id,)) for room_id in room_ids]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if queue is not None:
+            queue.stop()
+        elapsed = time.perf_counter() - start
+
+        total_turns = sockets * turns
+        return {
+            "mode": mode,
+            "sockets": sockets,
+            "turns": total_turns,
+            "elapsed_s": round(elapsed, 3),
+            "turns_per_sec": round(total_turns / elapsed, 1),
+            "commits": commits["count"],
+            "commits_per_sec": round(commits["count"] / elapsed, 1),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sockets", type=int, default=16)
+    parser.add_argument("--turns", type=int, default=50)
+    args = parser.parse_args()
+    for mode in ("direct", "write-behind"):
+        print(json.dumps(run(mode, args.sockets, args.turns)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Benchmark the fast list serialization path (libs/serialization.py) against the previous handlers.
+
+Creates a throwaway DB with one room holding --turns conversations (plus --rooms rooms and
+--documents documents), then times GET /chat/history, /chat/rooms and /document/ on the app.
+The same queries are also served by copies of the previous handlers, which built a dict (or an
+ORM object validated by DocumentResponse) per row and looked up each turn's Message separately.
+
+    python bench/bench_serialization.py --turns 20000 --requests 5
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+WORKDIR = tempfile.mkdtemp(prefix="natachat-bench-")
+os.makedirs(os.path.join(WORKDIR, "storage"))
+# libs.db opens ./storage/app.db, so run from the scratch directory
+os.chdir(WORKDIR)
+
+from typing import List
+from fastapi import Depends
+from fastapi.testclient import TestClient
+from sqlalchemy import asc, insert
+from sqlalchemy.orm import Session
+from dependency import get_db
+from libs import serialization
+from libs.db import SessionLocal, init_db
+from router.auth import create_access_token
+from router.document import DocumentResponse
+from schemas.models import ChatRoom, Conversation, Document, Message, UserAccount
+
+
+def seed(turns: int, rooms: int, documents: int) -> uuid.UUID:
+    init_db()
+    db = SessionLocal()
+    db.add(UserAccount(username="bench", password="-"))
+    room_id = uuid.uuid4()
+    db.add(ChatRoom(id=room_id, roomName="bench-history", username="bench"))
+    db.execute(insert(ChatRoom), [{"id": uuid.uuid4(), "roomName": f"room-{i}", "username": "bench"} for i in range(rooms)])
+    db.execute(insert(Document), [
+        {"username": "bench", "fileName": f"doc-{i}.pdf", "filePath": f"bench/doc-{i}.pdf"} for i in range(documents)
+    ])
+    ids = db.execute(insert(Conversation).returning(Conversation.id, sort_by_parameter_order=True), [
+        {"chatRoom_id": room_id, "query": f"Question {i} about the quarterly numbers?",
+         "responseMessage": "A reasonably long answer that explains the numbers in some detail. " * 4}
+        for i in range(turns)
+    ]).scalars().all()
+    db.execute(insert(Message), [{"conversation_id": i, "senderUsername": "bench", "rating": None} for i in ids])
+    db.commit()
+    db.close()
+    return room_id
+
+
+def add_legacy_routes(app):
+    @app.get("/legacy/history/{chatroom_id}")
+    def legacy_history(chatroom_id: uuid.UUID, db: Session = Depends(get_db)):
+        chatroom = db.query(ChatRoom).filter(ChatRoom.id == chatroom_id).first()
+        conversations = db.query(Conversation).filter(Conversation.chatRoom_id == chatroom_id).order_by(asc(Conversation.timestamp)).all()
+        history = []
+        for convo in conversations:
+            msg = db.query(Message).filter(Message.conversation_id == convo.id).first()
+            history.append({
+                "conversation_id": convo.id, "query": convo.query, "response": convo.responseMessage,
+                "timestamp": convo.timestamp, "senderUsername": msg.senderUsername if msg else None,
+                "rating": msg.rating if msg else None,
+            })
+        return {"chatroom_id": str(chatroom.id), "chatroom_name": chatroom.roomName, "owner": chatroom.username, "messages": history}
+
+    @app.get("/legacy/rooms")
+    def legacy_rooms(db: Session = Depends(get_db)):
+        rooms = db.query(ChatRoom).filter(ChatRoom.username == "bench").all()
+        return [{"id": str(r.id), "roomName": r.roomName, "owner": r.username} for r in rooms]
+
+    @app.get("/legacy/documents", response_model=List[DocumentResponse])
+    def legacy_documents(db: Session = Depends(get_db)):
+        return db.query(Document).filter(Document.username == "bench").all()
+
+
+def measure(client: TestClient, path: str, headers: dict, requests: int) -> dict:
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get(path, headers=headers)
+        latencies.append((time.perf_counter() - start) * 1000)
+    assert response.status_code == 200, response.text
+    return {
+        "content_type": response.headers["content-type"],
+        "bytes": len(response.content),
+        "p50_ms": round(statistics.median(latencies), 1),
+        "min_ms": round(min(latencies), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=20000)
+    parser.add_argument("--rooms", type=int, default=2000)
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=5)
+    args = parser.parse_args()
+
+    room_id = seed(args.turns, args.rooms, args.documents)
+    import main as app_module
+    app = app_module.app
+    add_legacy_routes(app)
+    auth = {"Authorization": f"Bearer {create_access_token({'sub': 'bench'})}", "Accept-Encoding": "identity"}
+    print(json.dumps({"encoder": "orjson" if serialization.orjson else "json", "msgpack": serialization.msgpack is not None}))
+
+    cases = [
+        ("history legacy", f"/legacy/history/{room_id}", {}),
+        ("history fast", f"/chat/history/{room_id}", {}),
+        ("rooms legacy", "/legacy/rooms", {}),
+        ("rooms fast", "/chat/rooms", {}),
+        ("documents legacy", "/legacy/documents", {}),
+        ("documents fast", "/document/", {}),
+    ]
+    if serialization.msgpack is not None:
+        cases.append(("history fast msgpack", f"/chat/history/{room_id}", {"Accept": "application/msgpack"}))
+    with TestClient(app) as client:
+        for name, path, headers in cases:
+            print(json.dumps({"case": name, **measure(client, path, {**auth, **headers}, args.requests)}), flush=True)
+
+
+if __name__ == "__main__":
+    main()
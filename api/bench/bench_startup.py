@@ -0,0 +1,88 @@
+"""Benchmark API cold start: import time of the app and of individual routers.
+
+Every measurement runs in a fresh interpreter so module caches don't carry over.
+Pass a model name to also time the first local model load, from the original
+checkpoint and then from the local safetensors snapshot (MODEL_SNAPSHOTS is set for these runs).
+
+    python bench/bench_startup.py
+    python bench/bench_startup.py --model Qwen/Qwen2.5-0.5B-Instruct --profile bf16
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+API_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+IMPORT_TARGETS = ["main", "router.auth", "router.document", "router.ws_chat", "libs.llm"]
+
+LOAD_SNIPPET = """
+import time
+from libs.model_loader import load_model
+start = time.perf_counter()
+load_model({model!r}, {profile!r})
+print(time.perf_counter() - start)
+"""
+
+
+def time_in_subprocess(code: str) -> float:
+    wrapped = f"import time\n_start = time.perf_counter()\n{code}\nprint(time.perf_counter() - _start)"
+    result = subprocess.run([sys.executable, "-c", wrapped], cwd=API_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip()[-500:])
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def heavy_modules_loaded(module: str) -> list:
+    code = f"import sys\nimport {module}\nprint(','.join(m for m in ('torch', 'transformers') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=API_DIR, capture_output=True, text=True)
+    return [m for m in result.stdout.strip().split(",") if m]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--profile", default="auto")
+    args = parser.parse_args()
+
+    for module in IMPORT_TARGETS:
+        try:
+            samples = [time_in_subprocess(f"import {module}") for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(json.dumps({"import": module, "error": str(e)}))
+            continue
+        print(json.dumps({
+            "import": module,
+            "median_s": round(statistics.median(samples), 4),
+            "min_s": round(min(samples), 4),
+            "heavy_modules": heavy_modules_loaded(module),
+        }))
+
+    if args.model:
+        from libs.model_loader import resolve_revision, snapshot_path
+        revision = resolve_revision(args.model)
+        env = dict(os.environ, MODEL_SNAPSHOTS="1")
+        for _ in range(2):
+            snapshot = revision and os.path.isdir(snapshot_path(args.model, args.profile, revision))
+            label = "snapshot" if snapshot else "checkpoint"
+            code = LOAD_SNIPPET.format(model=args.model, profile=args.profile)
+            # The interpreter exits only after the background snapshot write has finished
+            result = subprocess.run([sys.executable, "-c", code], cwd=API_DIR, env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                print(json.dumps({"load": label, "error": result.stderr.strip()[-500:]}))
+                break
+            print(json.dumps({
+                "load": label,
+                "model": args.model,
+                "profile": args.profile,
+                "seconds": round(float(result.stdout.strip().splitlines()[-1]), 3),
+            }))
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, API_DIR)
+    os.chdir(API_DIR)
+    main()
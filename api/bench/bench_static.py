@@ -0,0 +1,100 @@
+"""Compare response size and latency of the UI page and large JSON payloads, with and without
+precompressed static assets (libs/static_assets.py) and the compression middleware (libs/compression.py).
+
+Runs in-process against small FastAPI apps, so no server or DB is needed:
+
+    python bench/bench_static.py --requests 500 --turns 200
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse
+from fastapi.testclient import TestClient
+from libs.compression import CompressionMiddleware, supported_encodings
+from libs.static_assets import STATIC_PATH, asset_response, load_assets
+
+
+def build_app(compressed: bool) -> FastAPI:
+    app = FastAPI()
+    with open(os.path.join(STATIC_PATH, "room-chat.html"), "r", encoding="utf-8") as f:
+        html = f.read()
+
+    @app.get("/inline")
+    def inline():
+        # What router/ui.py used to do: a fresh string response on every request
+        return HTMLResponse("".join(html.splitlines(keepends=True)))
+
+    @app.get("/asset")
+    def asset(request: Request):
+        return asset_response(request, "room-chat.html")
+
+    @app.get("/history")
+    def history(turns: int):
+        return [
+            {"id": i, "query": f"Question number {i} about the quarterly report?",
+             "response": "Here is a detailed answer that repeats the usual phrasing. " * 8,
+             "timestamp": "2025-01-01T00:00:00"}
+            for i in range(turns)
+        ]
+
+    if compressed:
+        app.add_middleware(CompressionMiddleware)
+    return app
+
+
+def measure(client: TestClient, path: str, requests: int, headers: dict) -> dict:
+    response = client.get(path, headers=headers)
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        client.get(path, headers=headers)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        "status": response.status_code,
+        "encoding": response.headers.get("content-encoding", "identity"),
+        # Bytes on the wire; the test client has already decoded the body
+        "bytes": int(response.headers.get("content-length") or len(response.content)),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--turns", type=int, default=200, help="turns in the synthetic chat history payload")
+    args = parser.parse_args()
+
+    load_assets()
+    # Keep both clients' event loops open for the whole run instead of one per request
+    with TestClient(build_app(False)) as plain, TestClient(build_app(True)) as compressed:
+        run_cases(plain, compressed, args)
+
+
+def run_cases(plain: TestClient, compressed: TestClient, args):
+    identity = {"Accept-Encoding": "identity"}
+    etag = compressed.get("/asset", headers={"Accept-Encoding": "gzip"}).headers["etag"]
+    cases = [
+        ("ui inline", plain, "/inline", identity),
+        ("ui asset", plain, "/asset", identity),
+        ("ui asset 304", plain, "/asset", {"Accept-Encoding": "gzip", "If-None-Match": etag}),
+    ]
+    cases += [(f"ui asset {encoding}", plain, "/asset", {"Accept-Encoding": encoding}) for encoding in supported_encodings()]
+    history = f"/history?turns={args.turns}"
+    cases += [("history json", plain, history, identity)]
+    cases += [(f"history json {encoding}", compressed, history, {"Accept-Encoding": encoding}) for encoding in supported_encodings()]
+
+    for name, client, path, headers in cases:
+        print(json.dumps({"case": name, **measure(client, path, args.requests, headers)}), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Local mock of the remote LLM APIs, for exercising libs/providers.py without network access.
+
+Serves streaming (SSE) responses in the OpenAI-compatible format on /v1/chat/completions
+and in the HuggingFace text-generation format on /models/<model>. Latency and failures are
+configurable so retries, hedging and circuit breaking can be observed.
+
+    python bench/mock_llm_server.py --port 9100 --first-token-delay 0.5 --fail-rate 0.2
+    # Setting: isApi=true domainName=openai apiBase=http://127.0.0.1:9100/v1
+    #          or domainName=huggingface apiBase=http://127.0.0.1:9100/models
+"""
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    options = None
+
+    def log_message(self, format, *args):
+        if self.options.verbose:
+            super().log_message(format, *args)
+
+    def _send_error(self, status: int, message: str):
+        body = json.dumps({"error": message}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, events):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            for event in events:
+                data = event if isinstance(event, str) else json.dumps(event)
+                self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+    def _words(self, max_tokens: int):
+        time.sleep(self.options.first_token_delay)
+        for i in range(min(max_tokens, self.options.tokens)):
+            if i:
+                time.sleep(self.options.token_delay)
+            yield f"word{i} "
+
+    def do_POST(self):
+        length  = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if random.random() < self.options.fail_rate:
+            self._send_error(503, "mock overloaded")
+            return
+
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            max_tokens = payload.get("max_tokens") or self.options.tokens
+
+            def events():
+                for word in self._words(max_tokens):
+                    yield {"choices": [{"index": 0, "delta": {"content": word}}]}
+                yield "[DONE]"
+
+            self._stream(events())
+        elif self.path.startswith("/models/"):
+            max_tokens = (payload.get("parameters") or {}).get("max_new_tokens") or self.options.tokens
+            self._stream({"token": {"text": word, "special": False}} for word in self._words(max_tokens))
+        else:
+            self._send_error(404, f"unknown path {self.path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--tokens", type=int, default=32)
+    parser.add_argument("--first-token-delay", type=float, default=0.1)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--verbose", action="store_true")
+    MockHandler.options = parser.parse_args()
+    server = ThreadingHTTPServer((MockHandler.options.host, MockHandler.options.port), MockHandler)
+    print(f"Mock LLM server listening on http://{MockHandler.options.host}:{MockHandler.options.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
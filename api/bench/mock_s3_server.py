@@ -0,0 +1,150 @@
+"""Local stand-in for an S3-compatible object store, for exercising the S3 document storage driver.
+
+Keeps objects in memory and implements the subset of the S3 REST API that libs/storage.py uses
+with path-style addressing: PUT/GET (with Range)/HEAD/DELETE object, server-side copy and
+multipart uploads. Requests must carry a SigV4 Authorization header, but signatures are not
+verified.
+
+    python bench/mock_s3_server.py --port 9200
+    # DOCUMENT_STORAGE=s3 S3_ENDPOINT=http://127.0.0.1:9200 S3_BUCKET=documents \
+    #     S3_ACCESS_KEY=test S3_SECRET_KEY=test uvicorn main:app
+"""
+import argparse
+import hashlib
+import re
+import threading
+import uuid
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+objects = {}
+uploads = {}
+lock    = threading.Lock()
+
+
+class MockS3Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    options = None
+
+    def log_message(self, format, *args):
+        if self.options.verbose:
+            super().log_message(format, *args)
+
+    def _reply(self, status: int, body: bytes = b"", headers: dict | None = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if "Content-Length" not in (headers or {}):
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _error(self, status: int, code: str):
+        self._reply(status, f"<Error><Code>{code}</Code></Error>".encode("utf-8"), {"Content-Type": "application/xml"})
+
+    def _parse(self):
+        url = urlsplit(self.path)
+        _, bucket, key = (unquote(url.path).split("/", 2) + [""])[:3]
+        params = {name: values[0] for name, values in parse_qs(url.query, keep_blank_values=True).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        return f"{bucket}/{key}", params, body
+
+    def _authorized(self) -> bool:
+        if not (self.headers.get("Authorization") or "").startswith("AWS4-HMAC-SHA256 "):
+            self._error(403, "AccessDenied")
+            return False
+        return True
+
+    def do_PUT(self):
+        if not self._authorized():
+            return
+        key, params, body = self._parse()
+        if "uploadId" in params:
+            with lock:
+                upload = uploads.get(params["uploadId"])
+                if upload is None:
+                    return self._error(404, "NoSuchUpload")
+                upload[int(params["partNumber"])] = body
+            return self._reply(200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+        source = self.headers.get("x-amz-copy-source")
+        if source:
+            with lock:
+                data = objects.get(unquote(source).lstrip("/"))
+                if data is None:
+                    return self._error(404, "NoSuchKey")
+                objects[key] = data
+            return self._reply(200, b"<CopyObjectResult></CopyObjectResult>", {"Content-Type": "application/xml"})
+        with lock:
+            objects[key] = body
+        self._reply(200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        key, params, body = self._parse()
+        if "uploads" in params:
+            upload_id = uuid.uuid4().hex
+            with lock:
+                uploads[upload_id] = {}
+            xml = f"<InitiateMultipartUploadResult><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+            return self._reply(200, xml.encode("utf-8"), {"Content-Type": "application/xml"})
+        if "uploadId" in params:
+            with lock:
+                parts = uploads.pop(params["uploadId"], None)
+            if parts is None:
+                return self._error(404, "NoSuchUpload")
+            numbers = [int(part.findtext("PartNumber")) for part in ET.fromstring(body).iter("Part")]
+            with lock:
+                objects[key] = b"".join(parts[number] for number in numbers)
+            return self._reply(200, b"<CompleteMultipartUploadResult></CompleteMultipartUploadResult>")
+        self._error(400, "InvalidRequest")
+
+    def _get(self):
+        if not self._authorized():
+            return
+        key, _, _ = self._parse()
+        with lock:
+            data = objects.get(key)
+        if data is None:
+            return self._error(404, "NoSuchKey")
+        headers = {"ETag": f'"{hashlib.md5(data).hexdigest()}"', "Content-Type": "application/octet-stream"}
+        match = re.match(r"bytes=(\d*)-(\d*)$", self.headers.get("Range") or "")
+        if match and self.command == "GET":
+            start = int(match.group(1) or 0)
+            end = min(int(match.group(2)), len(data) - 1) if match.group(2) else len(data) - 1
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            return self._reply(206, data[start:end + 1], headers)
+        headers["Content-Length"] = str(len(data))
+        self._reply(200, data, headers)
+
+    do_GET  = _get
+    do_HEAD = _get
+
+    def do_DELETE(self):
+        if not self._authorized():
+            return
+        key, params, _ = self._parse()
+        with lock:
+            if "uploadId" in params:
+                uploads.pop(params["uploadId"], None)
+            else:
+                objects.pop(key, None)
+        self._reply(204)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--verbose", action="store_true")
+    MockS3Handler.options = parser.parse_args()
+    server = ThreadingHTTPServer((MockS3Handler.options.host, MockS3Handler.options.port), MockS3Handler)
+    print(f"Mock S3 server listening on http://{MockS3Handler.options.host}:{MockS3Handler.options.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
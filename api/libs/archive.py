@@ -0,0 +1,185 @@
+"""Cold storage for the conversations of idle rooms.
+
+Archived turns move out of the conversation/message tables into append-only, gzip-compressed
+JSONL files, one per user and month (storage/archive/<username>/<YYYY-MM>.jsonl.gz). Every
+archival run appends one gzip member holding one JSON line per archived turn, so files are
+never rewritten and a crash mid-append only leaves an unreferenced tail. The DB keeps an
+ArchivedSegment stub per member (file, byte offset, length, conversation id range) so a room's
+archived turns can be read back with a seek and a single decompress.
+"""
+import gzip
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from libs import metrics
+from schemas.models import ArchivedSegment, ChatRoom, Conversation, Message, PromptTokenCache
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+ARCHIVE_PATH      = "./storage/archive"
+ARCHIVE_IDLE_DAYS = float(os.environ.get("ARCHIVE_IDLE_DAYS", "90"))
+
+# Read-only stand-in for a Conversation row whose data now lives in an archive file
+ArchivedTurn = namedtuple(
+    "ArchivedTurn",
+    ["id", "query", "responseMessage", "timestamp", "senderUsername", "rating"],
+)
+
+# Appends to the same archive file must not interleave
+_append_lock = threading.Lock()
+
+
+def archive_file(username: str, when: datetime) -> str:
+    # Usernames are user-chosen; keep them from escaping the archive directory
+    safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in username).lstrip(".") or "_"
+    return os.path.join(ARCHIVE_PATH, safe_name, f"{when:%Y-%m}.jsonl.gz")
+
+
+def _append_member(path: str, payload: bytes) -> tuple:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    member = gzip.compress(payload)
+    with _append_lock, open(path, "ab") as f:
+        offset = f.seek(0, os.SEEK_END)
+        f.write(member)
+        f.flush()
+        os.fsync(f.fileno())
+    return offset, len(member)
+
+
+def _read_member(path: str, offset: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return gzip.decompress(f.read(length))
+
+
+def read_segment(segment: ArchivedSegment) -> list:
+    turns = []
+    for line in _read_member(segment.archivePath, segment.offset, segment.length).splitlines():
+        if not line:
+            continue
+        record = json.loads(line)
+        turns.append(ArchivedTurn(
+            id=record["id"],
+            query=record["query"],
+            responseMessage=record["response"],
+            timestamp=datetime.fromisoformat(record["timestamp"]) if record["timestamp"] else None,
+            senderUsername=record["senderUsername"],
+            rating=record["rating"],
+        ))
+    return turns
+
+
+def iter_archived_turns(db: Session, room_id: uuid.UUID, after_id: int | None = None):
+    """Archived turns of a room in conversation order, optionally only those after after_id.
+
+    Segments are decompressed one at a time, so only one segment's turns are held in memory.
+    """
+    query = db.query(ArchivedSegment).filter(ArchivedSegment.chatRoom_id == room_id)
+    if after_id is not None:
+        query = query.filter(ArchivedSegment.lastConversationId > after_id)
+    for segment in query.order_by(ArchivedSegment.firstConversationId).all():
+        try:
+            turns = read_segment(segment)
+        except (OSError, EOFError, ValueError) as e:
+            metrics.incr("archive_read_errors")
+            logger.error(f"Could not read archive segment {segment.id} ({segment.archivePath}): {e}")
+            continue
+        for turn in turns:
+            if after_id is None or turn.id > after_id:
+                yield turn
+
+
+def load_archived_turns(db: Session, room_id: uuid.UUID, after_id: int | None = None) -> list:
+    return list(iter_archived_turns(db, room_id, after_id))
+
+
+def archive_room(db: Session, room: ChatRoom) -> int:
+    """Move every completed turn of a room into its user's archive file. Returns the number archived."""
+    rows = (
+        db.query(Conversation, Message)
+        .outerjoin(Message, Message.conversation_id == Conversation.id)
+        .filter(Conversation.chatRoom_id == room.id, Conversation.responseMessage != "")
+        .order_by(Conversation.id)
+        .all()
+    )
+    # Tables created before sqlite_autoincrement hand out max(id) + 1, so the newest row must stay
+    if rows and rows[-1][0].id == db.query(func.max(Conversation.id)).scalar():
+        rows = rows[:-1]
+    if not rows:
+        return 0
+
+    lines = []
+    for conv, msg in rows:
+        lines.append(json.dumps({
+            "id": conv.id,
+            "room_id": str(room.id),
+            "query": conv.query,
+            "response": conv.responseMessage,
+            "timestamp": conv.timestamp.isoformat() if conv.timestamp else None,
+            "senderUsername": msg.senderUsername if msg else None,
+            "rating": msg.rating if msg else None,
+        }, ensure_ascii=False))
+    last_message_at = max((conv.timestamp for conv, _ in rows if conv.timestamp), default=None)
+    path = archive_file(room.username, last_message_at or datetime.utcnow())
+
+    # The file is appended first: if the commit below fails the member is simply never referenced
+    offset, length = _append_member(path, ("\n".join(lines) + "\n").encode("utf-8"))
+
+    conv_ids = [conv.id for conv, _ in rows]
+    db.add(ArchivedSegment(
+        chatRoom_id=room.id,
+        archivePath=path,
+        offset=offset,
+        length=length,
+        firstConversationId=conv_ids[0],
+        lastConversationId=conv_ids[-1],
+        turnCount=len(conv_ids),
+        lastMessageAt=last_message_at,
+    ))
+    db.query(PromptTokenCache).filter(PromptTokenCache.conversation_id.in_(conv_ids)).delete(synchronize_session=False)
+    db.query(Message).filter(Message.conversation_id.in_(conv_ids)).delete(synchronize_session=False)
+    db.query(Conversation).filter(Conversation.id.in_(conv_ids)).delete(synchronize_session=False)
+    db.commit()
+
+    metrics.incr("rooms_archived")
+    metrics.incr("turns_archived", len(conv_ids))
+    metrics.incr("archive_bytes_written", length)
+    logger.info(f"Archived room {room.id}: {len(conv_ids)} turns to {path} @ {offset} ({length} bytes)")
+    return len(conv_ids)
+
+
+def idle_rooms(db: Session, idle_days: float = ARCHIVE_IDLE_DAYS) -> list:
+    """Rooms with live turns whose latest turn is older than idle_days."""
+    cutoff = datetime.utcnow() - timedelta(days=idle_days)
+    latest = (
+        db.query(Conversation.chatRoom_id, func.max(Conversation.timestamp).label("last_at"))
+        .filter(Conversation.responseMessage != "")
+        .group_by(Conversation.chatRoom_id)
+        .subquery()
+    )
+    return (
+        db.query(ChatRoom)
+        .join(latest, latest.c.chatRoom_id == ChatRoom.id)
+        .filter(latest.c.last_at < cutoff)
+        .all()
+    )
+
+
+def archive_idle_rooms(db: Session, idle_days: float = ARCHIVE_IDLE_DAYS) -> int:
+    archived = 0
+    for room in idle_rooms(db, idle_days):
+        try:
+            archived += archive_room(db, room)
+        except Exception as e:
+            db.rollback()
+            metrics.incr("archive_errors")
+            logger.exception(f"Archiving room {room.id} failed: {e}")
+    return archived
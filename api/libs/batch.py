@@ -0,0 +1,362 @@
+"""Offline batch completion of many prompts at once.
+
+Input is JSONL, one prompt per line: {"id": ..., "prompt": "..."} (id defaults to the line number).
+Each prompt is answered on its own, after the setting's system prompt and, if a room is given,
+the room's summary and history. Nothing is written back to the room.
+
+For a local model the prompts are tokenized up front, sorted by length and cut into buckets of
+at most BATCH_SIZE prompts and MAX_BATCH_TOKENS padded tokens. Each bucket is then left-padded
+into a single generate() call. Sorting keeps the padding in each bucket small. Generation runs
+in the bulk lane (libs/scheduler.py), so it pauses at token boundaries while chat turns are
+generating. Remote backends have no batch API, so prompts are sent REMOTE_CONCURRENCY at a time.
+
+Each bucket and each remote prompt is admitted against the user's daily token quota before it
+runs, and its new tokens are capped by what is left of it, shared among the prompts generated
+together. Once the quota is spent the batch stops with a quota_exceeded error record.
+
+Output is JSONL streamed as results arrive, in completion order:
+
+    {"type": "result", "id": ..., "response": "...", "prompt_tokens": 12, "completion_tokens": 40}
+    {"type": "error", "id": ..., "error": "..."}
+    {"type": "error", "id": null, "code": "quota_exceeded", "error": "...", "used": 5000, "quota": 5000}
+    {"type": "progress", "done": 64, "total": 1000, "elapsed": 12.3, "tokens_per_sec": 210.5}
+    {"type": "summary", "total": 1000, "failed": 0, "elapsed": 190.2, "prompts_per_sec": 5.26, ...}
+
+    python -m libs.batch prompts.jsonl --user admin --out results.jsonl [--room ROOM_ID]
+"""
+import argparse
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from libs import llm, metrics
+from libs.model_loader import apply_cpu_settings, load_model
+from libs.prompt_cache import conversation_messages
+from libs.scheduler import BULK, generation_scheduler, pause_criteria
+from libs.usage import QuotaExceeded, usage_tracker
+from schemas.models import Setting, UserAccount
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+BATCH_SIZE         = 16    # prompts per generate() call
+MAX_BATCH_TOKENS   = 16384 # padded prompt + new tokens across a batch
+REMOTE_CONCURRENCY = 8
+PROGRESS_EVERY     = 16    # remote results between progress records
+MAX_PROMPTS        = 100000
+
+
+def parse_prompts(lines) -> list:
+    prompts = []
+    for number, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        if not isinstance(record, dict) or not isinstance(record.get("prompt"), str):
+            raise ValueError(f"Line {number + 1}: expected an object with a string 'prompt'")
+        prompts.append({"id": record.get("id", number), "prompt": record["prompt"]})
+        if len(prompts) > MAX_PROMPTS:
+            raise ValueError(f"At most {MAX_PROMPTS} prompts per batch")
+    if not prompts:
+        raise ValueError("No prompts given")
+    return prompts
+
+
+def user_setting(db, username: str) -> Setting | None:
+    user = db.get(UserAccount, username)
+    if user is not None and user.setting_id:
+        return db.get(Setting, user.setting_id)
+    return llm.load_setting(db)
+
+
+def context_messages(db, setting: Setting, room_id: str | None) -> list:
+    """Messages every prompt is appended to: the system prompt, plus the room's summary and history."""
+    if room_id is None:
+        return llm.build_head_messages(setting, None)
+    messages, conversations = llm.load_prompt_context(db, setting, room_id)
+    for conv in conversations:
+        messages.extend(conversation_messages(conv))
+    return messages
+
+
+def quota_record(error: QuotaExceeded) -> dict:
+    return {"type": "error", "id": None, "code": "quota_exceeded", "error": str(error), "used": error.used, "quota": error.quota}
+
+
+def token_limit(username: str, max_new_tokens: int, prompts: int = 1) -> int:
+    """New tokens per prompt for prompts generated together, within the user's quota. Raises QuotaExceeded."""
+    budget = usage_tracker.admit(username)
+    if budget is None:
+        return max_new_tokens
+    return max(1, min(max_new_tokens, budget // prompts))
+
+
+def length_buckets(lengths: list, max_new_tokens: int, batch_size: int = BATCH_SIZE, max_batch_tokens: int = MAX_BATCH_TOKENS) -> list:
+    """Indices grouped into batches of similar length, shortest first."""
+    batches, current = [], []
+    for index in sorted(range(len(lengths)), key=lengths.__getitem__):
+        # Sorted ascending, so the prompt being added sets the padded width of the batch
+        width = lengths[index] + max_new_tokens
+        if current and (len(current) >= batch_size or (len(current) + 1) * width > max_batch_tokens):
+            batches.append(current)
+            current = []
+        current.append(index)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _generate_batch(model, tokenizer, sequences: list, max_new_tokens: int) -> list:
+    import torch
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    width  = max(len(ids) for ids in sequences)
+    input_ids = torch.full((len(sequences), width), pad_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(sequences), width), dtype=torch.long)
+    for row, ids in enumerate(sequences):
+        # Left padding, so every sequence's next token lands in the same column
+        input_ids[row, width - len(ids):] = torch.tensor(ids, dtype=torch.long)
+        attention_mask[row, width - len(ids):] = 1
+
+    with torch.inference_mode():
+        output = model.generate(
+            input_ids=input_ids.to(model.device),
+            attention_mask=attention_mask.to(model.device),
+            max_new_tokens=max_new_tokens,
+            do_sample=False,
+            pad_token_id=pad_id,
+            stopping_criteria=[pause_criteria(generation_scheduler, BULK)],
+        )
+
+    results = []
+    for row in output[:, width:].tolist():
+        # Finished sequences are padded out to the longest one in the batch
+        while row and row[-1] == pad_id:
+            row.pop()
+        results.append((tokenizer.decode(row, skip_special_tokens=True).strip(), len(row)))
+    return results
+
+
+def run_local(setting: Setting, context: list, prompts: list, max_new_tokens: int, username: str, emit, cancelled: threading.Event):
+    apply_cpu_settings(setting.numThreads, setting.cpuAffinity)
+    tokenizer, model = load_model(setting.modelName, setting.loadProfile, setting.compileModel)
+    total = len(prompts)
+    start, done, generated = time.monotonic(), 0, 0
+
+    def progress():
+        elapsed = time.monotonic() - start
+        emit({
+            "type": "progress", "done": done, "total": total, "elapsed": round(elapsed, 2),
+            "tokens_per_sec": round(generated / elapsed, 2) if elapsed > 0 else 0.0,
+        })
+
+    sequences, valid = [], []
+    for item in prompts:
+        try:
+            text = tokenizer.apply_chat_template(
+                context + [{"role": "user", "content": item["prompt"]}], tokenize=False, add_generation_prompt=True
+            )
+            sequences.append(tokenizer(text, add_special_tokens=False)["input_ids"])
+        except Exception as e:
+            emit({"type": "error", "id": item["id"], "error": str(e)})
+            done += 1
+            continue
+        valid.append(item)
+    prompts = valid
+
+    for batch in length_buckets([len(ids) for ids in sequences], max_new_tokens):
+        if cancelled.is_set():
+            return
+        try:
+            batch_tokens = token_limit(username, max_new_tokens, len(batch))
+        except QuotaExceeded as e:
+            emit(quota_record(e))
+            return
+        batch_start = time.monotonic()
+        try:
+            results = _generate_batch(model, tokenizer, [sequences[index] for index in batch], batch_tokens)
+        except Exception as e:
+            # An over-long prompt, running out of memory or a generate() error fails this bucket only
+            logger.error(f"Batch bucket of {len(batch)} prompts failed for user={username}: {e}")
+            for index in batch:
+                emit({"type": "error", "id": prompts[index]["id"], "error": str(e)})
+            done += len(batch)
+            progress()
+            continue
+        prompt_tokens = sum(len(sequences[index]) for index in batch)
+        completion_tokens = sum(count for _, count in results)
+        usage_tracker.record(username, setting.modelName, prompt_tokens, completion_tokens, time.monotonic() - batch_start, requests=len(batch))
+        metrics.observe("batch_size", len(batch))
+        metrics.incr("batch_prompts", len(batch))
+
+        for index, (text, count) in zip(batch, results):
+            emit({
+                "type": "result", "id": prompts[index]["id"], "response": text,
+                "prompt_tokens": len(sequences[index]), "completion_tokens": count,
+            })
+        done      += len(batch)
+        generated += completion_tokens
+        progress()
+
+
+def run_remote(setting: Setting, context: list, prompts: list, max_new_tokens: int, username: str, emit, cancelled: threading.Event):
+    backend = f"{setting.domainName}:{setting.modelName}"
+    context_tokens = sum(len(message["content"] or "") for message in context) // 4
+
+    exhausted = threading.Event()
+
+    def complete(item):
+        if cancelled.is_set() or exhausted.is_set():
+            return None
+        try:
+            # Prompts in flight share what is left of the quota
+            item_tokens = token_limit(username, max_new_tokens, REMOTE_CONCURRENCY)
+        except QuotaExceeded:
+            exhausted.set()
+            raise
+        item_start = time.monotonic()
+        text = llm.complete(setting, context + [{"role": "user", "content": item["prompt"]}], item_tokens, lane=BULK)
+        # Same ~4 chars per token estimate as interactive remote turns
+        prompt_tokens, completion_tokens = context_tokens + len(item["prompt"]) // 4, len(text) // 4
+        usage_tracker.record(username, backend, prompt_tokens, completion_tokens, time.monotonic() - item_start)
+        return text, prompt_tokens, completion_tokens
+
+    start, done, quota_reported = time.monotonic(), 0, False
+    with ThreadPoolExecutor(max_workers=REMOTE_CONCURRENCY, thread_name_prefix="batch-remote") as pool:
+        futures = {pool.submit(complete, item): item for item in prompts}
+        for future in as_completed(futures):
+            item = futures[future]
+            if future.cancelled():
+                continue
+            try:
+                result = future.result()
+            except QuotaExceeded as e:
+                # Reported once; prompts not started yet are dropped, the ones in flight still finish
+                if not quota_reported:
+                    quota_reported = True
+                    for pending in futures:
+                        pending.cancel()
+                    emit(quota_record(e))
+                continue
+            except Exception as e:
+                emit({"type": "error", "id": item["id"], "error": str(e)})
+            else:
+                if result is None:
+                    continue
+                text, prompt_tokens, completion_tokens = result
+                emit({
+                    "type": "result", "id": item["id"], "response": text,
+                    "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                })
+            metrics.incr("batch_prompts")
+            done += 1
+            if done % PROGRESS_EVERY == 0 or done == len(prompts):
+                emit({"type": "progress", "done": done, "total": len(prompts), "elapsed": round(time.monotonic() - start, 2)})
+            if cancelled.is_set():
+                pool.shutdown(wait=False, cancel_futures=True)
+                return
+
+
+def run_batch(
+    db, username: str, prompts: list, room_id: str | None = None, max_new_tokens: int | None = None,
+    token_budget: int | None = None,
+):
+    """Yield output records for prompts as they complete, ending with a summary record.
+
+    token_budget is what was left of the user's quota when the batch was admitted.
+
+    Closing the generator early stops the batch after the generate() call in flight.
+    """
+    setting = user_setting(db, username)
+    if setting is None or not (setting.isLocal or setting.isApi):
+        raise ValueError("No local model or API configured")
+    context = context_messages(db, setting, room_id)
+    limit   = llm.max_new_tokens_for(setting)
+    max_new_tokens = min(max_new_tokens, limit) if max_new_tokens else limit
+    if token_budget is not None:
+        max_new_tokens = max(1, min(max_new_tokens, token_budget))
+
+    results   = queue.Queue()
+    cancelled = threading.Event()
+    finished  = object()
+    runner    = run_local if setting.isLocal else run_remote
+
+    def job():
+        try:
+            runner(setting, context, prompts, max_new_tokens, username, results.put, cancelled)
+        except Exception as e:
+            logger.exception(f"Batch for user={username} failed")
+            results.put({"type": "error", "id": None, "error": str(e)})
+        finally:
+            results.put(finished)
+
+    start = time.monotonic()
+    logger.info(f"Batch started: user={username}, prompts={len(prompts)}, room={room_id}, max_new_tokens={max_new_tokens}")
+    if setting.isLocal:
+        # A queued batch waits in the bulk lane, so interactive turns are never stuck behind it
+        generation_scheduler.submit(BULK, job)
+    else:
+        threading.Thread(target=job, name="batch", daemon=True).start()
+
+    answered, failed, completion_tokens = 0, 0, 0
+    try:
+        while True:
+            record = results.get()
+            if record is finished:
+                break
+            if record["type"] == "result":
+                answered += 1
+                completion_tokens += record["completion_tokens"]
+            elif record["type"] == "error":
+                failed += 1
+            yield record
+    finally:
+        cancelled.set()
+
+    elapsed = time.monotonic() - start
+    logger.info(f"Batch finished: user={username}, answered={answered}, failed={failed}, elapsed={elapsed:.1f}s")
+    yield {
+        "type": "summary", "total": len(prompts), "answered": answered, "failed": failed,
+        "completion_tokens": completion_tokens, "elapsed": round(elapsed, 2),
+        "prompts_per_sec": round(answered / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+
+
+def main():
+    from libs.db import SessionLocal, init_db
+
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of prompts in batches")
+    parser.add_argument("path", help="JSONL prompts, one {\"id\": ..., \"prompt\": ...} per line")
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--room", help="answer every prompt in the context of this room")
+    parser.add_argument("--max-new-tokens", type=int, default=None)
+    args = parser.parse_args()
+    if args.max_new_tokens is not None and args.max_new_tokens < 1:
+        parser.error("--max-new-tokens must be at least 1")
+
+    init_db()
+    db = SessionLocal()
+    try:
+        if db.get(UserAccount, args.user) is None:
+            parser.error(f"unknown user '{args.user}'")
+        with open(args.path, "r", encoding="utf-8") as f:
+            prompts = parse_prompts(f)
+        with open(args.out, "w", encoding="utf-8") as out:
+            for record in run_batch(db, args.user, prompts, args.room, args.max_new_tokens):
+                if record["type"] in ("progress", "summary"):
+                    print(json.dumps(record), file=sys.stderr, flush=True)
+                if record["type"] != "progress":
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    out.flush()
+    finally:
+        usage_tracker.flush().result()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
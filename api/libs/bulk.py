@@ -0,0 +1,404 @@
+"""Streaming bulk export and import of a user's settings, rooms, conversations and documents.
+
+The format is NDJSON, one record per line, in phase order:
+
+    {"type": "header", "version": 1, "username": ..., "cursor": ...}
+    {"type": "setting", ...}
+    {"type": "room", "id": ..., "roomName": ...}            followed by the room's archived turns
+    {"type": "conversation", "id": ..., "room_id": ..., "query": ..., "response": ..., ...}
+    {"type": "document", "id": ..., "fileName": ..., "size": ...}
+    {"type": "blob", "document": ..., "data": <base64>}     the document's bytes, in chunks
+    {"type": "checkpoint", "cursor": "conversations:12345"}
+
+Export reads in keyset-paginated batches, and archived turns one archive segment at a time.
+Import commits in batches of executemany inserts. Both therefore run in constant memory. An export can be restarted from any checkpoint cursor. An import
+records how many records it has committed under its import id; sending the same stream again
+with that id skips what is already in the DB. API keys are only exported with --include-secrets.
+
+    python -m libs.bulk export --user admin --out backup.ndjson [--resume] [--include-secrets]
+    python -m libs.bulk import --user admin --in backup.ndjson [--import-id ID]
+"""
+import argparse
+import base64
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from libs import metrics, room_stats
+from libs.archive import iter_archived_turns
+from libs.storage import ObjectNotFound, StorageDriver, document_key, document_storage, stored_key
+from schemas.models import SETTING_SECRET_FIELDS, BulkImport, ChatRoom, Conversation, Document, Message, Setting, UserAccount
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+FORMAT_VERSION  = 1
+BATCH_SIZE      = 1000
+BLOB_CHUNK_SIZE = 192 * 1024  # 256 KiB once base64-encoded
+PHASES          = ("setting", "rooms", "conversations", "documents")
+
+# Rooms whose id is already taken by another user are re-keyed deterministically, so resumes agree
+IMPORT_NAMESPACE = uuid.UUID("6f1c2d64-3c1e-4a43-9d1b-8d0e3e1f7a52")
+
+SETTING_FIELDS = [column.name for column in Setting.__table__.columns if column.name != "id"]
+
+
+def _isoformat(value: datetime | None) -> str | None:
+    return value.isoformat() if value else None
+
+
+def parse_cursor(cursor: str | None) -> tuple:
+    """(phase index, last exported key) for a checkpoint cursor; (0, None) exports everything."""
+    if not cursor:
+        return 0, None
+    phase, _, after = cursor.partition(":")
+    if phase not in PHASES:
+        raise ValueError(f"Invalid export cursor '{cursor}'")
+    if phase == "rooms" and after:
+        uuid.UUID(after)
+    elif phase in ("conversations", "documents") and after:
+        int(after)
+    return PHASES.index(phase), after or None
+
+
+def _conversation_record(conv_id, room_id, query, response, timestamp, sender, rating) -> dict:
+    return {
+        "type": "conversation",
+        "id": conv_id,
+        "room_id": str(room_id),
+        "query": query,
+        "response": response,
+        "timestamp": _isoformat(timestamp),
+        "senderUsername": sender,
+        "rating": rating,
+    }
+
+
+def export_records(
+    db: Session, username: str, cursor: str | None = None, storage: StorageDriver = document_storage,
+    include_secrets: bool = False,
+):
+    """Yield the export records for username, starting after cursor; API keys only with include_secrets."""
+    start, after = parse_cursor(cursor)
+    yield {"type": "header", "version": FORMAT_VERSION, "username": username, "exportedAt": _isoformat(datetime.utcnow()), "cursor": cursor}
+
+    if start <= PHASES.index("setting"):
+        user = db.get(UserAccount, username)
+        setting = db.get(Setting, user.setting_id) if user is not None and user.setting_id else None
+        if setting is not None:
+            fields = [field for field in SETTING_FIELDS if include_secrets or field not in SETTING_SECRET_FIELDS]
+            yield {"type": "setting", **{field: getattr(setting, field) for field in fields}}
+        yield {"type": "checkpoint", "cursor": "rooms:"}
+
+    if start <= PHASES.index("rooms"):
+        query = db.query(ChatRoom.id, ChatRoom.roomName).filter(ChatRoom.username == username)
+        if start == PHASES.index("rooms") and after:
+            query = query.filter(ChatRoom.id > uuid.UUID(after))
+        for room_id, room_name in query.order_by(ChatRoom.id).all():
+            yield {"type": "room", "id": str(room_id), "roomName": room_name}
+            for turn in iter_archived_turns(db, room_id):
+                yield _conversation_record(
+                    turn.id, room_id, turn.query, turn.responseMessage, turn.timestamp, turn.senderUsername, turn.rating
+                )
+            yield {"type": "checkpoint", "cursor": f"rooms:{room_id}"}
+        yield {"type": "checkpoint", "cursor": "conversations:"}
+
+    if start <= PHASES.index("conversations"):
+        last_id = int(after) if start == PHASES.index("conversations") and after else 0
+        while True:
+            # Column tuples rather than entities keep the identity map from growing with the export
+            rows = (
+                db.query(
+                    Conversation.id, Conversation.chatRoom_id, Conversation.query, Conversation.responseMessage,
+                    Conversation.timestamp, Message.senderUsername, Message.rating,
+                )
+                .join(ChatRoom, ChatRoom.id == Conversation.chatRoom_id)
+                .outerjoin(Message, Message.conversation_id == Conversation.id)
+                .filter(ChatRoom.username == username, Conversation.id > last_id)
+                .order_by(Conversation.id)
+                .limit(BATCH_SIZE)
+                .all()
+            )
+            if not rows:
+                break
+            for row in rows:
+                if row[0] == last_id:
+                    continue  # a second Message row for the same conversation
+                last_id = row[0]
+                yield _conversation_record(*row)
+            yield {"type": "checkpoint", "cursor": f"conversations:{last_id}"}
+        yield {"type": "checkpoint", "cursor": "documents:"}
+
+    query = db.query(Document.id, Document.fileName, Document.filePath).filter(Document.username == username)
+    if start == PHASES.index("documents") and after:
+        query = query.filter(Document.id > int(after))
+    for doc_id, file_name, file_path in query.order_by(Document.id).all():
+        try:
+            key  = stored_key(file_path)
+            size = storage.stat(key)["size"]
+        except ObjectNotFound:
+            logger.warning(f"Skipping document {doc_id} in export, object is missing: {file_path}")
+            continue
+        yield {"type": "document", "id": doc_id, "fileName": file_name, "size": size}
+        for chunk in storage.stream(key, chunk_size=BLOB_CHUNK_SIZE):
+            yield {"type": "blob", "document": doc_id, "data": base64.b64encode(chunk).decode("ascii")}
+        yield {"type": "checkpoint", "cursor": f"documents:{doc_id}"}
+
+
+def export_ndjson(
+    db: Session, username: str, cursor: str | None = None, storage: StorageDriver = document_storage,
+    include_secrets: bool = False,
+):
+    exported = 0
+    for record in export_records(db, username, cursor, storage, include_secrets):
+        exported += 1
+        yield json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+    metrics.incr("bulk_records_exported", exported)
+
+
+class Importer:
+    """Applies export records to one user's account in batched transactions.
+
+    Records must be fed in stream order. Conversations are buffered and written with executemany
+    every BATCH_SIZE records; document bytes go straight to disk. Each commit also stores the
+    number of records consumed so far in the BulkImport row, which is what a resume skips.
+    """
+
+    def __init__(self, db: Session, username: str, import_id: str | None = None, storage: StorageDriver = document_storage):
+        self.db           = db
+        self.username     = username
+        self.storage      = storage
+        self.checkpoint   = db.get(BulkImport, import_id) if import_id else None
+        if self.checkpoint is None:
+            self.checkpoint = BulkImport(id=import_id or uuid.uuid4().hex, username=username, records=0, status="running")
+            db.add(self.checkpoint)
+            db.commit()
+        elif self.checkpoint.username != username:
+            raise ValueError(f"Import '{import_id}' belongs to another user")
+        self.import_id = self.checkpoint.id
+        self.skip      = self.checkpoint.records
+        self.seen      = 0
+        self.counts    = defaultdict(int)
+        self.room_ids  = {}
+        self.rooms     = set()
+        self.pending   = []
+        self.document  = None
+        self.started   = time.monotonic()
+
+    def feed_lines(self, lines: list):
+        for line in lines:
+            self.feed(line)
+
+    def feed(self, line):
+        if not line.strip():
+            return
+        record = json.loads(line)
+        if not isinstance(record, dict) or "type" not in record:
+            raise ValueError(f"Record {self.seen + 1} has no type")
+        self.seen += 1
+        if self.seen <= self.skip:
+            self.counts["skipped"] += 1
+            return
+        handler = getattr(self, f"_import_{record['type']}", None)
+        if handler is not None:
+            handler(record)
+        if len(self.pending) >= BATCH_SIZE and self.document is None:
+            self.commit()
+
+    def finish(self, lines: list = ()) -> dict:
+        self.feed_lines(lines)
+        if self.document is not None:
+            raise ValueError(f"Import stream ended inside document '{self.document['name']}'")
+        self.checkpoint.status = "done"
+        self.commit()
+        elapsed = time.monotonic() - self.started
+        logger.info(f"Import {self.import_id} for {self.username} finished in {elapsed:.1f}s: {dict(self.counts)}")
+        return {"import_id": self.import_id, "records": self.seen, **self.counts}
+
+    def commit(self):
+        """Write buffered rows and advance the checkpoint; only called between documents."""
+        self.db.flush()
+        if self.pending:
+            ids = self.db.execute(
+                insert(Conversation).returning(Conversation.id, sort_by_parameter_order=True),
+                [{key: row[key] for key in ("chatRoom_id", "query", "responseMessage", "timestamp")} for row in self.pending],
+            ).scalars().all()
+            # Imported turns are attributed to the importing user, who owns the rooms
+            messages = [
+                {"conversation_id": conv_id, "senderUsername": self.username, "rating": row["rating"]}
+                for conv_id, row in zip(ids, self.pending)
+                if row["hasMessage"]
+            ]
+            if messages:
+                self.db.execute(insert(Message), messages)
+            room_stats.record_imported(self.db, self.pending)
+            self.counts["conversations"] += len(self.pending)
+            metrics.incr("bulk_conversations_imported", len(self.pending))
+            self.pending = []
+        self.checkpoint.records   = self.seen
+        self.checkpoint.updatedAt = datetime.utcnow()
+        self.db.commit()
+
+    def _room_id(self, exported_id: str) -> uuid.UUID | None:
+        if exported_id not in self.room_ids:
+            room_id = uuid.UUID(exported_id)
+            owner = self.db.query(ChatRoom.username).filter(ChatRoom.id == room_id).scalar()
+            if owner is not None and owner != self.username:
+                room_id = uuid.uuid5(IMPORT_NAMESPACE, f"{self.username}:{exported_id}")
+            self.room_ids[exported_id] = room_id
+        return self.room_ids[exported_id]
+
+    def _room_name(self, room_id: uuid.UUID, name: str) -> str:
+        # roomName is unique across all users
+        candidate, n = name, 1
+        while self.db.query(ChatRoom.id).filter(ChatRoom.roomName == candidate, ChatRoom.id != room_id).first():
+            candidate = f"{name} (imported{'' if n == 1 else f' {n}'})"
+            n += 1
+        return candidate
+
+    def _import_setting(self, record: dict):
+        user = self.db.get(UserAccount, self.username)
+        setting = self.db.get(Setting, user.setting_id) if user.setting_id else None
+        if setting is None:
+            setting = Setting()
+            self.db.add(setting)
+            self.db.flush()
+            user.setting_id = setting.id
+        for field in SETTING_FIELDS:
+            if field in record:
+                setattr(setting, field, record[field])
+        self.counts["settings"] += 1
+
+    def _import_room(self, record: dict):
+        room_id = self._room_id(record["id"])
+        if self.db.get(ChatRoom, room_id) is None:
+            self.db.add(ChatRoom(id=room_id, roomName=self._room_name(room_id, record["roomName"]), username=self.username))
+            self.db.flush()
+            self.counts["rooms"] += 1
+        self.rooms.add(room_id)
+
+    def _import_conversation(self, record: dict):
+        room_id = self._room_id(record["room_id"])
+        if room_id not in self.rooms and self.db.get(ChatRoom, room_id) is None:
+            self.counts["orphaned"] += 1
+            return
+        self.rooms.add(room_id)
+        self.pending.append({
+            "chatRoom_id": room_id,
+            "query": record["query"],
+            "responseMessage": record.get("response") or "",
+            "timestamp": datetime.fromisoformat(record["timestamp"]) if record.get("timestamp") else datetime.utcnow(),
+            "rating": record.get("rating"),
+            "hasMessage": record.get("senderUsername") is not None,
+        })
+
+    def _import_document(self, record: dict):
+        if self.pending:
+            self.commit()
+        name = os.path.basename(record["fileName"])
+        exists = (
+            self.db.query(Document.id)
+            .filter(Document.username == self.username, Document.fileName == name)
+            .first()
+        )
+        # Blob chunks are spooled to a local temp file and handed to the storage driver in one put
+        self.document = {
+            "name": name,
+            "key": document_key(self.username, name),
+            "remaining": int(record.get("size") or 0),
+            "file": None if exists else tempfile.TemporaryFile(),
+        }
+        if self.document["remaining"] <= 0:
+            self._finish_document()
+
+    def _import_blob(self, record: dict):
+        if self.document is None:
+            raise ValueError(f"Record {self.seen} is a blob outside of a document")
+        data = base64.b64decode(record["data"])
+        if self.document["file"] is not None:
+            self.document["file"].write(data)
+        self.document["remaining"] -= len(data)
+        if self.document["remaining"] <= 0:
+            self._finish_document()
+
+    def _finish_document(self):
+        document, self.document = self.document, None
+        if document["file"] is None:
+            self.counts["documents_skipped"] += 1
+        else:
+            with document["file"] as f:
+                size = f.tell()
+                f.seek(0)
+                self.storage.put(document["key"], f, size)
+            self.db.add(Document(username=self.username, fileName=document["name"], filePath=document["key"]))
+            self.counts["documents"] += 1
+        self.commit()
+
+
+def _resume_cursor(path: str) -> str | None:
+    """Last checkpoint cursor in a partial export file, truncating anything written after it."""
+    cursor, keep = None, 0
+    with open(path, "rb") as f:
+        offset = 0
+        for line in f:
+            offset += len(line)
+            if not line.endswith(b"\n"):
+                break
+            if b'"type": "checkpoint"' in line:
+                cursor, keep = json.loads(line)["cursor"], offset
+    with open(path, "r+b") as f:
+        f.truncate(keep)
+    return cursor
+
+
+def main():
+    from libs.db import SessionLocal, init_db
+
+    parser = argparse.ArgumentParser(description="Bulk export/import of a user's rooms, history, settings and documents")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export")
+    export_parser.add_argument("--user", required=True)
+    export_parser.add_argument("--out", required=True)
+    export_parser.add_argument("--resume", action="store_true", help="continue a partial export file from its last checkpoint")
+    export_parser.add_argument("--include-secrets", action="store_true", help="also export the setting's API keys, in plaintext")
+    import_parser = commands.add_parser("import")
+    import_parser.add_argument("--user", required=True)
+    import_parser.add_argument("--in", dest="path", required=True)
+    import_parser.add_argument("--import-id", help="resume an earlier import of the same file")
+    args = parser.parse_args()
+
+    init_db()
+    db = SessionLocal()
+    try:
+        if db.get(UserAccount, args.user) is None:
+            parser.error(f"unknown user '{args.user}'")
+        start = time.monotonic()
+        if args.command == "export":
+            cursor = _resume_cursor(args.out) if args.resume and os.path.exists(args.out) else None
+            lines = 0
+            with open(args.out, "ab" if cursor else "wb") as out:
+                for line in export_ndjson(db, args.user, cursor, include_secrets=args.include_secrets):
+                    out.write(line)
+                    lines += 1
+            print(json.dumps({"records": lines, "resumed_from": cursor, "seconds": round(time.monotonic() - start, 2)}))
+        else:
+            importer = Importer(db, args.user, args.import_id)
+            print(f"Import id: {importer.import_id}", flush=True)
+            with open(args.path, "rb") as f:
+                for line in f:
+                    importer.feed(line)
+            summary = importer.finish()
+            print(json.dumps({**summary, "seconds": round(time.monotonic() - start, 2)}))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
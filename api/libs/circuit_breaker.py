@@ -0,0 +1,129 @@
+"""Per-backend circuit breakers for remote LLM calls.
+
+A breaker tracks recent outcomes over a sliding window. When enough calls have been seen and
+either the error rate or the share of slow calls crosses its threshold, the breaker opens and
+calls fail immediately with CircuitOpenError instead of waiting on a degraded backend. After
+OPEN_SECONDS it lets a single probe through (half-open); the probe's outcome closes it again
+or re-opens it.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from libs import metrics
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+CLOSED    = "closed"
+OPEN      = "open"
+HALF_OPEN = "half_open"
+
+WINDOW_SECONDS    = 60.0
+MIN_CALLS         = 5
+ERROR_RATE        = 0.5
+SLOW_CALL_SECONDS = 10.0
+SLOW_CALL_RATE    = 0.8
+OPEN_SECONDS      = 30.0
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, backend: str, retry_after: float):
+        super().__init__(f"Backend '{backend}' is temporarily unavailable, retry in {retry_after:.0f}s")
+        self.backend     = backend
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        window_seconds: float = WINDOW_SECONDS,
+        min_calls: int = MIN_CALLS,
+        error_rate: float = ERROR_RATE,
+        slow_call_seconds: float = SLOW_CALL_SECONDS,
+        slow_call_rate: float = SLOW_CALL_RATE,
+        open_seconds: float = OPEN_SECONDS,
+    ):
+        self.name              = name
+        self.window_seconds    = window_seconds
+        self.min_calls         = min_calls
+        self.error_rate        = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate    = slow_call_rate
+        self.open_seconds      = open_seconds
+        self.state     = CLOSED
+        self.opened_at = None
+        self.outcomes  = deque()  # (timestamp, ok, latency)
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self._publish_state()
+
+    def _publish_state(self):
+        metrics.set_gauge("circuit_state", self.state, backend=self.name)
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        logger.warning(f"Circuit breaker '{self.name}': {self.state} -> {state}")
+        self.state = state
+        self.opened_at = time.monotonic() if state == OPEN else None
+        metrics.incr("circuit_transitions", backend=self.name, state=state)
+        self._publish_state()
+
+    def allow(self):
+        """Raise CircuitOpenError unless a call may go to this backend now."""
+        with self._lock:
+            if self.state == OPEN:
+                waited = time.monotonic() - self.opened_at
+                if waited < self.open_seconds:
+                    metrics.incr("circuit_rejections", backend=self.name)
+                    raise CircuitOpenError(self.name, self.open_seconds - waited)
+                self._transition(HALF_OPEN)
+
+            if self.state == HALF_OPEN:
+                if self._probe_in_flight:
+                    metrics.incr("circuit_rejections", backend=self.name)
+                    raise CircuitOpenError(self.name, self.open_seconds)
+                self._probe_in_flight = True
+
+    def release(self):
+        """Give back a half-open probe slot for a call that was abandoned without an outcome."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record(self, ok: bool, latency: float):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+                slow = latency >= self.slow_call_seconds
+                self.outcomes.clear()
+                self._transition(CLOSED if ok and not slow else OPEN)
+                return
+
+            self.outcomes.append((now, ok, latency))
+            while self.outcomes and now - self.outcomes[0][0] > self.window_seconds:
+                self.outcomes.popleft()
+            if self.state != CLOSED or len(self.outcomes) < self.min_calls:
+                return
+
+            calls    = len(self.outcomes)
+            failures = sum(1 for _, ok, _ in self.outcomes if not ok)
+            slow     = sum(1 for _, _, latency in self.outcomes if latency >= self.slow_call_seconds)
+            if failures / calls >= self.error_rate or slow / calls >= self.slow_call_rate:
+                self.outcomes.clear()
+                self._transition(OPEN)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
@@ -0,0 +1,174 @@
+"""Background summarization of long rooms.
+
+Once the turns a room replays into every prompt grow past COMPACT_TOKEN_THRESHOLD, older turns
+are folded into a RoomSummary with the configured model and prompt assembly switches to
+summary + recent turns. Compaction is incremental: each pass summarizes only the turns after
+the summary's upToConversationId, together with the previous summary. The worker is a single
+low-priority thread that only runs while no interactive generation has been active for
+IDLE_SECONDS, and re-checks that before every room. The summary itself is generated in the
+background lane (libs/scheduler.py), so it still pauses at a token boundary if a chat turn starts.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from libs import llm, metrics
+from libs.db import SessionLocal
+from libs.prompt_cache import conversation_messages
+from libs.scheduler import BACKGROUND, INTERACTIVE, generation_scheduler
+from schemas.models import RoomSummary
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+COMPACT_TOKEN_THRESHOLD = 3000  # estimated tokens of replayed history before a room is compacted
+KEEP_RECENT_TURNS       = 6     # turns always replayed verbatim after the summary
+IDLE_SECONDS            = 30.0  # quiet time required since the last interactive generation
+SUMMARY_MAX_TOKENS      = 512
+WORKER_NICENESS         = 19
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a chat between a user and an assistant. "
+    "Merge the previous summary and the new turns into one concise summary that keeps names, "
+    "facts, decisions, open questions and user preferences needed to continue the conversation. "
+    "Reply with the summary only."
+)
+
+
+def estimate_tokens(text: str | None) -> int:
+    # Rough chars/4 estimate; good enough to decide when to compact without loading a tokenizer
+    return len(text or "") // 4
+
+
+def history_tokens(summary: RoomSummary | None, conversations: list) -> int:
+    total = estimate_tokens(summary.summary) if summary is not None else 0
+    for conv in conversations:
+        total += estimate_tokens(conv.query) + estimate_tokens(conv.responseMessage)
+    return total
+
+
+def summary_messages(previous: str | None, conversations: list) -> list:
+    lines = []
+    for conv in conversations:
+        for message in conversation_messages(conv):
+            lines.append(f"{message['role'].capitalize()}: {message['content']}")
+    content = f"Previous summary:\n{previous or '(none)'}\n\nNew turns:\n" + "\n\n".join(lines)
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": content},
+    ]
+
+
+def compact_room(room_id: str) -> bool:
+    """Fold the room's older unsummarized turns into its summary. Returns True if it changed."""
+    db = SessionLocal()
+    try:
+        setting = llm.load_setting(db)
+        if setting is None or not (setting.isLocal or setting.isApi):
+            return False
+
+        summary       = llm.load_summary(db, room_id)
+        conversations = llm.load_history(db, room_id, summary.upToConversationId if summary else None)
+        if history_tokens(summary, conversations) < COMPACT_TOKEN_THRESHOLD:
+            return False
+        older = conversations[:-KEEP_RECENT_TURNS]
+        if not older:
+            return False
+
+        start = time.monotonic()
+        text  = llm.complete(
+            setting,
+            summary_messages(summary.summary if summary else None, older),
+            max_new_tokens=SUMMARY_MAX_TOKENS,
+            lane=BACKGROUND,
+        )
+        if not text:
+            logger.warning(f"Empty summary for room {room_id}, keeping full history")
+            return False
+
+        if summary is None:
+            summary = RoomSummary(chatRoom_id=uuid.UUID(room_id))
+            db.add(summary)
+        summary.summary            = text
+        summary.upToConversationId = older[-1].id
+        summary.tokenCount         = estimate_tokens(text)
+        db.commit()
+
+        metrics.incr("rooms_compacted")
+        metrics.incr("turns_summarized", len(older))
+        metrics.observe("compaction_seconds", time.monotonic() - start)
+        logger.info(f"Compacted room {room_id}: {len(older)} turns up to conversation {older[-1].id}")
+        return True
+    finally:
+        db.close()
+
+
+class CompactionWorker:
+    def __init__(self, idle_seconds: float = IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self._queue   = queue.Queue()
+        self._pending = set()
+        self._lock    = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread  = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="compaction", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stopped.set()
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def schedule(self, room_id: str):
+        """Queue a room for a compaction check; a room already waiting is not queued twice."""
+        with self._lock:
+            if room_id in self._pending:
+                return
+            self._pending.add(room_id)
+        self._queue.put(room_id)
+        metrics.set_gauge("compaction_queue", len(self._pending))
+
+    def _lower_priority(self):
+        # Linux applies nice values per thread, so this leaves the request threads untouched
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), WORKER_NICENESS)
+        except (AttributeError, OSError) as e:
+            logger.debug(f"Could not lower compaction worker priority: {e}")
+
+    def _wait_for_idle(self) -> bool:
+        while not self._stopped.is_set():
+            idle = generation_scheduler.idle_seconds(INTERACTIVE)
+            if idle >= self.idle_seconds:
+                return True
+            self._stopped.wait(max(1.0, self.idle_seconds - idle))
+        return False
+
+    def _run(self):
+        self._lower_priority()
+        while not self._stopped.is_set():
+            room_id = self._queue.get()
+            if room_id is None:
+                continue
+            if not self._wait_for_idle():
+                return
+            with self._lock:
+                self._pending.discard(room_id)
+            metrics.set_gauge("compaction_queue", len(self._pending))
+            try:
+                compact_room(room_id)
+            except Exception as e:
+                metrics.incr("compaction_errors")
+                logger.exception(f"Compaction failed for room {room_id}: {e}")
+
+
+compaction_worker = CompactionWorker()
@@ -0,0 +1,139 @@
+"""Response compression shared by the static UI assets and the JSON API.
+
+Brotli is used when the optional `brotli` package is installed and the client accepts it,
+gzip otherwise. CompressionMiddleware only compresses JSON: complete bodies of at least
+MIN_COMPRESS_SIZE bytes, and streamed JSON such as chat history and document lists. A stream
+is flushed after every chunk, so each one still reaches the client as soon as it is written.
+NDJSON streams (bulk export, batch results), document content and anything already encoded
+pass through untouched.
+"""
+import asyncio
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_SIZE    = 1024
+THREAD_COMPRESS_SIZE = 128 * 1024  # larger bodies are compressed off the event loop
+GZIP_LEVEL           = 6           # dynamic responses; static assets use the maximum levels
+BROTLI_QUALITY       = 5
+COMPRESSIBLE_TYPES   = ("application/json",)
+
+
+def supported_encodings() -> tuple:
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding: str | None) -> str | None:
+    """The preferred encoding the client accepts, or None for identity."""
+    accepted = set()
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip())
+    for encoding in supported_encodings():
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str, best: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if best else BROTLI_QUALITY)
+    # mtime=0 keeps the output identical for identical input, so ETags of static variants are stable
+    return gzip.compress(body, compresslevel=9 if best else GZIP_LEVEL, mtime=0)
+
+
+def stream_compressor(encoding: str):
+    """(compress_chunk, finish) pair for compressing a body that arrives in pieces."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return (lambda data: compressor.process(data) + compressor.flush()), (lambda data: compressor.process(data) + compressor.finish())
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return (lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)), (lambda data: compressor.compress(data) + compressor.flush())
+
+
+def _encoded_headers(headers: list, encoding: str, length: int | None) -> list:
+    vary = [value for name, value in headers if name.lower() == b"vary"]
+    encoded = [(name, value) for name, value in headers if name.lower() not in (b"content-length", b"vary")]
+    encoded += [(b"content-encoding", encoding.encode("latin-1")), (b"vary", b", ".join(vary + [b"Accept-Encoding"]))]
+    if length is not None:
+        encoded.append((b"content-length", str(length).encode("latin-1")))
+    return encoded
+
+
+async def _run(fn, body: bytes) -> bytes:
+    # Compressing large bodies inline would stall every other request on the event loop
+    if len(body) >= THREAD_COMPRESS_SIZE:
+        return await asyncio.to_thread(fn, body)
+    return fn(body)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = MIN_COMPRESS_SIZE):
+        self.app          = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers  = dict(scope["headers"])
+        encoding = negotiate(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start  = None
+        stream = None
+
+        async def send_compressed(message):
+            nonlocal start, stream
+            if message["type"] == "http.response.start":
+                response_headers = {name.lower(): value for name, value in message.get("headers", [])}
+                content_type = response_headers.get(b"content-type", b"").split(b";")[0].strip().decode("latin-1")
+                if (
+                    message["status"] == 200
+                    and content_type in COMPRESSIBLE_TYPES
+                    and b"content-encoding" not in response_headers
+                ):
+                    # Hold the start message until the body shows whether it is worth compressing
+                    start = message
+                    return
+                await send(message)
+                return
+
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body      = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if stream is not None:
+                compress_chunk, finish = stream
+                chunk = await _run(compress_chunk if more_body else finish, body)
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+                return
+            if start is None:
+                await send(message)
+                return
+
+            held, start = start, None
+            if more_body:
+                stream = stream_compressor(encoding)
+                await send(dict(held, headers=_encoded_headers(held.get("headers", []), encoding, None)))
+                await send({"type": "http.response.body", "body": await _run(stream[0], body), "more_body": True})
+                return
+            if len(body) < self.minimum_size:
+                await send(held)
+                await send(message)
+                return
+
+            compressed = await _run(lambda data: compress(data, encoding), body)
+            await send(dict(held, headers=_encoded_headers(held.get("headers", []), encoding, len(compressed))))
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
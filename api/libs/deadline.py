@@ -0,0 +1,28 @@
+import time
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    """End-to-end time budget for a chat turn, passed down to every blocking call it makes."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self):
+        if self.expired():
+            raise DeadlineExceeded(f"Turn exceeded its {self.seconds:.0f}s time budget")
+
+    def timeout(self, cap: float) -> float:
+        """Timeout for the next call: the smaller of cap and what is left of the budget."""
+        self.check()
+        return min(cap, self.remaining())
@@ -1,12 +1,20 @@
-import requests
 import logging
+import queue
+import threading
 import time
-import torch
 import uuid
+from collections import namedtuple
 from sqlalchemy.orm import Session
-from transformers import AutoTokenizer, AutoModelForCausalLM, TextIteratorStreamer
+from libs import metrics
+from libs.archive import load_archived_turns
 from libs.db import SessionLocal
-from schemas.models import Setting, Conversation, ChatRoom
+from libs.deadline import Deadline
+from libs.model_loader import load_model, apply_cpu_settings
+from libs.prompt_cache import build_input_ids, conversation_messages
+from libs.providers import get_provider, hedged_stream
+from libs.scheduler import BACKGROUND, INTERACTIVE, generation_scheduler, pause_criteria
+from libs.tracing import TurnTrace, snapshot_setting
+from schemas.models import Setting, Conversation, ChatRoom, RoomSummary
 
 # Initialize module logger (fall back to basicConfig only if no handlers configured)
 logger = logging.getLogger(__name__)
@@ -14,19 +22,269 @@ if not logging.getLogger().handlers:
     logging.basicConfig(level=logging.DEBUG)
 logger.debug("llm module initialized")
 
-# Global cache for the model and tokenizer
-model_cache = {}
+# Whether a (model, draft model) pair share a vocabulary, computed once per pair
+draft_compat_cache = {}
+
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+
+# Per-turn generation limit when the setting has no maxNewTokens
+DEFAULT_MAX_NEW_TOKENS = 1024
+
+StreamerResponse = namedtuple(
+    'StreamerResponse',
+    ['model', 'inputs', 'streamer', 'max_max_tokens', 'model_name', 'draft_model_name', 'max_new_tokens'],
+    defaults=(None, None, DEFAULT_MAX_NEW_TOKENS),
+)
+
+class RemoteStreamer:
+    """Iterator of text chunks fed by a remote provider, mirroring TextIteratorStreamer for ws_chat."""
+
+    _end = object()
+
+    def __init__(self):
+        self.queue = queue.Queue()
+
+    def put(self, text: str):
+        self.queue.put(text)
+
+    def end(self):
+        self.queue.put(self._end)
+
+    def fail(self, error: Exception):
+        self.queue.put(error)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = self.queue.get()
+        if item is self._end:
+            raise StopIteration
+        if isinstance(item, Exception):
+            raise item
+        return item
 
 def load_setting(db: Session):
     return db.query(Setting).first()
 
-def get_llm_response(room_id: str, prompt: str) -> str:
-    start_time = time.perf_counter()
+def max_new_tokens_for(setting: Setting, max_max_tokens: int | None = None) -> int:
+    limit = setting.maxNewTokens or DEFAULT_MAX_NEW_TOKENS
+    return min(limit, max_max_tokens) if max_max_tokens else limit
+
+def load_history(db: Session, room_id: str, after_id: int | None = None):
+    # Turns without a response are the in-flight turn itself (its query is the prompt) or aborted ones
+    room_uuid = uuid.UUID(room_id)
+    query = db.query(Conversation).filter(Conversation.chatRoom_id == room_uuid, Conversation.responseMessage != "")
+    if after_id is not None:
+        query = query.filter(Conversation.id > after_id)
+    # A room reopened after archival replays its archived turns ahead of the live ones
+    return load_archived_turns(db, room_uuid, after_id) + query.order_by(Conversation.timestamp).all()
+
+def load_summary(db: Session, room_id: str):
+    return db.query(RoomSummary).filter(RoomSummary.chatRoom_id == uuid.UUID(room_id)).first()
+
+def build_head_messages(setting: Setting, summary: RoomSummary | None) -> list:
+    content = setting.systemPrompt
+    if summary is not None:
+        content = "\n\n".join(part for part in (setting.systemPrompt, f"{SUMMARY_HEADER}\n{summary.summary}") if part)
+    return [{"role": "system", "content": content}]
+
+def load_prompt_context(db: Session, setting: Setting, room_id: str):
+    """Head messages plus the turns to replay: only those after the room's summary, if it has one."""
+    summary = load_summary(db, room_id)
+    head_messages = build_head_messages(setting, summary)
+    conversations = load_history(db, room_id, summary.upToConversationId if summary else None)
+    return head_messages, conversations
+
+def _generate_text(setting: Setting, messages: list, max_new_tokens: int, lane: str) -> str:
+    import torch
+    tokenizer, model = load_model(setting.modelName, setting.loadProfile, setting.compileModel)
+    text   = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    inputs = tokenizer(text, return_tensors="pt", add_special_tokens=False).to(model.device)
+    with torch.inference_mode():
+        output = model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            do_sample=False,
+            stopping_criteria=[pause_criteria(generation_scheduler, lane)],
+        )
+    return tokenizer.decode(output[0, inputs["input_ids"].shape[-1]:], skip_special_tokens=True).strip()
+
+def complete(setting: Setting, messages: list, max_new_tokens: int = 512, lane: str = BACKGROUND) -> str:
+    """Blocking, non-streaming completion with the configured model for non-interactive work.
+
+    Local generation runs on the lane's worker threads and pauses whenever a higher lane is generating.
+    """
+    if setting.isLocal:
+        return generation_scheduler.submit(lane, _generate_text, setting, messages, max_new_tokens, lane).result()
+
+    if setting.isApi:
+        provider = get_provider(setting.domainName, setting.modelName, setting.apiKey, setting.apiBase)
+        return "".join(provider.stream(messages, setting.temperature or 0.7, max_new_tokens)).strip()
+
+    raise ValueError("No local model or API configured")
+
+def remote_streamer_response(setting: Setting, messages: list) -> StreamerResponse:
+    provider    = get_provider(setting.domainName, setting.modelName, setting.apiKey, setting.apiBase)
+    temperature = setting.temperature or 0.7
+
+    def stream(max_new_tokens: int, deadline: Deadline | None = None):
+        primary = lambda: provider.stream(messages, temperature, max_new_tokens, deadline)
+        if not setting.hedgeDomainName:
+            return primary()
+        secondary_provider = get_provider(
+            setting.hedgeDomainName,
+            setting.hedgeModelName or setting.modelName,
+            setting.hedgeApiKey,
+            setting.hedgeApiBase,
+        )
+        secondary = lambda: secondary_provider.stream(messages, temperature, max_new_tokens, deadline)
+        return hedged_stream(primary, secondary, (setting.hedgeDelayMs or 1000) / 1000)
+
+    return StreamerResponse(
+        model=None,
+        inputs={"stream": stream, "messages": messages},
+        streamer=RemoteStreamer(),
+        max_max_tokens=None,
+        model_name=f"{setting.domainName}:{setting.modelName}",
+        max_new_tokens=max_new_tokens_for(setting),
+    )
+
+def load_draft_model(setting: Setting, tokenizer):
+    """Return the draft model for speculative decoding, or None to fall back to plain decoding."""
+    model_name       = setting.modelName
+    draft_model_name = setting.draftModelName
+    try:
+        draft_tokenizer, draft_model = load_model(draft_model_name, setting.loadProfile, setting.compileModel)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Failed to load draft model '{draft_model_name}', speculative decoding disabled: {e}")
+        return None
+
+    pair = (model_name, draft_model_name)
+    if pair not in draft_compat_cache:
+        # Verification compares token ids directly, so both models must share the same vocabulary
+        draft_compat_cache[pair] = draft_tokenizer.get_vocab() == tokenizer.get_vocab()
+    if not draft_compat_cache[pair]:
+        logger.warning(f"Draft model '{draft_model_name}' tokenizer does not match '{model_name}', speculative decoding disabled")
+        return None
+    return draft_model
+
+def _count_forward_calls(model, counter: dict, key: str):
+    # Only count forwards issued from the calling thread so concurrent rooms sharing a cached model don't skew stats
+    thread_id = threading.get_ident()
+
+    def hook(module, args, output):
+        if threading.get_ident() == thread_id:
+            counter[key] += 1
+
+    return model.register_forward_hook(hook)
+
+def run_remote_generation(streamer_response: StreamerResponse, max_new_tokens: int, deadline: Deadline | None = None) -> dict:
+    streamer = streamer_response.streamer
+    chunks   = 0
+    chars    = 0
+    start    = time.perf_counter()
+    first_chunk = None
+    try:
+        for text in streamer_response.inputs["stream"](max_new_tokens, deadline):
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - start
+            chunks += 1
+            chars  += len(text)
+            streamer.put(text)
+        streamer.end()
+    except Exception as e:
+        logger.error(f"Remote generation failed: model={streamer_response.model_name} error={e}")
+        streamer.fail(e)
+    elapsed = time.perf_counter() - start
+
+    labels = {"model": streamer_response.model_name, "draft": "none"}
+    metrics.incr("generated_chunks", chunks, **labels)
+    if first_chunk is not None:
+        metrics.observe("remote_first_chunk_seconds", first_chunk, **labels)
+    logger.info(f"Remote generation finished: model={streamer_response.model_name} chunks={chunks} elapsed={elapsed:.3f}s")
+    return {
+        "model": streamer_response.model_name,
+        "draft_model": None,
+        "new_tokens": chunks,
+        # Providers stream text without token counts, so usage is estimated at ~4 chars per token
+        "prompt_tokens": sum(len(m["content"] or "") for m in streamer_response.inputs["messages"]) // 4,
+        "completion_tokens": chars // 4,
+        "elapsed": elapsed,
+        "tokens_per_sec": chunks / elapsed if elapsed > 0 else 0.0,
+        "acceptance_rate": None,
+    }
+
+def run_generation(streamer_response: StreamerResponse, max_new_tokens: int, deadline: Deadline | None = None) -> dict:
+    """Run model.generate for a StreamerResponse and return throughput (and speculative acceptance) stats."""
+    if streamer_response.model is None:
+        # A remote turn uses no local CPU, so it does not hold back local background work
+        return run_remote_generation(streamer_response, max_new_tokens, deadline)
+    # Local chat turns run in the interactive lane; background and bulk generations pause while it is busy
+    with generation_scheduler.running(INTERACTIVE):
+        return run_local_generation(streamer_response, max_new_tokens, deadline)
+
+def run_local_generation(streamer_response: StreamerResponse, max_new_tokens: int, deadline: Deadline | None = None) -> dict:
+    inputs       = streamer_response.inputs
+    model        = streamer_response.model
+    draft_model  = inputs.get("assistant_model")
+    prompt_len   = inputs["input_ids"].shape[-1]
+    counter      = {"target": 0, "draft": 0}
+    hooks        = []
+    if draft_model is not None:
+        hooks.append(_count_forward_calls(model, counter, "target"))
+        hooks.append(_count_forward_calls(draft_model, counter, "draft"))
+
+    if deadline is not None:
+        # generate() stops at the next token boundary once max_time is spent
+        inputs = dict(inputs, max_time=deadline.remaining())
+
+    start = time.perf_counter()
+    try:
+        output = model.generate(**inputs, streamer=streamer_response.streamer, max_new_tokens=max_new_tokens, use_cache=True)
+    finally:
+        for hook in hooks:
+            hook.remove()
+    elapsed = time.perf_counter() - start
+
+    new_tokens = int(output.shape[-1] - prompt_len)
+    stats = {
+        "model": streamer_response.model_name,
+        "draft_model": streamer_response.draft_model_name if draft_model is not None else None,
+        "new_tokens": new_tokens,
+        "prompt_tokens": int(prompt_len),
+        "completion_tokens": new_tokens,
+        "elapsed": elapsed,
+        "tokens_per_sec": new_tokens / elapsed if elapsed > 0 else 0.0,
+        "acceptance_rate": None,
+    }
+    labels = {"model": stats["model"], "draft": stats["draft_model"] or "none"}
+    if draft_model is not None and counter["draft"]:
+        # Every verification pass of the target model emits one token of its own on top of the accepted draft tokens
+        accepted = max(0, new_tokens - counter["target"])
+        stats["acceptance_rate"] = min(1.0, accepted / counter["draft"])
+        metrics.incr("speculative_proposed_tokens", counter["draft"], **labels)
+        metrics.incr("speculative_accepted_tokens", accepted, **labels)
+        metrics.observe("speculative_acceptance_rate", stats["acceptance_rate"], **labels)
+
+    metrics.incr("generated_tokens", new_tokens, **labels)
+    metrics.observe("generation_tokens_per_sec", stats["tokens_per_sec"], **labels)
+    logger.info(
+        "Generation finished: model=%s draft=%s new_tokens=%d elapsed=%.3fs tokens/sec=%.2f acceptance_rate=%s",
+        stats["model"], stats["draft_model"], new_tokens, elapsed, stats["tokens_per_sec"],
+        f"{stats['acceptance_rate']:.3f}" if stats["acceptance_rate"] is not None else None,
+    )
+    return stats
+
+def get_llm_response(room_id: str, prompt: str, trace: TurnTrace | None = None) -> str:
     logger.debug(f"get_llm_response called; room_id={room_id} prompt (truncated)={(prompt or '')[:200]}")
+    # Stage timings and inputs for replay (libs/tracing.py); a throwaway trace when the caller keeps none
+    trace = trace if trace is not None else TurnTrace(room_id, prompt)
 
     db = SessionLocal()
     try:
-        setting = load_setting(db)
+        with trace.stage("load_setting"):
+            setting = load_setting(db)
         if not setting:
             logger.error("No setting found in DB")
             return "No setting found"
@@ -54,58 +312,50 @@ def get_llm_response(room_id: str, prompt: str) -> str:
             max_max_tokens = 2048  # maximum possible tokens (custom value, adjust as needed)
             
             try:
-                if setting.modelName not in model_cache:
-                    logger.info(f"Loading model {setting.modelName}...")
-                    try:
-                        tokenizer = AutoTokenizer.from_pretrained(setting.modelName)
-                        model     = AutoModelForCausalLM.from_pretrained(
-                            setting.modelName,
-                            device_map="auto",
-                            torch_dtype="auto"
-                        )
-                        model_cache[setting.modelName] = (tokenizer, model)
-                    except (OSError, ValueError) as e:
-                        logger.error(f"Failed to load user-specified model '{setting.modelName}': {e}")
-                        return f"Failed to load model '{setting.modelName}'. Please check the model name and try again."
-                else:
-                    logger.info(f"Using cached model {setting.modelName}")
-
-                tokenizer, model = model_cache[setting.modelName]
-
-                device = "cuda" if torch.cuda.is_available() else "cpu"
-                # Get history
-                room_uuid = uuid.UUID(room_id)
-                conversations = db.query(Conversation).filter(Conversation.chatRoom_id == room_uuid).order_by(Conversation.timestamp).all()
-
-                messages = []
-                
-                # system prompt
-                messages.append({
-                    "role": "system",
-                    "content":  setting.systemPrompt}
-                )
-                
-                for conv in conversations:
-                    messages.append({"role": "user", "content": conv.query})
-                    if conv.responseMessage:
-                        messages.append({"role": "assistant", "content": conv.responseMessage})
-
-                messages.append({"role": "user", "content": prompt})
+                apply_cpu_settings(setting.numThreads, setting.cpuAffinity)
+                try:
+                    with trace.stage("load_model"):
+                        tokenizer, model = load_model(setting.modelName, setting.loadProfile, setting.compileModel)
+                except (OSError, ValueError) as e:
+                    logger.error(f"Failed to load user-specified model '{setting.modelName}': {e}")
+                    return f"Failed to load model '{setting.modelName}'. Please check the model name and try again."
 
-                texts = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+                draft_model = None
+                if setting.draftModelName:
+                    with trace.stage("load_model"):
+                        draft_model = load_draft_model(setting, tokenizer)
 
-                inputs = tokenizer(text=texts, return_tensors="pt").to(device)
+                # system prompt (plus the room summary once older turns have been compacted)
+                with trace.stage("load_history"):
+                    head_messages, conversations = load_prompt_context(db, setting, room_id)
 
-                from collections import namedtuple
-                StreamerResponse = namedtuple('StreamerResponse', ['model', 'inputs', 'streamer', 'max_max_tokens'])
+                import torch
+                with trace.stage("build_prompt"):
+                    token_ids = build_input_ids(
+                        db, tokenizer, setting.modelName, setting.systemPrompt, head_messages, conversations, prompt
+                    )
+                input_ids = torch.tensor([token_ids], dtype=torch.long, device=model.device)
+                messages = list(head_messages)
+                for conv in conversations:
+                    messages.extend(conversation_messages(conv))
+                messages.append({"role": "user", "content": prompt})
+                trace.capture(
+                    backend="local",
+                    setting=snapshot_setting(setting),
+                    messages=messages,
+                    token_ids=token_ids,
+                    draft_model=setting.draftModelName if draft_model is not None else None,
+                )
 
+                from transformers import TextIteratorStreamer
                 streamer = TextIteratorStreamer(tokenizer, skip_special_tokens=True, skip_prompt=True)
 
                 # Only include the basic input tensors in generation_kwargs
                 generation_kwargs = {
-                    "input_ids": inputs["input_ids"],
-                    "attention_mask": inputs["attention_mask"] if "attention_mask" in inputs else None,
+                    "input_ids": input_ids,
+                    "attention_mask": torch.ones_like(input_ids),
                     "temperature": setting.temperature or 0.1,
+                    "assistant_model": draft_model,
                 }
                 # Remove None values from the dict
                 generation_kwargs = {k: v for k, v in generation_kwargs.items() if v is not None}
@@ -114,59 +364,29 @@ def get_llm_response(room_id: str, prompt: str) -> str:
                     model=model,
                     inputs=generation_kwargs,
                     streamer=streamer,
-                    max_max_tokens=max_max_tokens
+                    max_max_tokens=max_max_tokens,
+                    model_name=setting.modelName,
+                    draft_model_name=setting.draftModelName if draft_model is not None else None,
+                    max_new_tokens=max_new_tokens_for(setting, max_max_tokens),
                 )
             except Exception as e:
                 logger.exception("Failed to load local model or generate response")
                 return f"Error with local model: {e}"
 
-        elif setting.isApi and setting.domainName == "huggingface":
-            logger.debug("Using HuggingFace API: model=%s", setting.modelName)
-            url     = f"https://api-inference.huggingface.co/models/{setting.modelName}"
-            headers = {"Authorization": f"Bearer {setting.apiKey}"}
-
-            full_prompt = prompt
-            if setting.systemPrompt:
-                full_prompt = f"{setting.systemPrompt}\n\nUser: {prompt}"
-
-            payload = {
-                "inputs": full_prompt,
-                "parameters": {
-                    "max_new_tokens": 512,
-                    "temperature": setting.temperature or 0.7
-                }
-            }
-
-            try:
-                req_start   = time.perf_counter()
-                response    = requests.post(url, headers=headers, json=payload, timeout=60)
-                req_elapsed = time.perf_counter() - req_start
-                logger.debug("HuggingFace request completed in %.3fs; status=%s", req_elapsed, response.status_code)
-            except Exception as e:
-                logger.exception("HuggingFace request failed")
-                return f"HuggingFace request error: {e}"
-
-            if response.status_code != 200:
-                logger.error("HuggingFace API Error: status=%s text=%s", response.status_code, (response.text or "")[:500])
-                return f"HuggingFace API Error: {response.text}"
-
+        elif setting.isApi:
+            logger.debug("Using remote API: provider=%s model=%s hedge=%s", setting.domainName, setting.modelName, setting.hedgeDomainName)
+            with trace.stage("load_history"):
+                messages, conversations = load_prompt_context(db, setting, room_id)
+            with trace.stage("build_prompt"):
+                for conv in conversations:
+                    messages.extend(conversation_messages(conv))
+                messages.append({"role": "user", "content": prompt})
+            trace.capture(backend="remote", setting=snapshot_setting(setting), messages=messages)
             try:
-                data = response.json()
-            except Exception as e:
-                logger.exception("Failed to parse HuggingFace JSON response")
-                return f"HuggingFace JSON parse error: {e}"
-
-            logger.debug("HuggingFace response data (truncated)=%s", str(data)[:1000])
-
-            if isinstance(data, list) and len(data) > 0 and "generated_text" in data[0]:
-                result  = data[0]["generated_text"].replace(full_prompt, "").strip()
-                elapsed = time.perf_counter() - start_time
-                logger.debug("get_llm_response finished in %.3fs", elapsed)
-                return result
-            
-            if isinstance(data, dict) and "error" in data:
-                logger.error("HuggingFace API returned error field: %s", data.get("error"))
-                return f"HuggingFace API Error: {data['error']}"
+                return remote_streamer_response(setting, messages)
+            except ValueError as e:
+                logger.error(f"Invalid API provider setting: {e}")
+                return str(e)
     finally:
         try:
             db.close()
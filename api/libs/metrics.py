@@ -0,0 +1,49 @@
+import threading
+from collections import defaultdict
+
+# Minimal in-process metrics registry, exposed as JSON on /metrics
+_lock     = threading.Lock()
+_counters = defaultdict(float)
+_gauges   = {}
+_summaries = {}
+
+
+def _key(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    label_str = ",".join(f"{k}={labels[k]}" for k in sorted(labels))
+    return f"{name}{{{label_str}}}"
+
+
+def incr(name: str, value: float = 1.0, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def set_gauge(name: str, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name: str, value: float, **labels):
+    key = _key(name, labels)
+    with _lock:
+        summary = _summaries.get(key)
+        if summary is None:
+            summary = _summaries[key] = {"count": 0, "sum": 0.0, "min": value, "max": value}
+        summary["count"] += 1
+        summary["sum"]   += value
+        summary["min"]    = min(summary["min"], value)
+        summary["max"]    = max(summary["max"], value)
+
+
+def snapshot() -> dict:
+    with _lock:
+        summaries = {}
+        for key, s in _summaries.items():
+            summaries[key] = dict(s, avg=s["sum"] / s["count"] if s["count"] else 0.0)
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "summaries": summaries,
+        }
@@ -0,0 +1,224 @@
+import logging
+import os
+import shutil
+import threading
+import time
+
+# torch and transformers are imported inside the functions below so that workers
+# which never serve a local model (auth, documents, remote APIs) don't pay for them at startup
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+# Supported load profiles:
+#   auto - weights as stored in the checkpoint, placed with device_map="auto"
+#   bf16 - bfloat16 weights on CPU
+#   int8 - float32 weights on CPU with Linear layers dynamically quantized to int8
+LOAD_PROFILES = ("auto", "bf16", "int8")
+DEFAULT_LOAD_PROFILE = "auto"
+
+# Global cache for the model and tokenizer, keyed by (model name, profile, compiled)
+model_cache = {}
+
+# Local safetensors snapshots of loaded checkpoints; later loads mmap these instead of
+# resolving, converting and deserializing the original checkpoint again. Opt-in, since a
+# snapshot is a full copy of the weights on disk.
+SNAPSHOT_PATH = os.path.abspath(os.path.join("storage", "model-snapshots"))
+MODEL_SNAPSHOTS = os.environ.get("MODEL_SNAPSHOTS", "").lower() in ("1", "true", "yes")
+
+# Snapshot paths being written by a background thread
+_saving_snapshots = set()
+_saving_lock = threading.Lock()
+
+# Weight dtype each profile is loaded with before any post-processing (e.g. quantization)
+PROFILE_DTYPES = {"auto": "auto", "bf16": "bfloat16", "int8": "float32"}
+
+# CPU settings last applied to this process, so threads and torch are only reconfigured when they change
+_applied_cpu_settings = {}
+
+# Native ids of threads with a CPU list of their own (scheduler lanes), left alone by process-wide changes
+_own_affinity_threads = set()
+
+
+def profile_key(model_name: str, profile: str | None = None, compile_model: bool | None = None):
+    return (model_name, profile or DEFAULT_LOAD_PROFILE, bool(compile_model))
+
+
+def parse_cpu_list(cpu_list: str) -> set:
+    """Parse a taskset-style CPU list such as "0-3,8" into a set of CPU ids."""
+    cpus = set()
+    for part in cpu_list.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def set_process_affinity(cpus: set) -> int:
+    """Pin every thread of the process to cpus; returns the number of threads pinned.
+
+    On Linux sched_setaffinity(0, ...) only pins the calling thread. Threads started later
+    inherit the affinity of the thread that starts them, so threads already running (the
+    generation thread's parent, torch's intra-op pool, the lane pools) are pinned one by one.
+    """
+    try:
+        thread_ids = [int(tid) for tid in os.listdir("/proc/self/task")]
+    except OSError:
+        thread_ids = [0]
+    # Forget lane threads that have exited, their ids may be reused by new threads
+    _own_affinity_threads.intersection_update(thread_ids)
+    pinned = 0
+    for tid in thread_ids:
+        if tid in _own_affinity_threads:
+            continue
+        try:
+            os.sched_setaffinity(tid, cpus)
+            pinned += 1
+        except ProcessLookupError:
+            pass  # the thread exited meanwhile
+    return pinned
+
+
+def set_thread_affinity(cpus: set):
+    """Pin the calling thread to cpus, and keep it there when the process affinity changes."""
+    tid = threading.get_native_id()
+    os.sched_setaffinity(tid, cpus)
+    _own_affinity_threads.add(tid)
+
+
+def apply_cpu_settings(num_threads: int | None = None, cpu_affinity: str | None = None):
+    # Threads started after this inherit the affinity from the (already pinned) thread starting them
+    if cpu_affinity and _applied_cpu_settings.get("cpu_affinity") != cpu_affinity:
+        try:
+            pinned = set_process_affinity(parse_cpu_list(cpu_affinity))
+            _applied_cpu_settings["cpu_affinity"] = cpu_affinity
+            logger.info(f"CPU affinity set to {cpu_affinity} for {pinned} threads")
+        except (AttributeError, OSError, ValueError) as e:
+            logger.warning(f"Failed to set CPU affinity '{cpu_affinity}': {e}")
+
+    if num_threads and _applied_cpu_settings.get("num_threads") != num_threads:
+        import torch
+        torch.set_num_threads(num_threads)
+        _applied_cpu_settings["num_threads"] = num_threads
+        logger.info(f"Torch intra-op threads set to {num_threads}")
+
+
+def resolve_revision(model_name: str) -> str | None:
+    """Commit hash of the hub checkpoint model_name resolves to, None for local directories or when unknown."""
+    from transformers.utils import cached_file
+    from transformers.utils.hub import extract_commit_hash
+
+    try:
+        config_file = cached_file(model_name, "config.json", _raise_exceptions_for_missing_entries=False)
+    except Exception as e:
+        logger.warning(f"Failed to resolve the revision of {model_name}: {e}")
+        return None
+    return extract_commit_hash(config_file, None) if config_file else None
+
+
+def snapshot_path(model_name: str, profile: str, revision: str) -> str:
+    # Keyed by revision so an updated hub checkpoint gets a snapshot of its own
+    return os.path.join(SNAPSHOT_PATH, f"{model_name.replace('/', '--')}__{revision}__{PROFILE_DTYPES[profile]}")
+
+
+def _save_snapshot(model_name: str, path: str, tokenizer, model):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        os.makedirs(SNAPSHOT_PATH, exist_ok=True)
+        model.save_pretrained(tmp_path, safe_serialization=True)
+        tokenizer.save_pretrained(tmp_path)
+        # Publish atomically so a concurrent or interrupted save never leaves a half-written snapshot
+        os.replace(tmp_path, path)
+        logger.info(f"Saved model snapshot {path}")
+    except Exception as e:
+        logger.warning(f"Failed to save model snapshot for {model_name}: {e}")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    finally:
+        with _saving_lock:
+            _saving_snapshots.discard(path)
+
+
+def _save_snapshot_in_background(model_name: str, path: str, tokenizer, model):
+    """Write the snapshot off the request path; the loaded model is served meanwhile."""
+    with _saving_lock:
+        if path in _saving_snapshots:
+            return
+        _saving_snapshots.add(path)
+    # Not a daemon thread, so shutdown waits for the write instead of leaving a temporary directory behind
+    threading.Thread(
+        target=_save_snapshot, args=(model_name, path, tokenizer, model), name="model-snapshot"
+    ).start()
+
+
+def _load_weights(model_name: str, profile: str):
+    import torch
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+
+    if profile not in LOAD_PROFILES:
+        raise ValueError(f"Unknown load profile '{profile}', expected one of {', '.join(LOAD_PROFILES)}")
+
+    revision = resolve_revision(model_name) if MODEL_SNAPSHOTS else None
+    path = snapshot_path(model_name, profile, revision) if revision else None
+    from_snapshot = path is not None and os.path.isdir(path)
+    source = path if from_snapshot else model_name
+
+    tokenizer = AutoTokenizer.from_pretrained(source)
+    if profile == "auto":
+        model = AutoModelForCausalLM.from_pretrained(source, device_map="auto", torch_dtype="auto")
+    else:
+        model = AutoModelForCausalLM.from_pretrained(
+            source,
+            torch_dtype=getattr(torch, PROFILE_DTYPES[profile]),
+            low_cpu_mem_usage=True,
+        )
+
+    if path and not from_snapshot:
+        _save_snapshot_in_background(model_name, path, tokenizer, model)
+
+    if profile == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return tokenizer, model
+
+
+def _compile(model_name: str, tokenizer, model):
+    """Compile the model's forward, falling back to eager mode if compilation fails.
+
+    torch.compile is lazy and only compiles on the first call, so a warm-up forward runs here
+    to surface compile errors at load time instead of on the first generate().
+    """
+    import torch
+
+    eager_forward = model.forward
+    try:
+        model.forward = torch.compile(eager_forward, dynamic=True)
+        inputs = tokenizer("Hello", return_tensors="pt").to(model.device)
+        with torch.inference_mode():
+            model(**inputs)
+    except Exception as e:
+        model.forward = eager_forward
+        logger.warning(f"torch.compile failed for {model_name}, using eager mode: {e}")
+
+
+def load_model(model_name: str, profile: str | None = None, compile_model: bool | None = None):
+    key = profile_key(model_name, profile, compile_model)
+    if key in model_cache:
+        logger.info(f"Using cached model {model_name} (profile={key[1]}, compiled={key[2]})")
+        return model_cache[key]
+
+    logger.info(f"Loading model {model_name} (profile={key[1]}, compiled={key[2]})...")
+    start = time.perf_counter()
+    tokenizer, model = _load_weights(model_name, key[1])
+    model.eval()
+
+    if key[2]:
+        _compile(model_name, tokenizer, model)
+
+    logger.info(f"Model {model_name} loaded in {time.perf_counter() - start:.3f}s")
+    model_cache[key] = (tokenizer, model)
+    return model_cache[key]
@@ -0,0 +1,48 @@
+"""Keyset pagination for listing endpoints.
+
+A page is read with `WHERE (sort key) after (cursor) ORDER BY sort key LIMIT limit + 1`, so
+deep pages cost the same as the first one. The extra row only tells whether there is a next
+page. The cursor is the sort key of the page's last row, as opaque URL-safe base64 JSON.
+"""
+import base64
+import json
+import uuid
+from datetime import datetime
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE     = 200
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return value.hex
+    return value
+
+
+def encode_cursor(*values) -> str:
+    data = json.dumps([_encode_value(value) for value in values], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, *types) -> list:
+    """Sort key values of a cursor, converted to types; raises ValueError for a malformed cursor."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if isinstance(values, list) and len(values) == len(types):
+            return [
+                None if value is None else datetime.fromisoformat(value) if kind is datetime else kind(value)
+                for kind, value in zip(types, values)
+            ]
+    except (ValueError, TypeError):
+        pass
+    raise ValueError(f"Invalid cursor '{cursor}'")
+
+
+def split_page(rows: list, limit: int, key) -> tuple:
+    """The page's rows and the cursor of the next page (None on the last page), from limit + 1 rows."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
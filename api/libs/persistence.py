@@ -0,0 +1,212 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from libs import metrics, room_stats
+from libs.db import SessionLocal
+from schemas.models import Conversation, Message
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+FLUSH_INTERVAL = 0.005  # seconds to keep collecting writes after the first one arrives
+MAX_BATCH_SIZE = 500
+
+
+def _resolve(future: Future, result=None, exception=None):
+    # Callers may stop waiting (e.g. a cancelled socket task); the write itself still happened
+    if not future.set_running_or_notify_cancel():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+class WriteBehindQueue:
+    """Batches DB writes from all sockets into grouped transactions on a single writer thread.
+
+    Each write is a callable taking the writer's session; its return value resolves the Future
+    returned by submit() once the transaction it was grouped into has committed. Partial responses
+    passed to checkpoint_response() are coalesced so only the latest text per conversation is written.
+    """
+
+    def __init__(self, session_factory=SessionLocal, flush_interval: float = FLUSH_INTERVAL, max_batch_size: int = MAX_BATCH_SIZE):
+        self.session_factory = session_factory
+        self.flush_interval  = flush_interval
+        self.max_batch_size  = max_batch_size
+        self._queue       = queue.Queue()
+        self._checkpoints = {}
+        self._lock        = threading.Lock()
+        self._thread      = None
+        self._stopping    = False
+        self.commits      = 0
+        self.writes       = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float | None = 10.0):
+        """Flush everything queued so far and stop the writer thread."""
+        if self._thread is None:
+            return
+        self.flush().result(timeout=timeout)
+        self._stopping = True
+        self._queue.put(None)
+        self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def submit(self, write) -> Future:
+        self.start()
+        future = Future()
+        self._queue.put((write, future))
+        return future
+
+    def flush(self) -> Future:
+        """Future that resolves once every write queued before this call is committed."""
+        return self.submit(lambda session: None)
+
+    def checkpoint_response(self, conversation_id: int, text: str):
+        with self._lock:
+            self._checkpoints[conversation_id] = text
+        self.start()
+        self._queue.put(("checkpoint", None))
+
+    def insert_conversation(self, room_uuid, query: str) -> Future:
+        def write(session):
+            convo = Conversation(chatRoom_id=room_uuid, query=query, responseMessage="")
+            session.add(convo)
+            session.flush()
+            room_stats.record_query(session, room_uuid, convo.timestamp, query)
+            return convo.id
+        return self.submit(write)
+
+    def complete_conversation(self, conversation_id: int, response: str, username: str) -> Future:
+        with self._lock:
+            self._checkpoints.pop(conversation_id, None)
+
+        def write(session):
+            session.query(Conversation).filter(Conversation.id == conversation_id).update(
+                {Conversation.responseMessage: response}, synchronize_session=False
+            )
+            room_stats.record_response(session, conversation_id, response)
+            session.add(Message(conversation_id=conversation_id, senderUsername=username, rating=None))
+        return self.submit(write)
+
+    def _take_batch(self):
+        item = self._queue.get()
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _take_checkpoints(self) -> dict:
+        with self._lock:
+            checkpoints, self._checkpoints = self._checkpoints, {}
+        return checkpoints
+
+    def _restore_checkpoints(self, checkpoints: dict):
+        # A checkpoint queued since they were taken is newer, and one dropped by complete_conversation stays dropped
+        with self._lock:
+            for conversation_id, text in checkpoints.items():
+                self._checkpoints.setdefault(conversation_id, text)
+
+    def _apply_checkpoints(self, session, checkpoints: dict):
+        for conversation_id, text in checkpoints.items():
+            session.query(Conversation).filter(Conversation.id == conversation_id).update(
+                {Conversation.responseMessage: text}, synchronize_session=False
+            )
+
+    def _commit_batch(self, writes):
+        checkpoints = self._take_checkpoints()
+        if not writes and not checkpoints:
+            return
+        session = self.session_factory()
+        try:
+            self._apply_checkpoints(session, checkpoints)
+            results = [write(session) for write, _ in writes]
+            session.commit()
+        except Exception:
+            session.rollback()
+            session.close()
+            logger.exception("Write-behind batch failed, retrying writes one by one")
+            self._restore_checkpoints(checkpoints)
+            self._commit_individually(writes)
+            return
+        session.close()
+
+        count = len(writes) + len(checkpoints)
+        self.commits += 1
+        self.writes  += count
+        metrics.incr("persistence_commits")
+        metrics.incr("persistence_writes", count)
+        metrics.observe("persistence_batch_size", count)
+        for (_, future), result in zip(writes, results):
+            _resolve(future, result=result)
+
+    def _commit_checkpoints(self):
+        checkpoints = self._take_checkpoints()
+        if not checkpoints:
+            return
+        session = self.session_factory()
+        try:
+            self._apply_checkpoints(session, checkpoints)
+            session.commit()
+            self.commits += 1
+            self.writes  += len(checkpoints)
+            metrics.incr("persistence_commits")
+        except Exception:
+            session.rollback()
+            metrics.incr("persistence_errors")
+            logger.exception("Write-behind checkpoints failed, keeping them for the next batch")
+            self._restore_checkpoints(checkpoints)
+        finally:
+            session.close()
+
+    def _commit_individually(self, writes):
+        # Checkpoints go first, as in a batch, so they never overwrite a response completed by one of the writes
+        self._commit_checkpoints()
+        for write, future in writes:
+            session = self.session_factory()
+            try:
+                result = write(session)
+                session.commit()
+                self.commits += 1
+                self.writes  += 1
+                metrics.incr("persistence_commits")
+                _resolve(future, result=result)
+            except Exception as e:
+                session.rollback()
+                metrics.incr("persistence_errors")
+                _resolve(future, exception=e)
+            finally:
+                session.close()
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            stop = any(item is None for item in batch)
+            writes = [item for item in batch if item is not None and item[0] != "checkpoint"]
+            try:
+                self._commit_batch(writes)
+            except Exception:
+                logger.exception("Write-behind writer failed")
+            if stop and self._stopping:
+                return
+
+
+write_behind = WriteBehindQueue()
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from libs import metrics
+from schemas.models import Conversation, PromptTokenCache
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+# Rendered + tokenized head messages (system prompt, room summary) per (model, head hash).
+# Every room and every compaction has a head of its own, so only the most recent ones are kept.
+HEAD_CACHE_SIZE = 128
+_head_cache = OrderedDict()  # least recently used first
+_head_lock  = threading.Lock()
+
+# Uncached segments that may be cut out of a render of the whole history prefix; each such render
+# grows with the history, so past this many the rest of the prompt is tokenized in one go
+MAX_PREFIX_RENDERS = 8
+
+
+def prompt_hash(system_prompt: str | None) -> str:
+    return hashlib.sha1((system_prompt or "").encode("utf-8")).hexdigest()
+
+
+def conversation_messages(conv) -> list:
+    messages = [{"role": "user", "content": conv.query}]
+    if conv.responseMessage:
+        messages.append({"role": "assistant", "content": conv.responseMessage})
+    return messages
+
+
+def _tokenize(tokenizer, text: str) -> list:
+    # The chat template already emits BOS/role markers, so never let the tokenizer add its own
+    if not text:
+        return []
+    return tokenizer(text, add_special_tokens=False)["input_ids"]
+
+
+def _render(tokenizer, messages: list, add_generation_prompt: bool) -> str:
+    return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=add_generation_prompt)
+
+
+def _head(tokenizer, model_name: str, head_messages: list):
+    key = (model_name, prompt_hash(json.dumps(head_messages, sort_keys=True)))
+    with _head_lock:
+        head = _head_cache.get(key)
+        if head is not None:
+            _head_cache.move_to_end(key)
+            return head
+    text = _render(tokenizer, head_messages, add_generation_prompt=False)
+    head = (text, _tokenize(tokenizer, text))
+    with _head_lock:
+        _head_cache[key] = head
+        while len(_head_cache) > HEAD_CACHE_SIZE:
+            _head_cache.popitem(last=False)
+    return head
+
+
+def _store_segments(db: Session, rows: list, model_name: str):
+    """Write new cache segments; the cache is only an optimization, so a failed write never fails the turn.
+
+    Workers serving the same room can race on the insert of a segment (room locks are per process).
+    """
+    try:
+        for row in rows:
+            db.merge(row)
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.warning(f"Failed to store {len(rows)} prompt cache segments for model={model_name}: {e}")
+
+
+def build_input_ids(
+    db: Session,
+    tokenizer,
+    model_name: str,
+    system_prompt: str | None,
+    head_messages: list,
+    conversations: list,
+    prompt: str,
+) -> list:
+    """Token ids for head + history + prompt, reusing cached per-conversation token segments.
+
+    The template is still rendered over the whole message list, but only the pieces of that text
+    not covered by a cached segment are tokenized. A segment is the text one conversation adds to
+    the rendered prompt; it is reused only when it appears verbatim at the expected offset, so
+    templates that rewrite earlier turns fall back to plain tokenization. Segments are keyed by
+    conversation id and are stale (and overwritten) once the model or system prompt changes.
+
+    A missing segment is rendered from the head and that conversation alone, so a cold cache
+    costs one small render per turn. Templates whose output for a turn depends on the turns
+    around it need a render of the whole prefix instead, which is done for at most
+    MAX_PREFIX_RENDERS segments.
+    """
+    messages = list(head_messages)
+    for conv in conversations:
+        messages.extend(conversation_messages(conv))
+    messages.append({"role": "user", "content": prompt})
+    rendered = _render(tokenizer, messages, add_generation_prompt=True)
+
+    head_text, head_ids = _head(tokenizer, model_name, head_messages)
+    if not rendered.startswith(head_text):
+        metrics.incr("prompt_cache_fallbacks", model=model_name)
+        return _tokenize(tokenizer, rendered)
+
+    current_hash = prompt_hash(system_prompt)
+    cached = {}
+    conv_ids = [conv.id for conv in conversations if conv.responseMessage]
+    if conv_ids:
+        rows = db.query(PromptTokenCache).filter(PromptTokenCache.conversation_id.in_(conv_ids)).all()
+        cached = {row.conversation_id: row for row in rows}
+
+    input_ids   = list(head_ids)
+    pos         = len(head_text)
+    n_messages  = len(head_messages)
+    reused      = 0
+    tokenized   = 0
+    windowed    = True
+    prefix_renders = 0
+    cache_rows  = []
+    for conv in conversations:
+        conv_messages = conversation_messages(conv)
+        n_messages += len(conv_messages)
+        row = cached.get(conv.id)
+        if (
+            row is not None
+            and row.modelKey == model_name
+            and row.promptHash == current_hash
+            and rendered.startswith(row.segmentText, pos)
+        ):
+            segment_ids = array("i")
+            segment_ids.frombytes(row.tokenIds)
+            input_ids.extend(segment_ids)
+            pos    += len(row.segmentText)
+            reused += len(segment_ids)
+            continue
+
+        segment_text = None
+        if windowed:
+            window = _render(tokenizer, head_messages + conv_messages, add_generation_prompt=False)
+            if window.startswith(head_text) and rendered.startswith(window[len(head_text):], pos):
+                segment_text = window[len(head_text):]
+            else:
+                windowed = False
+        if segment_text is None:
+            if prefix_renders >= MAX_PREFIX_RENDERS:
+                # Cheaper to tokenize the remainder in one go than to keep rendering longer prefixes
+                metrics.incr("prompt_cache_fallbacks", model=model_name)
+                break
+            prefix_renders += 1
+            end_text = _render(tokenizer, messages[:n_messages], add_generation_prompt=False)
+            if len(end_text) < pos or not rendered.startswith(end_text):
+                # Template is not append-only for this history; tokenize the remainder in one go
+                metrics.incr("prompt_cache_fallbacks", model=model_name)
+                break
+            segment_text = end_text[pos:]
+
+        segment_ids  = _tokenize(tokenizer, segment_text)
+        input_ids.extend(segment_ids)
+        pos       += len(segment_text)
+        tokenized += len(segment_ids)
+
+        # Only completed turns are stable enough to cache; archived turns no longer have a row to key on
+        if conv.responseMessage and isinstance(conv, Conversation):
+            cache_rows.append(PromptTokenCache(
+                conversation_id=conv.id,
+                modelKey=model_name,
+                promptHash=current_hash,
+                segmentText=segment_text,
+                tokenIds=array("i", segment_ids).tobytes(),
+            ))
+
+    tail_ids = _tokenize(tokenizer, rendered[pos:])
+    input_ids.extend(tail_ids)
+    tokenized += len(tail_ids)
+
+    if cache_rows:
+        _store_segments(db, cache_rows, model_name)
+
+    metrics.incr("prompt_tokens_reused", reused, model=model_name)
+    metrics.incr("prompt_tokens_tokenized", tokenized, model=model_name)
+    logger.debug(f"Prompt built for model={model_name}: reused={reused} tokenized={tokenized} tokens")
+    return input_ids
@@ -0,0 +1,357 @@
+"""Remote LLM backends with streaming, pooled connections, retries and optional request hedging.
+
+Each provider turns a chat message list into an iterator of text chunks. Connection failures,
+timeouts, 429 and 5xx responses are retried with jittered exponential backoff, but only until
+the first chunk arrives: once text has been streamed to the client a retry would duplicate it.
+Every attempt goes through the backend's circuit breaker and is bounded by the turn's deadline.
+"""
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from libs import metrics
+from libs.circuit_breaker import get_breaker
+from libs.deadline import Deadline
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+DEFAULT_TIMEOUT  = 60.0
+MAX_RETRIES      = 2
+BACKOFF_BASE     = 0.25  # seconds
+BACKOFF_MAX      = 4.0
+POOL_SIZE        = 16
+
+HUGGINGFACE_API_BASE = "https://api-inference.huggingface.co/models"
+OPENAI_API_BASE      = "http://127.0.0.1:8080/v1"
+
+# One pooled HTTP session per (provider, base URL), shared by every request to it
+_sessions      = {}
+_sessions_lock = threading.Lock()
+
+
+class ProviderError(Exception):
+    def __init__(self, message: str, status_code: int | None = None, retryable: bool = False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable   = retryable
+
+
+def http_session(provider: str, api_base: str) -> requests.Session:
+    key = (provider, api_base)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[key] = session
+        return session
+
+
+def backoff_delay(attempt: int) -> float:
+    # "Full jitter": spreads retries from many sockets instead of having them retry in lockstep
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def iter_sse_data(response):
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return
+        yield data
+
+
+class Provider:
+    name = "provider"
+
+    def __init__(self, model_name: str, api_key: str | None = None, api_base: str | None = None, max_retries: int = MAX_RETRIES):
+        self.model_name  = model_name
+        self.api_key     = api_key
+        self.api_base    = api_base
+        self.max_retries = max_retries
+
+    def _open(self, messages: list, temperature: float, max_new_tokens: int, timeout: float):
+        """Iterator of text chunks for one attempt; raise ProviderError on failure."""
+        raise NotImplementedError
+
+    @property
+    def backend(self) -> str:
+        return f"{self.name}:{self.api_base or 'default'}"
+
+    def _attempt(self, messages, temperature, max_new_tokens, timeout, deadline):
+        """One call guarded by this backend's circuit breaker; outcome latency is time to first chunk."""
+        breaker = get_breaker(self.backend)
+        breaker.allow()
+        start = time.monotonic()
+        first_chunk = None
+        recorded = False
+        try:
+            for text in self._open(messages, temperature, max_new_tokens, timeout):
+                if first_chunk is None:
+                    first_chunk = time.monotonic() - start
+                if deadline is not None:
+                    deadline.check()
+                yield text
+            breaker.record(True, first_chunk if first_chunk is not None else time.monotonic() - start)
+            recorded = True
+        except (requests.RequestException, ProviderError):
+            # A timeout cut short by the turn's deadline says nothing about the backend's health
+            if deadline is None or not deadline.expired():
+                breaker.record(False, time.monotonic() - start)
+                recorded = True
+            raise
+        finally:
+            # Also reached on DeadlineExceeded or when the consumer stops early: free the probe, record nothing
+            if not recorded:
+                breaker.release()
+
+    def stream(self, messages: list, temperature: float, max_new_tokens: int, deadline: Deadline | None = None):
+        attempt = 0
+        while True:
+            started = False
+            timeout = deadline.timeout(DEFAULT_TIMEOUT) if deadline is not None else DEFAULT_TIMEOUT
+            try:
+                for text in self._attempt(messages, temperature, max_new_tokens, timeout, deadline):
+                    started = True
+                    yield text
+                return
+            except requests.RequestException as e:
+                error = ProviderError(f"{self.name} request error: {e}", retryable=True)
+            except ProviderError as e:
+                error = e
+
+            metrics.incr("provider_errors", provider=self.name)
+            if started or not error.retryable or attempt >= self.max_retries:
+                raise error
+            delay = backoff_delay(attempt)
+            if deadline is not None and deadline.remaining() <= delay:
+                raise error
+            attempt += 1
+            metrics.incr("provider_retries", provider=self.name)
+            logger.warning(f"{error}; retrying {self.name} in {delay:.2f}s (attempt {attempt}/{self.max_retries})")
+            time.sleep(delay)
+
+    def _check_status(self, response):
+        if response.status_code == 200:
+            return
+        retryable = response.status_code == 429 or response.status_code >= 500
+        text = (response.text or "")[:500]
+        response.close()
+        raise ProviderError(f"{self.name} API Error: {text}", status_code=response.status_code, retryable=retryable)
+
+
+class HuggingFaceProvider(Provider):
+    name = "huggingface"
+
+    def _prompt(self, messages: list) -> str:
+        # The text-generation endpoint takes a flat prompt rather than chat messages
+        parts = []
+        for message in messages:
+            if not message["content"]:
+                continue
+            if message["role"] == "system":
+                parts.append(message["content"])
+            elif message["role"] == "user":
+                parts.append(f"User: {message['content']}")
+            else:
+                parts.append(f"Assistant: {message['content']}")
+        return "\n\n".join(parts) + "\n\nAssistant:"
+
+    def _open(self, messages, temperature, max_new_tokens, timeout):
+        api_base = (self.api_base or HUGGINGFACE_API_BASE).rstrip("/")
+        prompt   = self._prompt(messages)
+        payload  = {
+            "inputs": prompt,
+            "parameters": {"max_new_tokens": max_new_tokens, "temperature": temperature, "return_full_text": False},
+            "stream": True,
+        }
+        response = http_session(self.name, api_base).post(
+            f"{api_base}/{self.model_name}",
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            json=payload,
+            stream=True,
+            timeout=timeout,
+        )
+        self._check_status(response)
+
+        with response:
+            if "text/event-stream" not in response.headers.get("Content-Type", ""):
+                # Endpoints without streaming support answer with a single JSON document
+                data = response.json()
+                if isinstance(data, dict) and "error" in data:
+                    raise ProviderError(f"HuggingFace API Error: {data['error']}")
+                if isinstance(data, list) and data and "generated_text" in data[0]:
+                    yield data[0]["generated_text"].replace(prompt, "").strip()
+                return
+
+            for data in iter_sse_data(response):
+                event = json.loads(data)
+                if "error" in event:
+                    raise ProviderError(f"HuggingFace API Error: {event['error']}")
+                token = event.get("token") or {}
+                if token.get("text") and not token.get("special"):
+                    yield token["text"]
+
+
+class OpenAICompatibleProvider(Provider):
+    name = "openai"
+
+    def _open(self, messages, temperature, max_new_tokens, timeout):
+        api_base = (self.api_base or OPENAI_API_BASE).rstrip("/")
+        headers  = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        payload  = {
+            "model": self.model_name,
+            "messages": [m for m in messages if m["content"]],
+            "temperature": temperature,
+            "max_tokens": max_new_tokens,
+            "stream": True,
+        }
+        response = http_session(self.name, api_base).post(
+            f"{api_base}/chat/completions", headers=headers, json=payload, stream=True, timeout=timeout
+        )
+        self._check_status(response)
+
+        with response:
+            for data in iter_sse_data(response):
+                event = json.loads(data)
+                if "error" in event:
+                    raise ProviderError(f"OpenAI-compatible API Error: {event['error']}")
+                for choice in event.get("choices", []):
+                    text = (choice.get("delta") or {}).get("content")
+                    if text:
+                        yield text
+
+
+class GeminiProvider(Provider):
+    name = "gemini"
+
+    _clients      = {}
+    _clients_lock = threading.Lock()
+
+    def _client(self):
+        from google import genai
+        from google.genai import types
+
+        key = (self.api_key, self.api_base)
+        with self._clients_lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = genai.Client(api_key=self.api_key, http_options=types.HttpOptions(base_url=self.api_base))
+                self._clients[key] = client
+            return client
+
+    def _open(self, messages, temperature, max_new_tokens, timeout):
+        from google.genai import errors, types
+
+        system   = "\n\n".join(m["content"] for m in messages if m["role"] == "system" and m["content"])
+        contents = [
+            types.Content(role="model" if m["role"] == "assistant" else "user", parts=[types.Part(text=m["content"])])
+            for m in messages if m["role"] != "system" and m["content"]
+        ]
+        config = types.GenerateContentConfig(
+            system_instruction=system or None,
+            temperature=temperature,
+            max_output_tokens=max_new_tokens,
+            http_options=types.HttpOptions(timeout=int(timeout * 1000)),
+        )
+        try:
+            for chunk in self._client().models.generate_content_stream(
+                model=self.model_name, contents=contents, config=config
+            ):
+                if chunk.text:
+                    yield chunk.text
+        except errors.APIError as e:
+            raise ProviderError(
+                f"Gemini API Error: {e.message}",
+                status_code=e.code,
+                retryable=e.code == 429 or (e.code or 0) >= 500,
+            )
+
+
+PROVIDERS = {
+    HuggingFaceProvider.name: HuggingFaceProvider,
+    OpenAICompatibleProvider.name: OpenAICompatibleProvider,
+    GeminiProvider.name: GeminiProvider,
+}
+
+
+def get_provider(domain_name: str, model_name: str, api_key: str | None = None, api_base: str | None = None) -> Provider:
+    provider_class = PROVIDERS.get((domain_name or "").lower())
+    if provider_class is None:
+        raise ValueError(f"Unknown API provider '{domain_name}', expected one of {', '.join(PROVIDERS)}")
+    return provider_class(model_name, api_key=api_key, api_base=api_base)
+
+
+def hedged_stream(primary, secondary, hedge_delay: float):
+    """Stream from primary, racing a duplicate request to secondary if no chunk arrives within hedge_delay.
+
+    primary/secondary are zero-argument callables returning chunk iterators. Whichever yields
+    its first chunk first wins and the other is abandoned. A primary that fails before its first
+    chunk also starts the secondary right away.
+    """
+    events   = queue.Queue()
+    cancel   = [threading.Event(), threading.Event()]
+    sources  = [primary, secondary]
+    started  = []
+    finished = set()
+
+    def pump(index):
+        try:
+            for text in sources[index]():
+                if cancel[index].is_set():
+                    return
+                events.put((index, "data", text))
+            events.put((index, "end", None))
+        except Exception as e:
+            events.put((index, "error", e))
+
+    def start(index):
+        started.append(index)
+        threading.Thread(target=pump, args=(index,), daemon=True).start()
+
+    start(0)
+    deadline = time.monotonic() + hedge_delay
+    winner   = None
+    while True:
+        timeout = None
+        if winner is None and len(started) == 1:
+            timeout = max(0.0, deadline - time.monotonic())
+        try:
+            index, kind, value = events.get(timeout=timeout)
+        except queue.Empty:
+            metrics.incr("provider_hedges")
+            logger.info(f"No first token within {hedge_delay:.2f}s, hedging to secondary provider")
+            start(1)
+            continue
+
+        if winner is None:
+            if kind == "error":
+                finished.add(index)
+                if len(started) == 1:
+                    start(1)
+                    continue
+                if finished.issuperset(started):
+                    raise value
+                continue
+            winner = index
+            cancel[1 - index].set()
+            if index == 1:
+                metrics.incr("provider_hedge_wins")
+
+        if index != winner:
+            continue
+        if kind == "data":
+            yield value
+        elif kind == "end":
+            return
+        else:
+            raise value
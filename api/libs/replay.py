@@ -0,0 +1,277 @@
+"""Offline replay of captured chat turns (libs/tracing.py) under a profiler.
+
+A replay rebuilds the turn from its trace alone, with no live setting or history involved. For a
+local model it loads the recorded model and feeds generate() the recorded prompt token ids, with
+the recorded parameters and a fixed seed. It also forces exactly the recorded number of new
+tokens, so the work matches the original turn. The recorded messages are re-tokenized only to
+time that stage and to report whether the chat template still produces the same ids. Remote
+turns resend the recorded messages, which needs the API key the trace leaves out (--api-key or
+REPLAY_API_KEY).
+
+Profilers:
+
+    sample    stack sampling of every thread at --interval, written as folded stacks
+              (stacks.folded, input for flamegraph.pl / speedscope / inferno)
+    cprofile  deterministic profile of the generation thread (generation.pstats)
+    torch     torch.profiler op timings: chrome trace, folded stacks and a summary table
+
+    python -m libs.replay storage/traces --list
+    python -m libs.replay storage/traces/turns-20250101.jsonl.gz --trace-id ID --profiler sample --out replay-out
+"""
+import argparse
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+from libs.tracing import decode_token_ids, read_traces
+
+SAMPLE_INTERVAL = 0.005
+
+
+class StackSampler:
+    """Periodically samples the Python stacks of all other threads into folded-stack counts."""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.counts   = Counter()
+        self.samples  = 0
+        self._stopped = threading.Event()
+        self._thread  = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def timed_stream(chunks, stages: dict, start: float) -> str:
+    text = ""
+    for chunk in chunks:
+        if "ttft" not in stages and chunk:
+            stages["ttft"] = time.perf_counter() - start
+        text += chunk
+    stages["generation"] = time.perf_counter() - start
+    return text
+
+
+def replay_local(trace: dict, args, stages: dict, wrap) -> dict:
+    import torch
+    from transformers import TextIteratorStreamer
+    from libs.model_loader import apply_cpu_settings, load_model
+
+    inputs  = trace["inputs"]
+    setting = SimpleNamespace(**inputs["setting"])
+    apply_cpu_settings(setting.numThreads, setting.cpuAffinity)
+    start = time.perf_counter()
+    tokenizer, model = load_model(setting.modelName, setting.loadProfile, setting.compileModel)
+    draft_model = None
+    if inputs.get("draft_model"):
+        _, draft_model = load_model(inputs["draft_model"], setting.loadProfile, setting.compileModel)
+    stages["load_model"] = time.perf_counter() - start
+
+    token_ids = decode_token_ids(inputs["token_ids"])
+    start = time.perf_counter()
+    text = tokenizer.apply_chat_template(inputs["messages"], tokenize=False, add_generation_prompt=True)
+    retokenized = tokenizer(text, add_special_tokens=False)["input_ids"]
+    stages["build_prompt"] = time.perf_counter() - start
+
+    new_tokens = trace["stats"].get("new_tokens") or inputs["max_new_tokens"]
+    if args.max_new_tokens:
+        new_tokens = args.max_new_tokens
+    input_ids = torch.tensor([token_ids], dtype=torch.long, device=model.device)
+    kwargs = {
+        "input_ids": input_ids,
+        "attention_mask": torch.ones_like(input_ids),
+        "max_new_tokens": new_tokens,
+        "min_new_tokens": new_tokens,
+        "temperature": setting.temperature or 0.1,
+        "use_cache": True,
+    }
+    if draft_model is not None:
+        kwargs["assistant_model"] = draft_model
+
+    torch.manual_seed(args.seed)
+    streamer = TextIteratorStreamer(tokenizer, skip_special_tokens=True, skip_prompt=True)
+    output   = {}
+
+    def generate():
+        try:
+            with torch.inference_mode():
+                output["ids"] = model.generate(**kwargs, streamer=streamer)
+        except Exception as e:
+            output["error"] = str(e)
+            streamer.end()
+
+    start  = time.perf_counter()
+    thread = threading.Thread(target=wrap(generate), name="replay-generate")
+    thread.start()
+    timed_stream(streamer, stages, start)
+    thread.join()
+    generated = int(output["ids"].shape[-1] - len(token_ids)) if "ids" in output else 0
+    return {
+        "prompt_tokens": len(token_ids),
+        "prompt_tokens_match": retokenized == token_ids,
+        "new_tokens": generated,
+        "tokens_per_sec": round(generated / stages["generation"], 2) if stages.get("generation") else None,
+        "error": output.get("error"),
+    }
+
+
+def replay_remote(trace: dict, args, stages: dict, wrap) -> dict:
+    from libs.providers import get_provider
+
+    inputs  = trace["inputs"]
+    setting = SimpleNamespace(**inputs["setting"])
+    api_key = args.api_key or os.environ.get("REPLAY_API_KEY")
+    provider = get_provider(setting.domainName, setting.modelName, api_key, setting.apiBase)
+    result = {}
+
+    def generate():
+        try:
+            chunks = provider.stream(inputs["messages"], setting.temperature or 0.7, inputs["max_new_tokens"])
+            result["text"] = timed_stream(chunks, stages, start)
+        except Exception as e:
+            result["error"] = str(e)
+
+    start  = time.perf_counter()
+    thread = threading.Thread(target=wrap(generate), name="replay-generate")
+    thread.start()
+    thread.join()
+    return {"response_chars": len(result.get("text", "")), "error": result.get("error")}
+
+
+def compare_stages(recorded: dict, replayed: dict) -> dict:
+    comparison = {}
+    for name in list(recorded) + [name for name in replayed if name not in recorded]:
+        before, after = recorded.get(name), replayed.get(name)
+        comparison[name] = {
+            "recorded": before,
+            "replay": round(after, 6) if after is not None else None,
+            "delta": round(after - before, 6) if before is not None and after is not None else None,
+        }
+    return comparison
+
+
+def replay(trace: dict, args) -> dict:
+    os.makedirs(args.out, exist_ok=True)
+    stages, outputs = {}, []
+    profile = cProfile.Profile() if args.profiler == "cprofile" else None
+
+    def wrap(fn):
+        if profile is None:
+            return fn
+        # cProfile only sees the thread it was enabled on, so it runs inside the generation thread
+        return lambda: profile.runcall(fn)
+
+    run = replay_local if trace["inputs"]["backend"] == "local" else replay_remote
+    start = time.perf_counter()
+    if args.profiler == "sample":
+        with StackSampler(args.interval) as sampler:
+            result = run(trace, args, stages, wrap)
+        path = os.path.join(args.out, "stacks.folded")
+        sampler.write(path)
+        outputs.append(path)
+    elif args.profiler == "torch":
+        from torch.profiler import ProfilerActivity, profile as torch_profile
+        with torch_profile(activities=[ProfilerActivity.CPU], record_shapes=True, with_stack=True) as prof:
+            result = run(trace, args, stages, wrap)
+        for name, export in (("torch-trace.json", prof.export_chrome_trace), ("torch-stacks.folded", prof.export_stacks)):
+            path = os.path.join(args.out, name)
+            export(path)
+            outputs.append(path)
+        path = os.path.join(args.out, "torch-ops.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(prof.key_averages().table(sort_by="self_cpu_time_total", row_limit=50))
+        outputs.append(path)
+    else:
+        result = run(trace, args, stages, wrap)
+    stages["total"] = time.perf_counter() - start
+
+    if profile is not None:
+        path = os.path.join(args.out, "generation.pstats")
+        profile.dump_stats(path)
+        outputs.append(path)
+    return {
+        "trace_id": trace["trace_id"],
+        "backend": trace["inputs"]["backend"],
+        "model": trace["inputs"]["setting"].get("modelName"),
+        "reason": trace["reason"],
+        **result,
+        "stages": compare_stages(trace["stages"], stages),
+        "outputs": outputs,
+    }
+
+
+def select_trace(traces: list, args) -> dict:
+    if args.trace_id:
+        for trace in traces:
+            if trace["trace_id"] == args.trace_id:
+                return trace
+        raise SystemExit(f"trace '{args.trace_id}' not found")
+    try:
+        return traces[args.index]
+    except IndexError:
+        raise SystemExit(f"no trace at index {args.index} ({len(traces)} traces)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a captured chat turn offline under a profiler")
+    parser.add_argument("path", help="trace file or directory of trace files")
+    parser.add_argument("--list", action="store_true", help="list the traces instead of replaying one")
+    parser.add_argument("--trace-id")
+    parser.add_argument("--index", type=int, default=-1, help="trace to replay when no --trace-id is given (default: latest)")
+    parser.add_argument("--profiler", choices=["none", "sample", "cprofile", "torch"], default="sample")
+    parser.add_argument("--interval", type=float, default=SAMPLE_INTERVAL, help="stack sampling interval in seconds")
+    parser.add_argument("--out", default="replay-out")
+    parser.add_argument("--repeat", type=int, default=1, help="replays of the trace; the first one includes warm-up")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-new-tokens", type=int, default=None, help="override the recorded number of new tokens")
+    parser.add_argument("--api-key", help="API key for remote traces (default: $REPLAY_API_KEY)")
+    args = parser.parse_args()
+
+    traces = list(read_traces(args.path))
+    if args.list:
+        for index, trace in enumerate(traces):
+            print(json.dumps({
+                "index": index, "trace_id": trace["trace_id"], "started_at": trace["started_at"],
+                "reason": trace["reason"], "backend": trace["inputs"].get("backend"),
+                "total": trace["stages"].get("total"), "new_tokens": trace["stats"].get("new_tokens"),
+            }))
+        return
+
+    trace = select_trace(traces, args)
+    for _ in range(args.repeat):
+        print(json.dumps(replay(trace, args), indent=2), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Periodic retention and SQLite maintenance.
+
+A single background thread archives rooms that have gone idle (see libs/archive.py), deletes
+expired turn trace files (see libs/tracing.py), refreshes the query planner statistics with
+ANALYZE, and VACUUMs the database file once enough pages have been freed, typically after
+archival deleted a batch of turns. Each job only starts once no chat turn, local or remote,
+has been in flight for IDLE_SECONDS, since VACUUM blocks every writer (the turn's write-behind
+inserts, checkpoints and completions) until it finishes.
+"""
+import logging
+import os
+import threading
+import time
+from sqlalchemy import text
+from libs import archive, metrics, tracing
+from libs.db import SessionLocal, engine
+from libs.streams import turn_activity
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+CHECK_INTERVAL   = 300.0          # seconds between checks for due jobs
+ARCHIVE_INTERVAL = 6 * 3600.0
+ANALYZE_INTERVAL = 24 * 3600.0
+TRACE_PRUNE_INTERVAL = 24 * 3600.0
+VACUUM_INTERVAL  = 7 * 24 * 3600.0
+VACUUM_FREE_RATIO = 0.2           # VACUUM early once this share of the file is free pages
+IDLE_SECONDS     = 60.0
+WORKER_NICENESS  = 19
+
+
+def free_page_ratio() -> float:
+    with engine.connect() as conn:
+        pages = conn.execute(text("PRAGMA page_count")).scalar() or 0
+        free  = conn.execute(text("PRAGMA freelist_count")).scalar() or 0
+    return free / pages if pages else 0.0
+
+
+def run_archive(idle_days: float = archive.ARCHIVE_IDLE_DAYS) -> int:
+    db = SessionLocal()
+    try:
+        return archive.archive_idle_rooms(db, idle_days)
+    finally:
+        db.close()
+
+
+def run_analyze():
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("ANALYZE"))
+
+
+def run_vacuum():
+    # VACUUM cannot run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM"))
+
+
+class MaintenanceScheduler:
+    def __init__(self, check_interval: float = CHECK_INTERVAL, idle_seconds: float = IDLE_SECONDS):
+        self.check_interval = check_interval
+        self.idle_seconds   = idle_seconds
+        # Archive, trace pruning and ANALYZE on the first check after startup; VACUUM waits for free pages or its interval
+        now = time.monotonic()
+        self.last_run = {
+            "archive": now - ARCHIVE_INTERVAL, "traces": now - TRACE_PRUNE_INTERVAL,
+            "analyze": now - ANALYZE_INTERVAL, "vacuum": now,
+        }
+        self._stopped = threading.Event()
+        self._thread  = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _due(self, job: str, interval: float) -> bool:
+        return time.monotonic() - self.last_run[job] >= interval
+
+    def _run_job(self, job: str, fn):
+        if turn_activity.idle_seconds() < self.idle_seconds:
+            return
+        start = time.monotonic()
+        try:
+            result = fn()
+            logger.info(f"Maintenance job '{job}' finished in {time.monotonic() - start:.1f}s" + (f": {result}" if result is not None else ""))
+        except Exception as e:
+            metrics.incr("maintenance_errors", job=job)
+            logger.exception(f"Maintenance job '{job}' failed: {e}")
+        self.last_run[job] = time.monotonic()
+        metrics.observe("maintenance_seconds", self.last_run[job] - start, job=job)
+
+    def run_due_jobs(self):
+        if self._due("archive", ARCHIVE_INTERVAL):
+            self._run_job("archive", run_archive)
+        if self._due("traces", TRACE_PRUNE_INTERVAL):
+            self._run_job("traces", tracing.prune_traces)
+        if self._due("analyze", ANALYZE_INTERVAL):
+            self._run_job("analyze", run_analyze)
+        if self._due("vacuum", VACUUM_INTERVAL) or free_page_ratio() >= VACUUM_FREE_RATIO:
+            self._run_job("vacuum", run_vacuum)
+
+    def _run(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), WORKER_NICENESS)
+        except (AttributeError, OSError) as e:
+            logger.debug(f"Could not lower maintenance worker priority: {e}")
+        while not self._stopped.wait(self.check_interval):
+            try:
+                self.run_due_jobs()
+            except Exception as e:
+                logger.exception(f"Maintenance check failed: {e}")
+
+
+maintenance_scheduler = MaintenanceScheduler()
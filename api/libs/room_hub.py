@@ -0,0 +1,258 @@
+"""In-process pub/sub hub that fans chat frames out to every WebSocket subscribed to a room.
+
+Frames are plain JSON-serializable dicts. Each subscriber gets its own bounded queue so a slow
+socket never blocks the producer: on overflow it is either resynced (queued token frames are
+collapsed into the latest one, which carries the full text so far) or dropped.
+
+The hub talks to a pluggable backend. LocalBackend delivers within the process; BrokerBackend
+relays through a small line-delimited JSON broker (run with `python -m libs.room_hub`) so
+subscribers in other workers receive the same frames.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict
+from libs import metrics
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+SUBSCRIBER_BUFFER = 256
+OVERFLOW_RESYNC   = "resync"
+OVERFLOW_DROP     = "drop"
+BROKER_LINE_LIMIT = 4 * 1024 * 1024
+BROKER_MAX_WRITE_BUFFER = 8 * 1024 * 1024
+
+
+class Subscription:
+    def __init__(self, room_id: str, maxsize: int = SUBSCRIBER_BUFFER, overflow: str = OVERFLOW_RESYNC):
+        self.room_id  = room_id
+        self.overflow = overflow
+        self.queue    = asyncio.Queue(maxsize)
+        self.dropped  = False
+        self.resyncs  = 0
+
+    def deliver(self, frame: dict):
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(frame)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        if self.overflow == OVERFLOW_RESYNC and self._resync(frame):
+            return
+
+        self.dropped = True
+        metrics.incr("room_hub_dropped_subscribers")
+        logger.warning(f"Dropping slow subscriber in room {self.room_id}")
+        # Wake the consumer so it notices it has been dropped
+        self._drain()
+        self.queue.put_nowait(None)
+
+    def _drain(self) -> list:
+        frames = []
+        while not self.queue.empty():
+            frames.append(self.queue.get_nowait())
+        return frames
+
+    def _resync(self, frame: dict) -> bool:
+        # Token frames carry the cumulative text, so only the newest one per stream matters
+        frames = self._drain() + [frame]
+        latest_token = {}
+        for index, queued in enumerate(frames):
+            if queued.get("type") == "token":
+                latest_token[queued.get("stream_id")] = index
+        kept = [
+            queued for index, queued in enumerate(frames)
+            if queued.get("type") != "token" or latest_token[queued.get("stream_id")] == index
+        ]
+        if len(kept) > self.queue.maxsize:
+            return False
+        for queued in kept:
+            self.queue.put_nowait(queued)
+        self.resyncs += 1
+        metrics.incr("room_hub_resyncs")
+        return True
+
+    async def get(self):
+        """Next frame, or None once this subscriber has been dropped."""
+        if self.dropped and self.queue.empty():
+            return None
+        return await self.queue.get()
+
+
+class LocalBackend:
+    def __init__(self):
+        self.hub = None
+
+    def bind(self, hub):
+        self.hub = hub
+
+    async def subscribe(self, channel: str):
+        pass
+
+    async def unsubscribe(self, channel: str):
+        pass
+
+    async def publish(self, channel: str, frame: dict):
+        self.hub.dispatch(channel, frame)
+
+
+class BrokerBackend:
+    """Relays frames through a broker so every worker's subscribers see them (including our own)."""
+
+    def __init__(self, host: str, port: int):
+        self.host     = host
+        self.port     = port
+        self.hub      = None
+        self.channels = set()
+        self._reader  = None
+        self._writer  = None
+        self._reader_task = None
+        self._connect_lock = None
+
+    def bind(self, hub):
+        self.hub = hub
+
+    async def _connection(self):
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._writer is not None and not self._writer.is_closing():
+                return self._writer
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port, limit=BROKER_LINE_LIMIT)
+            self._reader_task = asyncio.create_task(self._read_loop(self._reader))
+            for channel in self.channels:
+                await self._send({"op": "sub", "channel": channel})
+            logger.info(f"Connected to room hub broker {self.host}:{self.port}")
+            return self._writer
+
+    async def _send(self, message: dict):
+        self._writer.write(json.dumps(message).encode("utf-8") + b"\n")
+        await self._writer.drain()
+
+    async def _read_loop(self, reader):
+        try:
+            async for line in reader:
+                message = json.loads(line)
+                self.hub.dispatch(message["channel"], message["frame"])
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.warning(f"Room hub broker connection lost: {e}")
+        finally:
+            if self._writer is not None:
+                self._writer.close()
+
+    async def subscribe(self, channel: str):
+        self.channels.add(channel)
+        await self._connection()
+        await self._send({"op": "sub", "channel": channel})
+
+    async def unsubscribe(self, channel: str):
+        self.channels.discard(channel)
+        await self._connection()
+        await self._send({"op": "unsub", "channel": channel})
+
+    async def publish(self, channel: str, frame: dict):
+        await self._connection()
+        await self._send({"op": "pub", "channel": channel, "frame": frame})
+
+
+class RoomHub:
+    def __init__(self, backend=None):
+        self.backend = backend or LocalBackend()
+        self.backend.bind(self)
+        self.subscribers = defaultdict(set)
+
+    async def subscribe(self, room_id: str, maxsize: int = SUBSCRIBER_BUFFER, overflow: str = OVERFLOW_RESYNC) -> Subscription:
+        subscription = Subscription(room_id, maxsize, overflow)
+        first = not self.subscribers[room_id]
+        self.subscribers[room_id].add(subscription)
+        if first:
+            await self.backend.subscribe(room_id)
+        metrics.set_gauge("room_hub_subscribers", sum(len(subs) for subs in self.subscribers.values()))
+        return subscription
+
+    async def unsubscribe(self, subscription: Subscription):
+        room_subscribers = self.subscribers.get(subscription.room_id)
+        if room_subscribers is None:
+            return
+        room_subscribers.discard(subscription)
+        if not room_subscribers:
+            del self.subscribers[subscription.room_id]
+            await self.backend.unsubscribe(subscription.room_id)
+        metrics.set_gauge("room_hub_subscribers", sum(len(subs) for subs in self.subscribers.values()))
+
+    def subscriber_count(self, room_id: str) -> int:
+        return len(self.subscribers.get(room_id, ()))
+
+    async def publish(self, room_id: str, frame: dict):
+        await self.backend.publish(room_id, frame)
+
+    def dispatch(self, room_id: str, frame: dict):
+        for subscription in list(self.subscribers.get(room_id, ())):
+            subscription.deliver(frame)
+
+
+def backend_from_env():
+    # ROOM_HUB_BROKER=host:port fans frames out across workers; otherwise stay in-process
+    broker = os.environ.get("ROOM_HUB_BROKER")
+    if not broker:
+        return LocalBackend()
+    host, _, port = broker.rpartition(":")
+    return BrokerBackend(host or "127.0.0.1", int(port))
+
+
+room_hub = RoomHub(backend_from_env())
+
+
+async def run_broker(host: str, port: int):
+    channels = defaultdict(set)
+
+    async def handle(reader, writer):
+        subscribed = set()
+        try:
+            async for line in reader:
+                message = json.loads(line)
+                channel = message.get("channel")
+                if message["op"] == "sub":
+                    channels[channel].add(writer)
+                    subscribed.add(channel)
+                elif message["op"] == "unsub":
+                    channels[channel].discard(writer)
+                    subscribed.discard(channel)
+                elif message["op"] == "pub":
+                    data = json.dumps({"channel": channel, "frame": message["frame"]}).encode("utf-8") + b"\n"
+                    for subscriber in list(channels.get(channel, ())):
+                        # Never let one stalled worker back up the broker
+                        if subscriber.transport.get_write_buffer_size() > BROKER_MAX_WRITE_BUFFER:
+                            logger.warning("Disconnecting slow room hub client")
+                            subscriber.close()
+                            channels[channel].discard(subscriber)
+                            continue
+                        subscriber.write(data)
+        except (ConnectionError, asyncio.IncompleteReadError, json.JSONDecodeError) as e:
+            logger.warning(f"Room hub client error: {e}")
+        finally:
+            for channel in subscribed:
+                channels[channel].discard(writer)
+                if not channels[channel]:
+                    channels.pop(channel, None)
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port, limit=BROKER_LINE_LIMIT)
+    logger.info(f"Room hub broker listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Room hub broker for fanning chat frames out across API workers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    asyncio.run(run_broker(args.host, args.port))
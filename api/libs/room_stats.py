@@ -0,0 +1,116 @@
+"""Denormalized per-room aggregates for room listings: turn count, last message time and preview.
+
+They are kept on the chatroom row and updated in the same transaction as the conversation write
+that changes them (libs/persistence.py for chat turns, libs/bulk.py for imports), so a listing
+reads them with the room and never counts conversations. Archiving moves turns out of the
+conversation table without changing the room's aggregates. Rooms created before the columns
+existed are filled in once by backfill() at startup.
+"""
+import logging
+from datetime import datetime
+from sqlalchemy import and_, case, func, or_, select, update
+from schemas.models import ArchivedSegment, ChatRoom, Conversation
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+PREVIEW_CHARS = 120
+
+
+def preview(text: str | None) -> str:
+    text = " ".join((text or "").split())
+    return text if len(text) <= PREVIEW_CHARS else text[:PREVIEW_CHARS - 1] + "…"
+
+
+def record_query(session, room_id, timestamp: datetime, query: str):
+    """A new turn was started in the room."""
+    session.execute(
+        update(ChatRoom).where(ChatRoom.id == room_id).values(
+            turnCount=func.coalesce(ChatRoom.turnCount, 0) + 1,
+            lastMessageAt=timestamp,
+            lastMessagePreview=preview(query),
+        ).execution_options(synchronize_session=False)
+    )
+
+
+def record_response(session, conversation_id: int, response: str):
+    """The turn's response was completed; it is now the room's last message."""
+    room_id = select(Conversation.chatRoom_id).where(Conversation.id == conversation_id).scalar_subquery()
+    session.execute(
+        update(ChatRoom).where(ChatRoom.id == room_id).values(
+            lastMessageAt=datetime.utcnow(),
+            lastMessagePreview=preview(response),
+        ).execution_options(synchronize_session=False)
+    )
+
+
+def record_imported(session, rows: list):
+    """Imported turns, as bulk import rows; imported history may be older than the room's last message."""
+    rooms = {}
+    for row in rows:
+        turns, latest = rooms.get(row["chatRoom_id"], (0, None))
+        if latest is None or row["timestamp"] >= latest["timestamp"]:
+            latest = row
+        rooms[row["chatRoom_id"]] = (turns + 1, latest)
+    for room_id, (turns, latest) in rooms.items():
+        newer = or_(ChatRoom.lastMessageAt.is_(None), ChatRoom.lastMessageAt < latest["timestamp"])
+        session.execute(
+            update(ChatRoom).where(ChatRoom.id == room_id).values(
+                turnCount=func.coalesce(ChatRoom.turnCount, 0) + turns,
+                lastMessageAt=case((newer, latest["timestamp"]), else_=ChatRoom.lastMessageAt),
+                lastMessagePreview=case(
+                    (newer, preview(latest["responseMessage"] or latest["query"])),
+                    else_=ChatRoom.lastMessagePreview,
+                ),
+            ).execution_options(synchronize_session=False)
+        )
+
+
+def backfill(session) -> int:
+    """Compute the aggregates of rooms that have none yet; returns the number of rooms filled in."""
+    live = select(func.count(Conversation.id)).where(Conversation.chatRoom_id == ChatRoom.id).scalar_subquery()
+    archived = (
+        select(func.coalesce(func.sum(ArchivedSegment.turnCount), 0))
+        .where(ArchivedSegment.chatRoom_id == ChatRoom.id)
+        .scalar_subquery()
+    )
+    last_live = select(func.max(Conversation.timestamp)).where(Conversation.chatRoom_id == ChatRoom.id).scalar_subquery()
+    last_archived = (
+        select(func.max(ArchivedSegment.lastMessageAt))
+        .where(ArchivedSegment.chatRoom_id == ChatRoom.id)
+        .scalar_subquery()
+    )
+    # Archived turns are older than the live ones, so the preview comes from the latest live turn
+    last_text = (
+        select(func.coalesce(func.nullif(Conversation.responseMessage, ""), Conversation.query))
+        .where(Conversation.chatRoom_id == ChatRoom.id)
+        .order_by(Conversation.timestamp.desc(), Conversation.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    result = session.execute(
+        update(ChatRoom).where(ChatRoom.turnCount.is_(None)).values(
+            turnCount=live + archived,
+            lastMessageAt=func.coalesce(last_live, last_archived),
+            lastMessagePreview=func.substr(last_text, 1, PREVIEW_CHARS),
+        ).execution_options(synchronize_session=False)
+    )
+    session.commit()
+    if result.rowcount:
+        logger.info(f"Backfilled listing aggregates for {result.rowcount} rooms")
+    return result.rowcount
+
+
+def recent_after(last_message_at: datetime | None, room_id):
+    """Keyset condition for rooms after (last_message_at, room_id) in most recent first order.
+
+    Rooms without messages sort last (NULLs come last in a descending SQLite index scan).
+    """
+    if last_message_at is None:
+        return and_(ChatRoom.lastMessageAt.is_(None), ChatRoom.id < room_id)
+    return or_(
+        ChatRoom.lastMessageAt < last_message_at,
+        and_(ChatRoom.lastMessageAt == last_message_at, ChatRoom.id < room_id),
+        ChatRoom.lastMessageAt.is_(None),
+    )
@@ -0,0 +1,155 @@
+"""Priority lanes for local generation.
+
+Every generation runs in one of three lanes, highest priority first:
+
+    interactive  chat turns from ws_chat; runs on the caller's thread and never waits
+    background   room summarization and other maintenance
+    bulk         batch jobs
+
+Lower lanes run on their own worker threads, with the lane's CPU quota applied to each of them:
+a nice value and an optional CPU list. torch's intra-op thread count is process-wide, so every
+lane uses the one set by apply_cpu_settings(). Lower lanes are preempted at token boundaries:
+PauseCriteria is consulted by generate() after every token and blocks while any higher lane has
+a generation running. The paused generate() call keeps its KV cache, so it resumes exactly where
+it stopped once the higher lanes drain.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from libs import metrics
+from libs.model_loader import parse_cpu_list, set_thread_affinity
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+INTERACTIVE = "interactive"
+BACKGROUND  = "background"
+BULK        = "bulk"
+LANES       = (INTERACTIVE, BACKGROUND, BULK)
+
+# Per-lane CPU quota: worker threads, nice value, CPU list.
+# The interactive lane keeps the process-wide settings from apply_cpu_settings().
+LANE_QUOTAS = {
+    INTERACTIVE: {"workers": None, "nice": 0, "cpus": None},
+    BACKGROUND:  {"workers": 1, "nice": 10, "cpus": os.environ.get("BACKGROUND_LANE_CPUS")},
+    BULK:        {"workers": 1, "nice": 19, "cpus": os.environ.get("BULK_LANE_CPUS")},
+}
+
+# Re-check interval while paused, so a missed notification can only delay a resume briefly
+PAUSE_POLL_SECONDS = 1.0
+
+
+def _apply_quota(lane: str, quota: dict):
+    # Linux applies nice values and affinity per thread; OpenMP pools started from this thread inherit both
+    tid = threading.get_native_id()
+    try:
+        if quota["nice"]:
+            os.setpriority(os.PRIO_PROCESS, tid, quota["nice"])
+        if quota["cpus"]:
+            set_thread_affinity(parse_cpu_list(quota["cpus"]))
+    except (AttributeError, OSError) as e:
+        logger.debug(f"Could not apply CPU quota for lane '{lane}': {e}")
+
+
+class GenerationScheduler:
+    def __init__(self, quotas: dict = LANE_QUOTAS):
+        self.quotas  = quotas
+        self.active  = {lane: 0 for lane in LANES}
+        self.paused  = {lane: 0 for lane in LANES}
+        self.last_finished = {lane: 0.0 for lane in LANES}
+        self._cond   = threading.Condition()
+        self._pools  = {}
+        self._pools_lock = threading.Lock()
+
+    def _pool(self, lane: str) -> ThreadPoolExecutor:
+        with self._pools_lock:
+            pool = self._pools.get(lane)
+            if pool is None:
+                quota = self.quotas[lane]
+                pool = ThreadPoolExecutor(
+                    max_workers=quota["workers"] or 1,
+                    thread_name_prefix=f"lane-{lane}",
+                    initializer=_apply_quota,
+                    initargs=(lane, quota),
+                )
+                self._pools[lane] = pool
+            return pool
+
+    def _higher_active(self, lane: str) -> bool:
+        return any(self.active[higher] for higher in LANES[:LANES.index(lane)])
+
+    @contextmanager
+    def running(self, lane: str):
+        """Mark a generation as running in lane for as long as the block lasts."""
+        with self._cond:
+            self.active[lane] += 1
+            metrics.set_gauge("lane_active", self.active[lane], lane=lane)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active[lane] -= 1
+                self.last_finished[lane] = time.monotonic()
+                metrics.set_gauge("lane_active", self.active[lane], lane=lane)
+                self._cond.notify_all()
+
+    def submit(self, lane: str, fn, *args, **kwargs) -> Future:
+        """Run fn on one of the lane's worker threads, inside running(lane)."""
+        if lane == INTERACTIVE:
+            raise ValueError("Interactive generations run on the caller's thread, use running() instead")
+
+        def job():
+            # Wait for the turn before starting too, so a queued job never begins its prefill mid-turn
+            self.checkpoint(lane)
+            with self.running(lane):
+                return fn(*args, **kwargs)
+
+        return self._pool(lane).submit(job)
+
+    def checkpoint(self, lane: str):
+        """Block while a higher-priority lane has a generation running."""
+        with self._cond:
+            if not self._higher_active(lane):
+                return
+            start = time.monotonic()
+            self.paused[lane] += 1
+            metrics.incr("lane_preemptions", lane=lane)
+            metrics.set_gauge("lane_paused", self.paused[lane], lane=lane)
+            while self._higher_active(lane):
+                self._cond.wait(PAUSE_POLL_SECONDS)
+            self.paused[lane] -= 1
+            metrics.set_gauge("lane_paused", self.paused[lane], lane=lane)
+        metrics.observe("lane_pause_seconds", time.monotonic() - start, lane=lane)
+
+    def idle_seconds(self, lane: str = INTERACTIVE) -> float:
+        """Seconds since the lane's last generation finished, or 0 while one is running."""
+        with self._cond:
+            if self.active[lane]:
+                return 0.0
+            return time.monotonic() - self.last_finished[lane]
+
+    def shutdown(self):
+        with self._pools_lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def pause_criteria(scheduler: GenerationScheduler, lane: str):
+    """StoppingCriteria for generate() that pauses a lower-lane generation at token boundaries."""
+    import torch
+    from transformers import StoppingCriteria
+
+    class PauseCriteria(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            scheduler.checkpoint(lane)
+            return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+    return PauseCriteria()
+
+
+generation_scheduler = GenerationScheduler()
@@ -0,0 +1,88 @@
+"""Fast serialization path for large list responses.
+
+Rows are read straight from the query in partitions of ROW_BATCH_SIZE, as plain column tuples
+with no ORM identity map, and turned into dicts. Each partition is encoded with one encoder
+call and written to the response as soon as it is ready, with no response_model validation or
+jsonable_encoder pass. orjson is used when installed, the stdlib json module otherwise. A client
+sending `Accept: application/msgpack` gets MessagePack instead, if the optional msgpack package
+is installed. MessagePack needs the item count up front, so that body is built in one go rather
+than streamed.
+"""
+import json
+import uuid
+from datetime import date, datetime
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+ROW_BATCH_SIZE      = 1000
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def wants_msgpack(request: Request) -> bool:
+    accept = request.headers.get("accept", "")
+    return msgpack is not None and any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES)
+
+
+def json_chunks(batches, head: dict | None = None, key: str | None = None):
+    """Encode batches of items as a JSON array, or as head[key] inside the head object."""
+    if key is None:
+        yield b"["
+    else:
+        encoded = dumps(head or {})
+        yield encoded[:-1] + (b"," if len(encoded) > 2 else b"") + dumps(key) + b":["
+    first = True
+    for batch in batches:
+        if not batch:
+            continue
+        # Strip the brackets of the encoded batch to splice it into the open array
+        body = dumps(batch)[1:-1]
+        yield body if first else b"," + body
+        first = False
+    yield b"]" if key is None else b"]}"
+
+
+def list_response(request: Request, batches, head: dict | None = None, key: str | None = None) -> Response:
+    """Response for a list of items produced in batches: a bare array, or head with the list under key."""
+    if wants_msgpack(request):
+        items = [item for batch in batches for item in batch]
+        body  = dict(head or {}, **{key: items}) if key is not None else items
+        return Response(msgpack.packb(body, default=_default, use_bin_type=True), media_type=MSGPACK_MEDIA_TYPES[0])
+    return StreamingResponse(json_chunks(batches, head, key), media_type="application/json")
+
+
+def query_batches(session_factory, statement, to_item, batch_size: int = ROW_BATCH_SIZE):
+    """Batches of to_item(row) for a Core select, read with a server-side cursor.
+
+    The generator owns its session, because a streamed response outlives the request's DB dependency.
+    """
+    session = session_factory()
+    try:
+        result = session.execute(statement.execution_options(yield_per=batch_size))
+        for partition in result.partitions():
+            yield [to_item(row) for row in partition]
+    finally:
+        session.close()
@@ -0,0 +1,78 @@
+"""Precompressed, cached static UI assets.
+
+Every file under STATIC_PATH is read once, at startup. At that point its gzip and (if available)
+brotli variants are compressed at the highest levels. Each variant gets a strong ETag derived
+from the content hash and the encoding. A request is then served from memory with the variant
+its Accept-Encoding prefers. A matching If-None-Match gets a 304 without a body.
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+from collections import namedtuple
+from fastapi import Request, Response
+from libs.compression import compress, negotiate, supported_encodings
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+STATIC_PATH   = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
+CACHE_CONTROL = "public, max-age=300"  # short, so a deploy reaches browsers quickly; revalidation is a cheap 304
+
+StaticAsset = namedtuple("StaticAsset", ["media_type", "etag", "variants"])  # variants: encoding -> (body, etag)
+
+assets = {}
+
+
+def build_asset(name: str, body: bytes) -> StaticAsset:
+    digest     = hashlib.sha256(body).hexdigest()[:32]
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    variants = {None: (body, f'"{digest}"')}
+    for encoding in supported_encodings():
+        compressed = compress(body, encoding, best=True)
+        # A variant that does not shrink the asset is never worth the decode on the client
+        if len(compressed) < len(body):
+            variants[encoding] = (compressed, f'"{digest}-{encoding}"')
+    return StaticAsset(media_type, f'"{digest}"', variants)
+
+
+def load_assets(path: str = STATIC_PATH) -> dict:
+    loaded = {}
+    for name in sorted(os.listdir(path)):
+        full_path = os.path.join(path, name)
+        if os.path.isfile(full_path):
+            with open(full_path, "rb") as f:
+                loaded[name] = build_asset(name, f.read())
+    assets.clear()
+    assets.update(loaded)
+    for name, asset in assets.items():
+        sizes = ", ".join(f"{encoding or 'identity'}={len(body)}" for encoding, (body, _) in asset.variants.items())
+        logger.info(f"Static asset {name}: {sizes}")
+    return assets
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so a W/ prefix added by a proxy still matches
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in if_none_match.split(","))
+
+
+def asset_response(request: Request, name: str) -> Response:
+    if not assets:
+        load_assets()
+    asset    = assets[name]
+    encoding = negotiate(request.headers.get("accept-encoding"))
+    body, etag = asset.variants.get(encoding) or asset.variants[None]
+    if etag == asset.variants[None][1]:
+        encoding = None
+
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=asset.media_type, headers=headers)
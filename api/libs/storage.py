@@ -0,0 +1,491 @@
+"""Object storage for uploaded documents.
+
+Documents are addressed by key ("<username>/<fileName>") through a StorageDriver, so API nodes
+can share one S3-compatible bucket instead of each writing to its own disk:
+
+    LocalDriver   files under a root directory (the default, object-storage/)
+    S3Driver      any S3-compatible endpoint (AWS, MinIO, ...) using path-style requests signed
+                  with SigV4; large uploads are split into parts sent in parallel
+    CachedDriver  wraps another driver with an LRU read-through cache on local disk, capped in
+                  size and revalidated against the object's ETag
+
+The driver is chosen from the environment (DOCUMENT_STORAGE=local|s3, see storage_from_env).
+"""
+import datetime
+import hashlib
+import hmac
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from libs import metrics
+from libs.providers import http_session
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+LOCAL_STORAGE_PATH  = os.path.abspath("object-storage")
+CHUNK_SIZE          = 256 * 1024
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+PART_SIZE           = 8 * 1024 * 1024   # S3 requires at least 5 MiB for every part but the last
+UPLOAD_WORKERS      = 4
+REQUEST_TIMEOUT     = 60.0
+CACHE_MAX_BYTES     = 1024 * 1024 * 1024
+
+
+class StorageError(Exception):
+    pass
+
+
+class ObjectNotFound(StorageError):
+    pass
+
+
+def validate_key(key: str) -> str:
+    parts = key.split("/")
+    if not key or key.startswith("/") or any(part in ("", ".", "..") for part in parts) or "\\" in key:
+        raise StorageError(f"Invalid object key '{key}'")
+    return key
+
+
+def document_key(username: str, file_name: str) -> str:
+    return validate_key(f"{username}/{file_name}")
+
+
+def storage_root() -> str:
+    """Root directory of the configured local driver; other drivers use the default root for legacy paths."""
+    return document_storage.root if isinstance(document_storage, LocalDriver) else LOCAL_STORAGE_PATH
+
+
+def stored_key(file_path: str) -> str:
+    """Object key for a Document.filePath; rows from before the storage drivers hold absolute local paths.
+
+    A legacy path outside the storage root has no object key, so it raises ObjectNotFound.
+    """
+    if os.path.isabs(file_path):
+        key = os.path.relpath(file_path, storage_root()).replace(os.sep, "/")
+        if key == ".." or key.startswith("../"):
+            raise ObjectNotFound(file_path)
+        return key
+    return file_path
+
+
+def document_path(file_path: str) -> str:
+    """What the API returned as filePath before the storage drivers: the absolute path under the storage root."""
+    if os.path.isabs(file_path):
+        return file_path
+    return os.path.join(storage_root(), *file_path.split("/"))
+
+
+class StorageDriver:
+    name = "storage"
+
+    def put(self, key: str, fileobj, size: int | None = None) -> int:
+        """Store the contents of a binary file object under key; returns the bytes written."""
+        raise NotImplementedError
+
+    def stream(self, key: str, start: int = 0, end: int | None = None, chunk_size: int = CHUNK_SIZE):
+        """Iterator of byte chunks of the object, optionally only bytes start..end (inclusive)."""
+        raise NotImplementedError
+
+    def stat(self, key: str) -> dict:
+        """{"size": ..., "etag": ...}; raises ObjectNotFound."""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def rename(self, src: str, dst: str):
+        raise NotImplementedError
+
+    def get(self, key: str) -> bytes:
+        return b"".join(self.stream(key))
+
+    def get_range(self, key: str, start: int, end: int) -> bytes:
+        return b"".join(self.stream(key, start, end))
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.stat(key)
+            return True
+        except ObjectNotFound:
+            return False
+
+
+class LocalDriver(StorageDriver):
+    name = "local"
+
+    def __init__(self, root: str = LOCAL_STORAGE_PATH):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *validate_key(key).split("/"))
+
+    def put(self, key, fileobj, size=None):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(fileobj, f, CHUNK_SIZE)
+                written = f.tell()
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return written
+
+    def stream(self, key, start=0, end=None, chunk_size=CHUNK_SIZE):
+        path = self.path(key)
+        if not os.path.isfile(path):
+            raise ObjectNotFound(key)
+
+        def chunks():
+            with open(path, "rb") as f:
+                f.seek(start)
+                remaining = None if end is None else end - start + 1
+                while remaining is None or remaining > 0:
+                    chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                    if not chunk:
+                        return
+                    if remaining is not None:
+                        remaining -= len(chunk)
+                    yield chunk
+
+        return chunks()
+
+    def stat(self, key):
+        try:
+            st = os.stat(self.path(key))
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+        return {"size": st.st_size, "etag": f"{st.st_mtime_ns:x}-{st.st_size:x}"}
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+
+    def rename(self, src, dst):
+        dst_path = self.path(dst)
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        try:
+            os.rename(self.path(src), dst_path)
+        except FileNotFoundError:
+            raise ObjectNotFound(src)
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _hmac(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode("utf-8"), hashlib.sha256).digest()
+
+
+class S3Driver(StorageDriver):
+    name = "s3"
+
+    def __init__(
+        self,
+        endpoint: str,
+        bucket: str,
+        access_key: str,
+        secret_key: str,
+        region: str = "us-east-1",
+        part_size: int = PART_SIZE,
+        multipart_threshold: int = MULTIPART_THRESHOLD,
+        upload_workers: int = UPLOAD_WORKERS,
+    ):
+        self.endpoint   = endpoint.rstrip("/")
+        self.bucket     = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region     = region
+        self.part_size  = part_size
+        self.multipart_threshold = multipart_threshold
+        self.upload_workers      = upload_workers
+        self.host = self.endpoint.split("://", 1)[-1]
+
+    def _path(self, key: str | None) -> str:
+        path = f"/{quote(self.bucket, safe='')}"
+        if key is not None:
+            path += "/" + quote(validate_key(key), safe="/-_.~")
+        return path
+
+    def _sign(self, method: str, path: str, params: dict, headers: dict, payload_hash: str) -> dict:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date = now.strftime("%Y%m%d")
+        headers = {**headers, "host": self.host, "x-amz-date": amz_date, "x-amz-content-sha256": payload_hash}
+        signed = sorted(name.lower() for name in headers)
+        lowered = {name.lower(): str(value).strip() for name, value in headers.items()}
+        canonical_query = "&".join(
+            f"{quote(str(k), safe='-_.~')}={quote(str(v), safe='-_.~')}" for k, v in sorted(params.items())
+        )
+        canonical_request = "\n".join([
+            method,
+            path,
+            canonical_query,
+            "".join(f"{name}:{lowered[name]}\n" for name in signed),
+            ";".join(signed),
+            payload_hash,
+        ])
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        string_to_sign = f"AWS4-HMAC-SHA256\n{amz_date}\n{scope}\n{_sha256(canonical_request.encode('utf-8'))}"
+        key = _hmac(("AWS4" + self.secret_key).encode("utf-8"), date)
+        for part in (self.region, "s3", "aws4_request"):
+            key = _hmac(key, part)
+        signature = hmac.new(key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+        headers["Authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={';'.join(signed)}, Signature={signature}"
+        )
+        del headers["host"]
+        return headers
+
+    def _request(self, method: str, key: str | None, params: dict | None = None, headers: dict | None = None,
+                 data: bytes = b"", stream: bool = False, ok=(200, 204, 206)):
+        params = params or {}
+        path = self._path(key)
+        signed = self._sign(method, path, params, headers or {}, _sha256(data))
+        response = http_session(self.name, self.endpoint).request(
+            method, self.endpoint + path, params=params, headers=signed, data=data or None,
+            stream=stream, timeout=REQUEST_TIMEOUT,
+        )
+        if response.status_code == 404:
+            response.close()
+            raise ObjectNotFound(key)
+        if response.status_code not in ok:
+            text = response.text[:500]
+            response.close()
+            raise StorageError(f"S3 {method} {key} failed with {response.status_code}: {text}")
+        return response
+
+    def put(self, key, fileobj, size=None):
+        first = fileobj.read(self.multipart_threshold)
+        if len(first) < self.multipart_threshold:
+            self._request("PUT", key, data=first)
+            return len(first)
+        return self._put_multipart(key, first, fileobj)
+
+    def _put_multipart(self, key, first: bytes, fileobj) -> int:
+        response = self._request("POST", key, params={"uploads": ""})
+        upload_id = ET.fromstring(response.content).findtext("{*}UploadId")
+        if not upload_id:
+            raise StorageError(f"S3 did not return an upload id for {key}")
+
+        def upload_part(number: int, data: bytes) -> tuple:
+            part = self._request("PUT", key, params={"partNumber": number, "uploadId": upload_id}, data=data)
+            return number, part.headers["ETag"]
+
+        etags   = []
+        total   = 0
+        pending = []
+        buffer  = first
+        try:
+            with ThreadPoolExecutor(max_workers=self.upload_workers, thread_name_prefix="s3-upload") as pool:
+                number = 0
+                while True:
+                    while len(buffer) < self.part_size:
+                        more = fileobj.read(self.part_size - len(buffer))
+                        if not more:
+                            break
+                        buffer += more
+                    if not buffer:
+                        break
+                    data, buffer = buffer[:self.part_size], buffer[self.part_size:]
+                    number += 1
+                    total  += len(data)
+                    pending.append(pool.submit(upload_part, number, data))
+                    # Keep at most one part per worker in memory
+                    if len(pending) >= self.upload_workers:
+                        etags.append(pending.pop(0).result())
+                etags.extend(future.result() for future in pending)
+        except BaseException:
+            try:
+                self._request("DELETE", key, params={"uploadId": upload_id})
+            except StorageError as e:
+                logger.warning(f"Could not abort multipart upload {upload_id} for {key}: {e}")
+            raise
+
+        body = "<CompleteMultipartUpload>" + "".join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>" for number, etag in sorted(etags)
+        ) + "</CompleteMultipartUpload>"
+        response = self._request("POST", key, params={"uploadId": upload_id}, data=body.encode("utf-8"))
+        # S3 can report a failed completion with a 200 status and an Error document
+        if b"<Error>" in response.content:
+            raise StorageError(f"S3 multipart completion failed for {key}: {response.text[:500]}")
+        metrics.incr("storage_multipart_uploads")
+        metrics.incr("storage_multipart_parts", len(etags))
+        return total
+
+    def stream(self, key, start=0, end=None, chunk_size=CHUNK_SIZE):
+        headers = {}
+        if start or end is not None:
+            headers["Range"] = f"bytes={start}-{'' if end is None else end}"
+        response = self._request("GET", key, headers=headers, stream=True)
+
+        def chunks():
+            with response:
+                yield from response.iter_content(chunk_size)
+
+        return chunks()
+
+    def stat(self, key):
+        response = self._request("HEAD", key)
+        return {"size": int(response.headers.get("Content-Length", 0)), "etag": response.headers.get("ETag", "").strip('"')}
+
+    def delete(self, key):
+        self.stat(key)
+        self._request("DELETE", key)
+
+    def rename(self, src, dst):
+        # S3 has no rename: server-side copy, then delete the source
+        copy_source = quote(f"{self.bucket}/{validate_key(src)}", safe="/-_.~")
+        response = self._request("PUT", dst, headers={"x-amz-copy-source": copy_source})
+        if b"<Error>" in response.content:
+            raise StorageError(f"S3 copy {src} -> {dst} failed: {response.text[:500]}")
+        self._request("DELETE", src)
+
+
+class CachedDriver(StorageDriver):
+    """Read-through LRU cache on local disk in front of a remote driver.
+
+    Reads of an object whose cached ETag still matches the remote one are served locally; a miss
+    downloads the whole object once. The least recently used files are evicted once the cache
+    exceeds max_bytes. Objects larger than max_bytes are never cached.
+    """
+
+    def __init__(self, driver: StorageDriver, cache_path: str, max_bytes: int = CACHE_MAX_BYTES):
+        self.driver     = driver
+        self.name       = f"cached-{driver.name}"
+        self.cache_path = os.path.abspath(cache_path)
+        self.max_bytes  = max_bytes
+        self.entries    = OrderedDict()  # key -> (etag, size), least recently used first
+        self.size       = 0
+        self._lock      = threading.Lock()
+        # The index lives in memory, so whatever a previous process left behind is unusable
+        shutil.rmtree(self.cache_path, ignore_errors=True)
+        os.makedirs(self.cache_path, exist_ok=True)
+
+    def _cache_file(self, key: str) -> str:
+        return os.path.join(self.cache_path, hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+    def _evict(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+            try:
+                os.remove(self._cache_file(key))
+            except FileNotFoundError:
+                pass
+
+    def _fill(self, key: str, stat: dict) -> bool:
+        if stat["size"] > self.max_bytes:
+            return False
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_path, prefix=".fill-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in self.driver.stream(key):
+                    f.write(chunk)
+            os.replace(tmp_path, self._cache_file(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        with self._lock:
+            self._evict(key)
+            self.entries[key] = (stat["etag"], stat["size"])
+            self.size += stat["size"]
+            while self.size > self.max_bytes and self.entries:
+                oldest = next(iter(self.entries))
+                self._evict(oldest)
+                metrics.incr("storage_cache_evictions")
+        return True
+
+    def _lookup(self, key: str) -> bool:
+        stat = self.driver.stat(key)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == stat["etag"]:
+                self.entries.move_to_end(key)
+                metrics.incr("storage_cache_hits")
+                return True
+        metrics.incr("storage_cache_misses")
+        return self._fill(key, stat)
+
+    def stream(self, key, start=0, end=None, chunk_size=CHUNK_SIZE):
+        if not self._lookup(key):
+            return self.driver.stream(key, start, end, chunk_size)
+        path = self._cache_file(key)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            # Evicted between the lookup and the open
+            return self.driver.stream(key, start, end, chunk_size)
+
+        def chunks():
+            with f:
+                f.seek(start)
+                remaining = None if end is None else end - start + 1
+                while remaining is None or remaining > 0:
+                    chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                    if not chunk:
+                        return
+                    if remaining is not None:
+                        remaining -= len(chunk)
+                    yield chunk
+
+        return chunks()
+
+    def put(self, key, fileobj, size=None):
+        with self._lock:
+            self._evict(key)
+        return self.driver.put(key, fileobj, size)
+
+    def stat(self, key):
+        return self.driver.stat(key)
+
+    def delete(self, key):
+        with self._lock:
+            self._evict(key)
+        self.driver.delete(key)
+
+    def rename(self, src, dst):
+        with self._lock:
+            self._evict(src)
+            self._evict(dst)
+        self.driver.rename(src, dst)
+
+
+def storage_from_env() -> StorageDriver:
+    # DOCUMENT_STORAGE=s3 shares documents between API nodes; otherwise keep them on local disk
+    kind = os.environ.get("DOCUMENT_STORAGE", "local").lower()
+    if kind == "local":
+        return LocalDriver(os.environ.get("DOCUMENT_STORAGE_PATH", LOCAL_STORAGE_PATH))
+    if kind != "s3":
+        raise ValueError(f"Unknown DOCUMENT_STORAGE '{kind}', expected local or s3")
+    driver = S3Driver(
+        endpoint=os.environ["S3_ENDPOINT"],
+        bucket=os.environ["S3_BUCKET"],
+        access_key=os.environ["S3_ACCESS_KEY"],
+        secret_key=os.environ["S3_SECRET_KEY"],
+        region=os.environ.get("S3_REGION", "us-east-1"),
+    )
+    cache_mb = int(os.environ.get("DOCUMENT_CACHE_MB", CACHE_MAX_BYTES // (1024 * 1024)))
+    if cache_mb <= 0:
+        return driver
+    # One cache directory per worker process, since each keeps its own index
+    cache_path = os.path.join(os.environ.get("DOCUMENT_CACHE_PATH", os.path.join("storage", "document-cache")), str(os.getpid()))
+    return CachedDriver(driver, cache_path, cache_mb * 1024 * 1024)
+
+
+document_storage = storage_from_env()
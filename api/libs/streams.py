@@ -0,0 +1,120 @@
+"""Replay buffers for in-flight chat turns so a reconnecting client can resume a stream.
+
+Every turn gets a stream id. Each chunk the generator emits is numbered with an increasing
+offset and kept in a bounded buffer, so a client that reconnects with the last offset it saw
+receives only what it missed and then the live tail. If it fell further behind than the
+buffer holds, it gets the full text so far (marked as a resync) instead.
+
+turn_activity counts the turns in flight, local or remote, for work that must not overlap with
+them (SQLite maintenance in libs/retention.py).
+"""
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+REPLAY_BUFFER_CHUNKS = 4096
+STREAM_RETENTION = 120.0  # seconds a finished stream stays resumable
+
+
+class StreamBuffer:
+    def __init__(self, room_key: str, conversation_id: int, maxlen: int = REPLAY_BUFFER_CHUNKS):
+        self.stream_id       = uuid.uuid4().hex
+        self.room_key        = room_key
+        self.conversation_id = conversation_id
+        self.chunks      = deque(maxlen=maxlen)
+        self.offset      = 0
+        self.text        = ""
+        self.done        = False
+        self.finished_at = None
+
+    def append(self, delta: str) -> int:
+        self.offset += 1
+        self.chunks.append((self.offset, delta))
+        self.text += delta
+        return self.offset
+
+    def finish(self):
+        self.done = True
+        self.finished_at = time.monotonic()
+
+    def replay_frame(self, last_offset: int):
+        """Frame carrying everything after last_offset, or None if the client is up to date."""
+        if last_offset >= self.offset and not self.done:
+            return None
+        first_buffered = self.chunks[0][0] if self.chunks else self.offset + 1
+        resync = last_offset + 1 < first_buffered
+        delta  = None if resync else "".join(chunk for offset, chunk in self.chunks if offset > last_offset)
+        return {
+            "type": "replay",
+            "stream_id": self.stream_id,
+            "conversation_id": self.conversation_id,
+            "from_offset": last_offset,
+            "offset": self.offset,
+            "delta": delta,
+            "text": self.text,
+            "resync": resync,
+            "done": self.done,
+        }
+
+
+class StreamRegistry:
+    def __init__(self, retention: float = STREAM_RETENTION):
+        self.retention = retention
+        self.streams   = {}
+
+    def create(self, room_key: str, conversation_id: int) -> StreamBuffer:
+        self._expire()
+        stream = StreamBuffer(room_key, conversation_id)
+        self.streams[stream.stream_id] = stream
+        return stream
+
+    def get(self, stream_id: str):
+        self._expire()
+        return self.streams.get(stream_id)
+
+    def active_for_room(self, room_key: str):
+        for stream in self.streams.values():
+            if stream.room_key == room_key and not stream.done:
+                return stream
+        return None
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [
+            stream_id for stream_id, stream in self.streams.items()
+            if stream.done and now - stream.finished_at > self.retention
+        ]
+        for stream_id in expired:
+            del self.streams[stream_id]
+
+
+class TurnActivity:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = 0
+        self.last_finished = time.monotonic()
+
+    @contextmanager
+    def running(self):
+        """Mark a chat turn as in flight for as long as the block lasts."""
+        with self._lock:
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.last_finished = time.monotonic()
+
+    def idle_seconds(self) -> float:
+        """Seconds since the last turn finished, or 0 while one is in flight."""
+        with self._lock:
+            if self.active:
+                return 0.0
+            return time.monotonic() - self.last_finished
+
+
+stream_registry = StreamRegistry()
+turn_activity   = TurnActivity()
@@ -0,0 +1,177 @@
+"""Capture of chat turn inputs for offline replay and profiling (python -m libs.replay).
+
+A TurnTrace follows one ws_chat turn. get_llm_response times its stages and records the exact
+inputs it assembled: a snapshot of the setting (API keys left out), the messages, the prompt
+token ids for local models and the generation parameters. ws_chat adds time to first token and
+the generation stats. When the turn ends it is written if it was sampled (TRACE_SAMPLE_RATE) or
+took longer than TRACE_SLOW_SECONDS. The inputs are already in memory, so deciding at the end
+costs nothing for the turns that are dropped.
+
+Traces are appended as gzip members to one JSONL file per UTC day under TRACE_PATH. Token ids
+are stored as base64 int32 arrays.
+
+Trace files hold user content: the prompt, the full message list including room history and
+summary, and its token ids. Only API keys are left out. Deleting a room does not remove its
+turns from the trace files. Files older than TRACE_RETENTION_DAYS are deleted by the maintenance
+scheduler (libs/retention.py), so keep the retention short and TRACE_PATH private.
+"""
+import array
+import base64
+import gzip
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from libs import metrics
+from schemas.models import SETTING_SECRET_FIELDS, Setting
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+TRACE_PATH         = "./storage/traces"
+TRACE_SAMPLE_RATE  = float(os.environ.get("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_SECONDS = float(os.environ.get("TRACE_SLOW_SECONDS", "30"))
+TRACE_RETENTION_DAYS = float(os.environ.get("TRACE_RETENTION_DAYS", "7"))
+TRACE_VERSION      = 1
+
+SETTING_FIELDS = [column.name for column in Setting.__table__.columns if column.name not in SETTING_SECRET_FIELDS]
+
+
+def encode_token_ids(ids) -> str:
+    return base64.b64encode(array.array("i", ids).tobytes()).decode("ascii")
+
+
+def decode_token_ids(data: str) -> list:
+    ids = array.array("i")
+    ids.frombytes(base64.b64decode(data))
+    return ids.tolist()
+
+
+def snapshot_setting(setting: Setting) -> dict:
+    return {name: getattr(setting, name) for name in SETTING_FIELDS}
+
+
+class TurnTrace:
+    def __init__(self, room_id: str, prompt: str):
+        self.trace_id   = uuid.uuid4().hex
+        self.room_id    = room_id
+        self.prompt     = prompt
+        self.started_at = datetime.utcnow()
+        self.start      = time.perf_counter()
+        self.stages     = {}
+        self.inputs     = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def mark(self, name: str, seconds: float):
+        self.stages[name] = seconds
+
+    def capture(self, **inputs):
+        self.inputs.update(inputs)
+
+    def to_record(self, total: float, stats: dict | None, error: str | None, reason: str) -> dict:
+        inputs = dict(self.inputs)
+        if inputs.get("token_ids") is not None:
+            inputs["token_ids"] = encode_token_ids(inputs["token_ids"])
+        return {
+            "version": TRACE_VERSION,
+            "trace_id": self.trace_id,
+            "reason": reason,
+            "started_at": self.started_at.isoformat(),
+            "room_id": self.room_id,
+            "prompt": self.prompt,
+            "inputs": inputs,
+            "stages": {name: round(seconds, 6) for name, seconds in dict(self.stages, total=total).items()},
+            "stats": {key: value for key, value in (stats or {}).items() if key != "model"},
+            "error": error,
+        }
+
+
+class TraceWriter:
+    def __init__(self, path: str = TRACE_PATH, sample_rate: float = TRACE_SAMPLE_RATE, slow_seconds: float = TRACE_SLOW_SECONDS):
+        self.path         = path
+        self.sample_rate  = sample_rate
+        self.slow_seconds = slow_seconds
+        self._lock        = threading.Lock()
+
+    def _reason(self, total: float, error: str | None) -> str | None:
+        if total >= self.slow_seconds:
+            return "slow"
+        if error is not None:
+            return "error"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    def finish(self, trace: TurnTrace, stats: dict | None = None, error: str | None = None) -> bool:
+        """Write the trace if the turn is kept; returns whether it was."""
+        total  = time.perf_counter() - trace.start
+        reason = self._reason(total, error)
+        if reason is None or not trace.inputs:
+            return False
+        line = json.dumps(trace.to_record(total, stats, error, reason), ensure_ascii=False, default=str) + "\n"
+        path = os.path.join(self.path, f"turns-{trace.started_at:%Y%m%d}.jsonl.gz")
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            # One gzip member per trace; gzip readers see the concatenation as a single stream
+            with self._lock, open(path, "ab") as f:
+                f.write(gzip.compress(line.encode("utf-8")))
+        except OSError as e:
+            logger.error(f"Failed to write trace {trace.trace_id}: {e}")
+            return False
+        metrics.incr("traces_written", reason=reason)
+        logger.info(f"Trace {trace.trace_id} written to {path} ({reason}, {total:.2f}s)")
+        return True
+
+
+def prune_traces(path: str = TRACE_PATH, retention_days: float = TRACE_RETENTION_DAYS) -> int:
+    """Delete the trace files of UTC days older than retention_days; returns the number deleted."""
+    if not os.path.isdir(path):
+        return 0
+    cutoff  = datetime.utcnow() - timedelta(days=retention_days)
+    deleted = 0
+    for name in sorted(os.listdir(path)):
+        if not (name.startswith("turns-") and name.endswith(".jsonl.gz")):
+            continue
+        try:
+            day = datetime.strptime(name[len("turns-"):-len(".jsonl.gz")], "%Y%m%d")
+        except ValueError:
+            continue
+        # A file covers its whole day, so it goes once the end of that day is past the cutoff
+        if day + timedelta(days=1) > cutoff:
+            continue
+        try:
+            os.remove(os.path.join(path, name))
+            deleted += 1
+        except OSError as e:
+            logger.error(f"Failed to delete trace file {name}: {e}")
+    if deleted:
+        metrics.incr("traces_pruned", deleted)
+    return deleted
+
+
+def read_traces(path: str):
+    """Traces from a trace file, or from every trace file in a directory, oldest first."""
+    paths = [path]
+    if os.path.isdir(path):
+        paths = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".jsonl.gz")]
+    for file_path in paths:
+        with gzip.open(file_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+trace_writer = TraceWriter()
@@ -0,0 +1,249 @@
+"""Per-user token accounting and daily quotas.
+
+Every chat turn records its prompt and completion tokens, generation wall time and backend.
+Records are summed in memory per (user, backend, UTC hour) and flushed through the write-behind
+queue every FLUSH_INTERVAL seconds as upserts into UsageRollup. A turn therefore costs no DB
+write of its own, and range queries read at most one row per user, backend and hour. Each user's
+total for the current UTC day is also kept in memory, loaded from the rollups the first time
+the user is admitted that day, so quota checks do not sum rollups on every turn.
+"""
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from libs import metrics
+from libs.db import SessionLocal
+from libs.persistence import write_behind
+from schemas.models import Setting, UsageRollup, UserAccount
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+FLUSH_INTERVAL = 10.0  # seconds between rollup flushes
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, username: str, used: int, quota: int):
+        super().__init__(f"Daily token quota exceeded for '{username}': {used} of {quota} tokens used")
+        self.username = username
+        self.used     = used
+        self.quota    = quota
+
+
+def hour_bucket(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(moment: datetime) -> datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def daily_quota(db, username: str) -> int | None:
+    """The quota from the user's own setting, falling back to the global one used for generation."""
+    setting = (
+        db.query(Setting).join(UserAccount, UserAccount.setting_id == Setting.id)
+        .filter(UserAccount.username == username).first()
+    )
+    if setting is None:
+        setting = db.query(Setting).first()
+    return setting.dailyTokenQuota if setting is not None and setting.dailyTokenQuota else None
+
+
+def _upsert_rollups(session, rows: list):
+    stmt = insert(UsageRollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UsageRollup.username, UsageRollup.bucketStart, UsageRollup.backend],
+        set_={
+            "requests":         UsageRollup.requests + stmt.excluded.requests,
+            "promptTokens":     UsageRollup.promptTokens + stmt.excluded.promptTokens,
+            "completionTokens": UsageRollup.completionTokens + stmt.excluded.completionTokens,
+            "seconds":          UsageRollup.seconds + stmt.excluded.seconds,
+        },
+    )
+    session.execute(stmt, rows)
+
+
+class UsageTracker:
+    def __init__(self, queue=write_behind, flush_interval: float = FLUSH_INTERVAL):
+        self.queue          = queue
+        self.flush_interval = flush_interval
+        self._pending = defaultdict(lambda: [0, 0, 0, 0.0])  # (username, backend, bucket) -> requests, prompt, completion, seconds
+        self._flushing = []  # windows handed to the write-behind queue and not committed yet
+        self._today   = {}  # username -> (day start, tokens used)
+        self._lock    = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread  = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="usage-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush().result(timeout=timeout)
+
+    def record(self, username: str, backend: str, prompt_tokens: int, completion_tokens: int, seconds: float, requests: int = 1):
+        now = datetime.utcnow()
+        with self._lock:
+            entry = self._pending[(username, backend, hour_bucket(now))]
+            entry[0] += requests
+            entry[1] += prompt_tokens
+            entry[2] += completion_tokens
+            entry[3] += seconds
+            today = self._today.get(username)
+            if today is not None and today[0] == day_start(now):
+                self._today[username] = (today[0], today[1] + prompt_tokens + completion_tokens)
+        metrics.incr("usage_prompt_tokens", prompt_tokens, backend=backend)
+        metrics.incr("usage_completion_tokens", completion_tokens, backend=backend)
+
+    def used_today(self, db, username: str) -> int:
+        start = day_start(datetime.utcnow())
+        with self._lock:
+            today = self._today.get(username)
+            if today is not None and today[0] == start:
+                return today[1]
+
+        committed = (
+            db.query(func.coalesce(func.sum(UsageRollup.promptTokens + UsageRollup.completionTokens), 0))
+            .filter(UsageRollup.username == username, UsageRollup.bucketStart >= start)
+            .scalar()
+        )
+        with self._lock:
+            today = self._today.get(username)
+            if today is None or today[0] != start:
+                pending = sum(
+                    entry[1] + entry[2] for (user, _, bucket), entry in self._pending.items()
+                    if user == username and bucket >= start
+                )
+                today = self._today[username] = (start, int(committed) + pending)
+            return today[1]
+
+    def admit(self, username: str) -> int | None:
+        """Tokens the user may still spend today, or None without a quota. Raises QuotaExceeded."""
+        db = SessionLocal()
+        try:
+            quota = daily_quota(db, username)
+            if quota is None:
+                return None
+            used = self.used_today(db, username)
+        finally:
+            db.close()
+        if used >= quota:
+            metrics.incr("quota_rejections")
+            raise QuotaExceeded(username, used, quota)
+        return quota - used
+
+    def flush(self) -> Future:
+        """Queue the pending rollups; the returned Future resolves once they are committed."""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: [0, 0, 0, 0.0])
+            # Days other than today are never asked for again
+            start = day_start(datetime.utcnow())
+            self._today = {user: today for user, today in self._today.items() if today[0] == start}
+            if pending:
+                self._flushing.append(pending)
+        if not pending:
+            return self.queue.flush()
+
+        rows = [
+            {
+                "username": username, "bucketStart": bucket, "backend": backend, "requests": requests,
+                "promptTokens": prompt, "completionTokens": completion, "seconds": seconds,
+            }
+            for (username, backend, bucket), (requests, prompt, completion, seconds) in pending.items()
+        ]
+        future = self.queue.submit(lambda session: _upsert_rollups(session, rows))
+        future.add_done_callback(lambda done: self._flushed(done, pending))
+        return future
+
+    def _flushed(self, future: Future, pending: dict):
+        with self._lock:
+            self._flushing = [window for window in self._flushing if window is not pending]
+        if future.exception() is None:
+            return
+        metrics.incr("usage_flush_errors")
+        logger.error(f"Failed to flush usage rollups, keeping them for the next flush: {future.exception()}")
+        # Put the window back so its usage reaches the rollups with a later flush instead of being lost
+        with self._lock:
+            for key, (requests, prompt, completion, seconds) in pending.items():
+                entry = self._pending[key]
+                entry[0] += requests
+                entry[1] += prompt
+                entry[2] += completion
+                entry[3] += seconds
+
+    def uncommitted(self, username: str, start: datetime, end: datetime) -> dict:
+        """Usage of [start, end) still in memory or queued for the DB: (backend, bucket) -> requests, prompt, completion, seconds."""
+        usage = defaultdict(lambda: [0, 0, 0, 0.0])
+        with self._lock:
+            for window in [self._pending, *self._flushing]:
+                for (user, backend, bucket), entry in window.items():
+                    if user == username and start <= bucket < end:
+                        usage[(backend, bucket)] = [total + value for total, value in zip(usage[(backend, bucket)], entry)]
+        return usage
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Usage flush failed")
+
+
+def usage_rows(
+    db, username: str, start: datetime, end: datetime, granularity: str = "hour", by_backend: bool = False,
+    tracker: UsageTracker | None = None,
+) -> list:
+    """Rollups for [start, end) re-aggregated per hour or day, optionally per backend, as dicts.
+
+    The tracker's uncommitted usage is added on top, so recent turns are included without
+    waiting for their flush. It is read after the rollups: a window committed in between is
+    left out of this answer rather than counted twice.
+    """
+    bucket  = func.date(UsageRollup.bucketStart) if granularity == "day" else UsageRollup.bucketStart
+    columns = [bucket.label("bucket")] + ([UsageRollup.backend] if by_backend else [])
+    query = (
+        db.query(
+            *columns,
+            func.sum(UsageRollup.requests).label("requests"),
+            func.sum(UsageRollup.promptTokens).label("promptTokens"),
+            func.sum(UsageRollup.completionTokens).label("completionTokens"),
+            func.sum(UsageRollup.seconds).label("seconds"),
+        )
+        .filter(UsageRollup.username == username, UsageRollup.bucketStart >= start, UsageRollup.bucketStart < end)
+        .group_by(*columns)
+    )
+    rows = {}
+    for row in query.all():
+        rows[(row.bucket, row.backend if by_backend else None)] = [row.requests, row.promptTokens, row.completionTokens, row.seconds]
+    uncommitted = tracker.uncommitted(username, start, end) if tracker is not None else {}
+    for (backend, hour), entry in uncommitted.items():
+        # func.date() gives SQLite's YYYY-MM-DD text
+        key = (hour.date().isoformat() if granularity == "day" else hour, backend if by_backend else None)
+        rows[key] = [total + value for total, value in zip(rows.get(key, (0, 0, 0, 0.0)), entry)]
+
+    result = []
+    for (bucket_value, backend), (requests, prompt, completion, seconds) in sorted(rows.items(), key=lambda item: (item[0][0], item[0][1] or "")):
+        row = {"bucket": bucket_value, "requests": requests, "promptTokens": prompt, "completionTokens": completion, "seconds": seconds}
+        if by_backend:
+            row["backend"] = backend
+        result.append(row)
+    return result
+
+
+def default_range(days: int = 7):
+    end = hour_bucket(datetime.utcnow()) + timedelta(hours=1)
+    return day_start(end - timedelta(days=days)), end
+
+
+usage_tracker = UsageTracker()
@@ -1,7 +1,15 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from libs.compression import CompressionMiddleware
 from libs.db import init_db
-from router import auth, chat, ws_chat, ui, setting, document
+from libs.persistence import write_behind
+from libs.compaction import compaction_worker
+from libs.retention import maintenance_scheduler
+from libs.room_stats import backfill as backfill_room_stats
+from libs.scheduler import generation_scheduler
+from libs.static_assets import load_assets
+from libs.usage import usage_tracker
+from router import auth, chat, ws_chat, ui, setting, document, metrics, bulk, usage, batch
 from dependency import get_db
 from router.auth import get_user, get_password_hash
 from schemas.models import UserAccount, Setting
@@ -12,6 +20,7 @@ app = FastAPI()
 @app.on_event("startup")
 def on_startup():
     init_db()
+    load_assets()
     # Create default user
     db: Session = next(get_db())
     if not get_user(db, "admin"):
@@ -28,6 +37,21 @@ def on_startup():
         db.add(new_user)
         db.commit()
         db.refresh(new_user)
+    # Before any conversation write, which only increments the aggregates
+    backfill_room_stats(db)
+    write_behind.start()
+    usage_tracker.start()
+    compaction_worker.start()
+    maintenance_scheduler.start()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    compaction_worker.stop()
+    maintenance_scheduler.stop()
+    generation_scheduler.shutdown()
+    usage_tracker.stop()
+    # Make sure every queued conversation write reaches the DB before the process exits
+    write_behind.stop()
 
 # This regex allows requests from localhost, 127.0.0.1, and local IP addresses.
 #allow_origin_regex = r"http://(localhost|127\.0\.0\.1|192\.168\..*):\d+"
@@ -44,9 +68,16 @@ app.add_middleware(
 	allow_headers=["*"],
 )
 
+# Large JSON payloads such as chat history and document lists; streams and static assets are left alone
+app.add_middleware(CompressionMiddleware)
+
 app.include_router(auth.router)
 app.include_router(chat.router)
 app.include_router(ws_chat.router)
 app.include_router(ui.router)  
 app.include_router(setting.router)
 app.include_router(document.router)
+app.include_router(metrics.router)
+app.include_router(bulk.router)
+app.include_router(usage.router)
+app.include_router(batch.router)
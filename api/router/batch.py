@@ -0,0 +1,57 @@
+import asyncio
+import json
+import logging
+import uuid
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from dependency import get_db
+from libs.batch import parse_prompts, run_batch
+from libs.db import SessionLocal
+from libs.usage import QuotaExceeded, usage_tracker
+from router.auth import get_current_user
+from schemas.models import ChatRoom, UserAccount
+
+router = APIRouter(prefix="/chat", tags=["batch"])
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+
+@router.post("/batch")
+async def batch_completion(
+    request: Request,
+    room_id: uuid.UUID | None = None,
+    max_new_tokens: int | None = Query(None, ge=1),
+    db: Session = Depends(get_db),
+    current_user: UserAccount = Depends(get_current_user),
+):
+    username = current_user.username
+    if room_id is not None:
+        room = db.query(ChatRoom).filter(ChatRoom.id == room_id, ChatRoom.username == username).first()
+        if not room:
+            raise HTTPException(status_code=404, detail="Room not found")
+    try:
+        prompts = parse_prompts((await request.body()).decode("utf-8").splitlines())
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        # Rejected up front when nothing is left; run_batch admits every bucket or prompt again as it runs
+        token_budget = await asyncio.to_thread(usage_tracker.admit, username)
+    except QuotaExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    def generate():
+        # The response outlives the request's DB dependency, so the stream owns its session
+        session = SessionLocal()
+        try:
+            for record in run_batch(session, username, prompts, str(room_id) if room_id else None, max_new_tokens, token_budget):
+                yield (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        except ValueError as e:
+            yield (json.dumps({"type": "error", "id": None, "error": str(e)}) + "\n").encode("utf-8")
+        finally:
+            session.close()
+
+    logger.info(f"Batch completion requested: user={username}, prompts={len(prompts)}, room={room_id}")
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from dependency import get_db
+from libs.bulk import BATCH_SIZE, Importer, export_ndjson, parse_cursor
+from libs.db import SessionLocal
+from libs.storage import StorageError
+from router.auth import get_current_user
+from schemas.models import UserAccount
+
+router = APIRouter(prefix="/bulk", tags=["bulk"])
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+# Upper bound on request bytes buffered before handing lines to the importer
+MAX_PENDING_BYTES = 8 * 1024 * 1024
+# Longest accepted NDJSON line; blob records are 256 KiB, so only a malformed body gets near it
+MAX_RECORD_BYTES  = 4 * 1024 * 1024
+
+
+@router.get("/export")
+def export_data(
+    cursor: str | None = None,
+    current_user: UserAccount = Depends(get_current_user),
+):
+    try:
+        parse_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    username = current_user.username
+
+    def generate():
+        # The response outlives the request's DB dependency, so the stream owns its session
+        db = SessionLocal()
+        try:
+            yield from export_ndjson(db, username, cursor)
+        finally:
+            db.close()
+
+    logger.info(f"Bulk export started for user={username}, cursor={cursor}")
+    return StreamingResponse(
+        generate(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="natachat-{username}.ndjson"'},
+    )
+
+
+@router.post("/import")
+async def import_data(
+    request: Request,
+    import_id: str | None = None,
+    db: Session = Depends(get_db),
+    current_user: UserAccount = Depends(get_current_user),
+):
+    try:
+        importer = await asyncio.to_thread(Importer, db, current_user.username, import_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"Bulk import {importer.import_id} started for user={current_user.username}, skipping {importer.skip} records")
+
+    lines, pending_bytes, tail = [], 0, b""
+    try:
+        async for chunk in request.stream():
+            *complete, tail = (tail + chunk).split(b"\n")
+            lines.extend(complete)
+            if len(tail) > MAX_RECORD_BYTES:
+                # Without a bound, a body without newlines would be buffered (and re-concatenated) whole
+                raise ValueError(f"Record is longer than {MAX_RECORD_BYTES} bytes")
+            pending_bytes += len(chunk)
+            if len(lines) >= BATCH_SIZE or pending_bytes >= MAX_PENDING_BYTES:
+                await asyncio.to_thread(importer.feed_lines, lines)
+                lines, pending_bytes = [], 0
+        lines.append(tail)
+        return await asyncio.to_thread(importer.finish, lines)
+    except (ValueError, KeyError, StorageError) as e:
+        db.rollback()
+        logger.warning(f"Bulk import {importer.import_id} failed at record {importer.seen}: {e}")
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": f"Invalid record {importer.seen}: {e}",
+                "import_id": importer.import_id,
+                "committed_records": importer.checkpoint.records,
+            },
+        )
@@ -1,11 +1,19 @@
 import uuid
 import logging
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime
+from itertools import islice
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from sqlalchemy.orm import Session
 from router.auth import get_current_user
-from schemas.models import ChatRoom, Conversation, Message, UserAccount
-from sqlalchemy import asc
+from schemas.models import ArchivedSegment, ChatRoom, Conversation, Message, PromptTokenCache, RoomSummary, UserAccount
+from sqlalchemy import select
 from dependency import get_db
+from libs import room_stats
+from libs.archive import iter_archived_turns
+from libs.db import SessionLocal
+from libs.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, split_page
+from libs.serialization import ROW_BATCH_SIZE, list_response, query_batches
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
@@ -48,15 +56,60 @@ def create_room(
 
 @router.get("/rooms")
 def get_rooms(
-    db: Session = Depends(get_db),
+    request: Request,
     current_user: UserAccount = Depends(get_current_user),
 ):
     logger.debug(f"get_rooms called for user={current_user.username}")
-    rooms = db.query(ChatRoom).filter(ChatRoom.username == current_user.username).all()
-    logger.info(f"Found {len(rooms)} rooms for user={current_user.username}")
-    return [
-        {"id": str(r.id), "roomName": r.roomName, "owner": r.username} for r in rooms
-    ]
+    statement = (
+        select(ChatRoom.id, ChatRoom.roomName, ChatRoom.username)
+        .where(ChatRoom.username == current_user.username)
+    )
+    return list_response(request, query_batches(
+        SessionLocal, statement, lambda r: {"id": str(r.id), "roomName": r.roomName, "owner": r.username},
+    ))
+
+
+@router.get("/rooms/page")
+def get_rooms_page(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    order: Literal["recent", "name"] = "recent",
+    include_stats: bool = False,
+    db: Session = Depends(get_db),
+    current_user: UserAccount = Depends(get_current_user),
+):
+    logger.debug(f"get_rooms_page called for user={current_user.username}: order={order}, limit={limit}")
+    columns = [ChatRoom.id, ChatRoom.roomName, ChatRoom.username]
+    if include_stats:
+        columns += [ChatRoom.turnCount, ChatRoom.lastMessageAt, ChatRoom.lastMessagePreview]
+    try:
+        if order == "recent":
+            # Most recently active first; the key columns are also needed for the cursor
+            statement = select(*columns, ChatRoom.lastMessageAt.label("sort_at")).order_by(
+                ChatRoom.lastMessageAt.desc(), ChatRoom.id.desc()
+            )
+            if cursor:
+                statement = statement.where(room_stats.recent_after(*decode_cursor(cursor, datetime, uuid.UUID)))
+            key = lambda r: (r.sort_at, r.id)
+        else:
+            statement = select(*columns).order_by(ChatRoom.roomName)
+            if cursor:
+                # roomName is unique, so it is the whole key
+                statement = statement.where(ChatRoom.roomName > decode_cursor(cursor, str)[0])
+            key = lambda r: (r.roomName,)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    rows = db.execute(statement.where(ChatRoom.username == current_user.username).limit(limit + 1)).all()
+    rows, next_cursor = split_page(rows, limit, key)
+
+    def to_item(r):
+        item = {"id": str(r.id), "roomName": r.roomName, "owner": r.username}
+        if include_stats:
+            item.update(turnCount=r.turnCount or 0, lastMessageAt=r.lastMessageAt, lastMessagePreview=r.lastMessagePreview)
+        return item
+
+    return list_response(request, [[to_item(r) for r in rows]], head={"next_cursor": next_cursor}, key="items")
 
 
 @router.get("/room/{room_id}")
@@ -130,6 +183,12 @@ def delete_room(
         logger.warning(f"Room not found for delete: room_id={room_id}, user={current_user.username}")
         raise HTTPException(status_code=404, detail="Room not found")
 
+    # Archive files are append-only; dropping the stubs makes the room's archived turns unreachable
+    db.query(ArchivedSegment).filter(ArchivedSegment.chatRoom_id == room_id).delete(synchronize_session=False)
+    # SQLite does not enforce the foreign keys, so rows derived from the room go explicitly
+    db.query(RoomSummary).filter(RoomSummary.chatRoom_id == room_id).delete(synchronize_session=False)
+    room_conversations = select(Conversation.id).where(Conversation.chatRoom_id == room_id)
+    db.query(PromptTokenCache).filter(PromptTokenCache.conversation_id.in_(room_conversations)).delete(synchronize_session=False)
     db.delete(room)
     db.commit()
     logger.info(f"Room deleted: id={room_id}, user={current_user.username}")
@@ -139,6 +198,7 @@ def delete_room(
 @router.get("/history/{chatroom_id}")
 def get_conversation_history(
     chatroom_id: uuid.UUID,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: UserAccount = Depends(get_current_user),
 ):
@@ -152,34 +212,57 @@ def get_conversation_history(
         logger.warning(f"Chat room not found for history: chatroom_id={chatroom_id}, user={current_user.username}")
         raise HTTPException(status_code=404, detail="Chat room not found")
 
-    conversations = (
-        db.query(Conversation)
-        .filter(Conversation.chatRoom_id == chatroom_id)
-        .order_by(asc(Conversation.timestamp))
-        .all()
-    )
-    logger.info(f"Found {len(conversations)} conversations for chatroom_id={chatroom_id}")
-
-    history = []
-    for convo in conversations:
-        msg = (
-            db.query(Message)
-            .filter(Message.conversation_id == convo.id)
-            .first()
+    head = {"chatroom_id": str(chatroom.id), "chatroom_name": chatroom.roomName, "owner": chatroom.username}
+    logger.debug(f"Streaming history for chatroom_id={chatroom_id}")
+    return list_response(request, history_batches(chatroom_id), head, "messages")
+
+
+def history_batches(chatroom_id: uuid.UUID):
+    """Turns of a room in order as history items, archived turns first, in batches."""
+    session = SessionLocal()
+    try:
+        # Turns of rooms that went idle live in the cold-storage archive, read one segment at a time
+        archived = iter_archived_turns(session, chatroom_id)
+        while batch := [
+            {
+                "conversation_id": turn.id,
+                "query": turn.query,
+                "response": turn.responseMessage,
+                "timestamp": turn.timestamp,
+                "senderUsername": turn.senderUsername,
+                "rating": turn.rating,
+            }
+            for turn in islice(archived, ROW_BATCH_SIZE)
+        ]:
+            yield batch
+
+        # One joined query instead of a Message lookup per conversation
+        statement = (
+            select(
+                Conversation.id, Conversation.query, Conversation.responseMessage, Conversation.timestamp,
+                Message.senderUsername, Message.rating,
+            )
+            .outerjoin(Message, Message.conversation_id == Conversation.id)
+            .where(Conversation.chatRoom_id == chatroom_id)
+            .order_by(Conversation.timestamp, Conversation.id)
+            .execution_options(yield_per=ROW_BATCH_SIZE)
         )
-        history.append({
-            "conversation_id": convo.id,
-            "query": convo.query,
-            "response": convo.responseMessage,
-            "timestamp": convo.timestamp,
-            "senderUsername": msg.senderUsername if msg else None,
-            "rating": msg.rating if msg else None
-        })
-
-    logger.debug(f"Returning history for chatroom_id={chatroom_id}, messages_count={len(history)}")
-    return {
-        "chatroom_id": str(chatroom.id),
-        "chatroom_name": chatroom.roomName,
-        "owner": chatroom.username,
-        "messages": history
-    }
\ No newline at end of file
+        last_id = None
+        for partition in session.execute(statement).partitions():
+            batch = []
+            for row in partition:
+                # A turn rated by several users joins once per message; the first one is reported
+                if row.id == last_id:
+                    continue
+                last_id = row.id
+                batch.append({
+                    "conversation_id": row.id,
+                    "query": row.query,
+                    "response": row.responseMessage,
+                    "timestamp": row.timestamp,
+                    "senderUsername": row.senderUsername,
+                    "rating": row.rating,
+                })
+            yield batch
+    finally:
+        session.close()
@@ -1,28 +1,55 @@
-import os
-import shutil
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+import re
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, UploadFile, File
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
+from urllib.parse import quote
 from dependency import get_db
+from libs.db import SessionLocal
+from libs.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, split_page
+from libs.serialization import list_response, query_batches
+from libs.storage import ObjectNotFound, StorageError, document_key, document_path, document_storage, stored_key
 from router.auth import get_current_user
 from schemas.models import Document, UserAccount
 
 router = APIRouter(prefix="/document", tags=["document"])
 
-BASE_STORAGE_PATH = os.path.abspath(os.path.join("object-storage"))
-os.makedirs(BASE_STORAGE_PATH, exist_ok=True)
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")
 
 
 class DocumentResponse(BaseModel):
     id: int
     fileName: str
     filePath: str
+    storageKey: Optional[str] = None
 
     class Config:
         orm_mode = True
 
 
+def document_item(doc_id: int, file_name: str, file_path: str) -> dict:
+    # filePath keeps its meaning from before the storage drivers; the object key is storageKey
+    try:
+        key = stored_key(file_path)
+    except ObjectNotFound:
+        key = None
+    return {"id": doc_id, "fileName": file_name, "filePath": document_path(file_path), "storageKey": key}
+
+
+def content_disposition(file_name: str) -> str:
+    """Attachment header for a file name (RFC 6266): the UTF-8 name in filename*, an ASCII fallback in filename."""
+    file_name = "".join(c for c in file_name if c not in '"\r\n')
+    fallback  = "".join(c if " " <= c <= "~" and c != "\\" else "_" for c in file_name)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(file_name, safe='')}"
+
+
+class DocumentPage(BaseModel):
+    items: List[DocumentResponse]
+    next_cursor: Optional[str] = None
+
+
 @router.post("/upload", response_model=DocumentResponse)
 def upload_file(
     file: UploadFile = File(...),
@@ -30,12 +57,12 @@ def upload_file(
     current_user: UserAccount = Depends(get_current_user),
 ):
     username = current_user.username
-    user_folder = os.path.join(BASE_STORAGE_PATH, username)
-    os.makedirs(user_folder, exist_ok=True)
-
-    file_path = os.path.join(user_folder, file.filename)
+    try:
+        file_path = document_key(username, file.filename)
+    except StorageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    if os.path.exists(file_path):
+    if document_storage.exists(file_path):
         raise HTTPException(
             status_code=400,
             detail=f"File '{file.filename}' already exists in your storage"
@@ -52,8 +79,7 @@ def upload_file(
             detail=f"Document record for '{file.filename}' already exists in database"
         )
 
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    document_storage.put(file_path, file.file, file.size)
 
     new_doc = Document(
         username=username,
@@ -63,16 +89,40 @@ def upload_file(
     db.add(new_doc)
     db.commit()
     db.refresh(new_doc)
-    return new_doc
+    return document_item(new_doc.id, new_doc.fileName, new_doc.filePath)
 
 
 @router.get("/", response_model=List[DocumentResponse])
 def list_documents(
+    request: Request,
+    current_user: UserAccount = Depends(get_current_user),
+):
+    # Same fields as DocumentResponse, encoded without validating every row against it
+    statement = select(Document.id, Document.fileName, Document.filePath).where(Document.username == current_user.username)
+    return list_response(request, query_batches(
+        SessionLocal, statement, lambda r: document_item(r.id, r.fileName, r.filePath),
+    ))
+
+
+@router.get("/page", response_model=DocumentPage)
+def list_documents_page(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
     db: Session = Depends(get_db),
     current_user: UserAccount = Depends(get_current_user),
 ):
-    docs = db.query(Document).filter(Document.username == current_user.username).all()
-    return docs
+    # Oldest upload first, keyed on id; registered before /{doc_id} so "page" is not taken for an id
+    statement = select(Document.id, Document.fileName, Document.filePath).where(Document.username == current_user.username)
+    if cursor:
+        try:
+            statement = statement.where(Document.id > decode_cursor(cursor, int)[0])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    rows = db.execute(statement.order_by(Document.id).limit(limit + 1)).all()
+    rows, next_cursor = split_page(rows, limit, lambda r: (r.id,))
+    items = [document_item(r.id, r.fileName, r.filePath) for r in rows]
+    return list_response(request, [items], head={"next_cursor": next_cursor}, key="items")
 
 
 @router.get("/{doc_id}", response_model=DocumentResponse)
@@ -88,7 +138,52 @@ def get_document(
     )
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
-    return doc
+    return document_item(doc.id, doc.fileName, doc.filePath)
+
+
+@router.get("/{doc_id}/content")
+def download_document(
+    doc_id: int,
+    range_header: str | None = Header(default=None, alias="Range"),
+    db: Session = Depends(get_db),
+    current_user: UserAccount = Depends(get_current_user),
+):
+    doc = (
+        db.query(Document)
+        .filter(Document.id == doc_id, Document.username == current_user.username)
+        .first()
+    )
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    try:
+        key  = stored_key(doc.filePath)
+        size = document_storage.stat(key)["size"]
+    except ObjectNotFound:
+        raise HTTPException(status_code=404, detail="File not found on server")
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": content_disposition(doc.fileName),
+    }
+    match = RANGE_PATTERN.match(range_header or "")
+    if not match or match.groups() == ("", ""):
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(document_storage.stream(key), media_type="application/octet-stream", headers=headers)
+
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(0, size - int(last)), size - 1  # suffix range: the last N bytes
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+
+    headers["Content-Range"]  = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        document_storage.stream(key, start, end), status_code=206, media_type="application/octet-stream", headers=headers
+    )
 
 
 @router.put("/{doc_id}", response_model=DocumentResponse)
@@ -106,24 +201,26 @@ def rename_document(
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
 
-    user_folder = os.path.dirname(doc.filePath)
-    new_path = os.path.join(user_folder, new_name)
-    if os.path.exists(new_path):
+    try:
+        new_path = document_key(current_user.username, new_name)
+    except StorageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if document_storage.exists(new_path):
         raise HTTPException(
             status_code=400,
             detail=f"A file named '{new_name}' already exists"
         )
 
-    if os.path.exists(doc.filePath):
-        os.rename(doc.filePath, new_path)
-    else:
+    try:
+        document_storage.rename(stored_key(doc.filePath), new_path)
+    except ObjectNotFound:
         raise HTTPException(status_code=404, detail="File not found on server")
 
     doc.fileName = new_name
     doc.filePath = new_path
     db.commit()
     db.refresh(doc)
-    return doc
+    return document_item(doc.id, doc.fileName, doc.filePath)
 
 
 @router.delete("/{doc_id}")
@@ -140,8 +237,10 @@ def delete_document(
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
 
-    if os.path.exists(doc.filePath):
-        os.remove(doc.filePath)
+    try:
+        document_storage.delete(stored_key(doc.filePath))
+    except ObjectNotFound:
+        pass
 
     db.delete(doc)
     db.commit()
@@ -0,0 +1,9 @@
+from fastapi import APIRouter
+from libs import metrics
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics")
+def get_metrics():
+    return metrics.snapshot()
@@ -16,6 +16,19 @@ class SettingModel(BaseModel):
     modelName: Optional[str]  = None
     temperature: Optional[float] = 0.7
     systemPrompt: Optional[str]  = None
+    draftModelName: Optional[str] = None
+    loadProfile: Optional[str]    = "auto"
+    compileModel: Optional[bool]  = False
+    numThreads: Optional[int]     = None
+    cpuAffinity: Optional[str]    = None
+    apiBase: Optional[str]        = None
+    hedgeDomainName: Optional[str] = None
+    hedgeModelName: Optional[str]  = None
+    hedgeApiKey: Optional[str]     = None
+    hedgeApiBase: Optional[str]    = None
+    hedgeDelayMs: Optional[int]    = None
+    maxNewTokens: Optional[int]    = None
+    dailyTokenQuota: Optional[int] = None
 
     class Config:
         orm_mode = True
@@ -0,0 +1,81 @@
+import logging
+from datetime import datetime, timezone
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from dependency import get_db
+from libs.usage import daily_quota, default_range, usage_rows, usage_tracker
+from router.auth import get_current_user
+from schemas.models import UserAccount
+
+router = APIRouter(prefix="/usage", tags=["usage"])
+
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.DEBUG)
+
+
+def utc_naive(moment: datetime | None) -> datetime | None:
+    """Rollup buckets are naive UTC; a timezone-aware query parameter is converted to that."""
+    if moment is None or moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+@router.get("/")
+def get_usage(
+    start: datetime | None = None,
+    end: datetime | None = None,
+    granularity: str = "hour",
+    by_backend: bool = False,
+    db: Session = Depends(get_db),
+    current_user: UserAccount = Depends(get_current_user),
+):
+    if granularity not in ("hour", "day"):
+        raise HTTPException(status_code=400, detail="granularity must be 'hour' or 'day'")
+    default_start, default_end = default_range()
+    start, end = utc_naive(start) or default_start, utc_naive(end) or default_end
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    # Include the turns still aggregated in memory, without waiting for (a possibly backed up) flush
+    rows = usage_rows(db, current_user.username, start, end, granularity, by_backend, tracker=usage_tracker)
+
+    buckets = []
+    totals  = {"requests": 0, "promptTokens": 0, "completionTokens": 0, "totalTokens": 0, "seconds": 0.0}
+    for row in rows:
+        bucket = {
+            "bucket": row["bucket"].isoformat() if isinstance(row["bucket"], datetime) else row["bucket"],
+            "requests": row["requests"],
+            "promptTokens": row["promptTokens"],
+            "completionTokens": row["completionTokens"],
+            "totalTokens": row["promptTokens"] + row["completionTokens"],
+            "seconds": round(row["seconds"], 3),
+        }
+        if by_backend:
+            bucket["backend"] = row["backend"]
+        buckets.append(bucket)
+        for key in totals:
+            totals[key] += bucket[key]
+    totals["seconds"] = round(totals["seconds"], 3)
+    logger.debug(f"get_usage: user={current_user.username}, {len(buckets)} buckets from {start} to {end}")
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "granularity": granularity,
+        "buckets": buckets,
+        "totals": totals,
+    }
+
+
+@router.get("/quota")
+def get_quota(
+    db: Session = Depends(get_db),
+    current_user: UserAccount = Depends(get_current_user),
+):
+    quota = daily_quota(db, current_user.username)
+    used  = usage_tracker.used_today(db, current_user.username)
+    return {
+        "dailyTokenQuota": quota,
+        "usedToday": used,
+        "remainingToday": max(0, quota - used) if quota is not None else None,
+    }
@@ -1,19 +1,42 @@
 import uuid
 import logging
 from dependency import get_db
-from libs.llm import get_llm_response
+from libs.llm import get_llm_response, run_generation
 import asyncio
+import json
+import time
 from threading import Thread
+from libs.persistence import write_behind
+from libs.room_hub import room_hub
+from libs.streams import stream_registry, turn_activity
+from libs.circuit_breaker import CircuitOpenError
+from libs.compaction import compaction_worker
+from libs.deadline import Deadline, DeadlineExceeded
+from libs.providers import ProviderError
+from libs.tracing import TurnTrace, trace_writer
+from libs.usage import QuotaExceeded, usage_tracker
 
 from sqlalchemy.orm import Session
-from fastapi import WebSocket, WebSocketDisconnect, Depends, APIRouter
-from schemas.models import Conversation, ChatRoom, Message, UserAccount
+from fastapi import WebSocket, WebSocketDisconnect, Depends, APIRouter, Query
+from schemas.models import ChatRoom, UserAccount
 
 router = APIRouter(prefix="/ws", tags=["websocket"])
 
 logger = logging.getLogger("ws_chat")
 logging.basicConfig(level=logging.DEBUG)
 
+# Seconds between write-behind checkpoints of a partial response, so a crash mid-generation keeps most of it
+CHECKPOINT_INTERVAL = 2.0
+
+# End-to-end time budget for a turn, from receiving the prompt to the last token
+TURN_DEADLINE_SECONDS = 180.0
+
+# Serializes turns within a room so two tabs never generate into the same history concurrently
+room_locks = {}
+
+# Turns run detached from the socket that started them, so a dropped connection never cancels generation
+turn_tasks = set()
+
 def get_next(streamer):
     try:
         return next(iter(streamer))
@@ -27,8 +50,192 @@ async def async_generator(streamer):
             break
         yield next_item
 
+def render_text_frame(frame: dict):
+    """Plain-text protocol used by the existing UI: cumulative response text and error messages only."""
+    if frame["type"] in ("token", "error", "replay"):
+        return frame["text"]
+    return None
+
+async def forward_frames(websocket: WebSocket, subscription, protocol: str, replay: dict | None = None):
+    # Live frames already covered by the replay may also be queued on the subscription; skip those
+    replayed = {}
+    if replay is not None:
+        replayed[replay["stream_id"]] = replay["offset"]
+        frames = [replay]
+    else:
+        frames = []
+
+    while True:
+        frame = frames.pop(0) if frames else await subscription.get()
+        if frame is None:
+            # Dropped for falling too far behind; the client reconnects and resumes its stream
+            await websocket.close(code=1013)
+            return
+        if frame["type"] == "token" and frame.get("offset", 0) <= replayed.get(frame.get("stream_id"), 0):
+            continue
+        if protocol == "json":
+            await websocket.send_text(json.dumps(frame))
+        else:
+            text = render_text_frame(frame)
+            if text is not None:
+                await websocket.send_text(text)
+
+def error_frame(stream, convo_id: int | None, error) -> dict:
+    frame = {
+        "type": "error", "stream_id": stream.stream_id if stream else None, "conversation_id": convo_id,
+        "code": "generation_error", "text": str(error),
+    }
+    if isinstance(error, CircuitOpenError):
+        frame.update(code="backend_unavailable", backend=error.backend, retry_after=round(error.retry_after, 1))
+    elif isinstance(error, DeadlineExceeded):
+        frame.update(code="deadline_exceeded")
+    elif isinstance(error, ProviderError):
+        frame.update(code="backend_error", status=error.status_code)
+    return frame
+
+def quota_frame(error: QuotaExceeded) -> dict:
+    return {
+        "type": "error", "stream_id": None, "conversation_id": None, "code": "quota_exceeded",
+        "text": str(error), "used": error.used, "quota": error.quota,
+    }
+
+async def run_turn(room_key: str, room_uuid: uuid.UUID, username: str, data: str):
+    lock = room_locks.setdefault(room_key, asyncio.Lock())
+    # Counted for its whole life, remote turns included, so database maintenance never overlaps with it
+    with turn_activity.running():
+        async with lock:
+            # The deadline covers this turn's own work, not the wait behind earlier turns in the room
+            deadline = Deadline(TURN_DEADLINE_SECONDS)
+            # Admit the turn before anything is written, so a rejected prompt leaves no empty conversation behind
+            try:
+                token_budget = await asyncio.to_thread(usage_tracker.admit, username)
+                convo_id = await asyncio.wrap_future(write_behind.insert_conversation(room_uuid, data))
+            except QuotaExceeded as e:
+                logger.warning(str(e))
+                await room_hub.publish(room_key, quota_frame(e))
+                return
+            except Exception as e:
+                logger.exception(f"Failed to start a turn in room {room_key}: {e}")
+                await room_hub.publish(room_key, error_frame(None, None, e))
+                return
+            logger.debug(f"Conversation created: id={convo_id}, query={data}")
+            stream = stream_registry.create(room_key, convo_id)
+            try:
+                await stream_turn(room_key, room_uuid, username, data, convo_id, stream, deadline, token_budget)
+            except Exception as e:
+                # A failed commit or a crashed generation thread still ends the stream for every subscriber
+                logger.exception(f"Turn failed for conversation {convo_id}: {e}")
+                if not stream.done:
+                    await room_hub.publish(room_key, error_frame(stream, convo_id, e))
+            finally:
+                stream.finish()
+
+async def publish_terminal(room_key: str, stream, frame: dict):
+    """Publish the turn's done or error frame; the stream is finished once subscribers have it."""
+    await room_hub.publish(room_key, frame)
+    stream.finish()
+
+async def stream_turn(
+    room_key: str, room_uuid: uuid.UUID, username: str, data: str, convo_id: int, stream, deadline: Deadline,
+    token_budget: int | None = None,
+):
+    await room_hub.publish(room_key, {
+        "type": "query", "stream_id": stream.stream_id, "conversation_id": convo_id, "username": username, "text": data,
+    })
+
+    trace = TurnTrace(str(room_uuid), data)
+    try:
+        deadline.check()
+        # Loading settings, history and possibly a model blocks, so keep it off the event loop
+        with trace.stage("prepare"):
+            streamer_response = await asyncio.to_thread(get_llm_response, str(room_uuid), data, trace)
+    except DeadlineExceeded as e:
+        streamer_response = e
+
+    if isinstance(streamer_response, (str, Exception)):
+        logger.error(f"LLM response is an error: {streamer_response}")
+        await publish_terminal(room_key, stream, error_frame(stream, convo_id, streamer_response))
+        await asyncio.to_thread(trace_writer.finish, trace, None, str(streamer_response))
+        return
+
+    # The setting's per-turn limit, never more than what is left of the user's daily quota
+    max_new_tokens = streamer_response.max_new_tokens
+    if token_budget is not None:
+        max_new_tokens = max(1, min(max_new_tokens, token_budget))
+
+    trace.capture(max_new_tokens=max_new_tokens, deadline_seconds=round(deadline.remaining(), 3))
+    stats = {}
+    failures = []
+
+    def generate():
+        try:
+            stats.update(run_generation(streamer_response, max_new_tokens=max_new_tokens, deadline=deadline))
+        except Exception as e:
+            failures.append(e)
+            # generate() does not end the streamer when it raises, and the loop below would wait forever
+            streamer_response.streamer.end()
+            return
+        usage_tracker.record(username, stats["model"], stats["prompt_tokens"], stats["completion_tokens"], stats["elapsed"])
+
+    # Start generation in a separate thread
+    #thread = Thread(target=lambda: streamer_response.model.generate(**streamer_response.inputs, streamer=streamer_response.streamer, max_new_tokens=64, use_cache=True))
+    thread = Thread(target=generate)
+    generation_start = time.perf_counter()
+    thread.start()
+
+    # Fan the response out to every socket in the room; slow sockets are handled by their own buffers
+    generated_text = ""
+    last_checkpoint = time.monotonic()
+    error = None
+    try:
+        async for new_text in async_generator(streamer_response.streamer):
+            if not generated_text:
+                trace.mark("ttft", time.perf_counter() - generation_start)
+            generated_text += new_text
+            offset = stream.append(new_text)
+            await room_hub.publish(room_key, {
+                "type": "token", "stream_id": stream.stream_id, "offset": offset,
+                "conversation_id": convo_id, "delta": new_text, "text": generated_text,
+            })
+            if time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                write_behind.checkpoint_response(convo_id, generated_text)
+                last_checkpoint = time.monotonic()
+    except Exception as e:
+        # Remote providers can fail mid-stream
+        error = e
+
+    await asyncio.to_thread(thread.join)
+    error = error or (failures[0] if failures else None)
+    if error is not None:
+        # Keep what was generated so far
+        logger.error(f"Generation failed for conversation {convo_id}: {error}")
+        if generated_text:
+            write_behind.checkpoint_response(convo_id, generated_text)
+        await publish_terminal(room_key, stream, error_frame(stream, convo_id, error))
+        await asyncio.to_thread(trace_writer.finish, trace, stats, str(error))
+        return
+
+    trace.mark("generation", stats.get("elapsed", time.perf_counter() - generation_start))
+    logger.debug(f"LLM response: {generated_text}")
+    # Announce completion only once it is committed, so clients reloading history see it
+    await asyncio.wrap_future(write_behind.complete_conversation(convo_id, generated_text, username))
+    logger.debug(f"Conversation completed: id={convo_id}, senderUsername={username}")
+    await publish_terminal(room_key, stream, {
+        "type": "done", "stream_id": stream.stream_id, "offset": stream.offset, "conversation_id": convo_id, "text": generated_text,
+    })
+    compaction_worker.schedule(str(room_uuid))
+    await asyncio.to_thread(trace_writer.finish, trace, stats)
+
 @router.websocket("/chat/{room_id}/{username}")
-async def websocket_endpoint(websocket: WebSocket, room_id: str, username: str, db: Session = Depends(get_db)):
+async def websocket_endpoint(
+    websocket: WebSocket,
+    room_id: str,
+    username: str,
+    protocol: str = Query("text"),
+    stream_id: str | None = Query(None),
+    last_offset: int = Query(0),
+    db: Session = Depends(get_db),
+):
     logger.debug(f"WebSocket connection attempt: room_id={room_id}, username={username}")
     try:
         room_uuid = uuid.UUID(room_id)
@@ -57,47 +264,32 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str, username: str,
 
     await websocket.accept()
     logger.debug(f"WebSocket connection accepted: room_id={room_id}, username={username}")
+    room_key = str(room_uuid)
+    subscription = await room_hub.subscribe(room_key)
+
+    # Resume the requested stream, or catch a fresh connection up on a turn that is still generating
+    stream = stream_registry.get(stream_id) if stream_id else stream_registry.active_for_room(room_key)
+    replay = None
+    if stream is not None and stream.room_key == room_key:
+        replay = stream.replay_frame(last_offset if stream_id else 0)
+        logger.debug(f"Resuming stream {stream.stream_id} from offset {last_offset}: room_id={room_id}, username={username}")
+
+    sender = asyncio.create_task(forward_frames(websocket, subscription, protocol, replay))
     try:
         while True:
             data = await websocket.receive_text()
             logger.debug(f"Received data from user {username} in room {room_id}: {data}")
-
-            convo = Conversation(chatRoom_id=room_uuid, query=data, responseMessage="")
-            db.add(convo)
-            db.commit()
-            db.refresh(convo)
-            logger.debug(f"Conversation created: id={convo.id}, query={data}")
-
-            streamer_response = get_llm_response(room_id, data)
-
-            if isinstance(streamer_response, str):
-                logger.error(f"LLM response is an error string: {streamer_response}")
-                await websocket.send_text(streamer_response)
-                continue
-
-            # Start generation in a separate thread
-            #thread = Thread(target=lambda: streamer_response.model.generate(**streamer_response.inputs, streamer=streamer_response.streamer, max_new_tokens=64, use_cache=True))
-            thread = Thread(target=lambda: streamer_response.model.generate(**streamer_response.inputs, streamer=streamer_response.streamer, max_new_tokens=1024, use_cache=True))
-            thread.start()
-
-            # Stream response back to the client
-            generated_text = ""
-            async for new_text in async_generator(streamer_response.streamer):
-                generated_text += new_text
-                await websocket.send_text(generated_text)
-                #await websocket.send_text(new_text)
-
-            thread.join()
-            logger.debug(f"LLM response: {generated_text}")
-            convo.responseMessage = generated_text
-            db.commit()
-            logger.debug(f"Conversation updated with response: id={convo.id}")
-
-            msg = Message(conversation_id=convo.id, senderUsername=username, rating=None)
-            db.add(msg)
-            db.commit()
-            logger.debug(f"Message created: conversation_id={convo.id}, senderUsername={username}")
+            task = asyncio.create_task(run_turn(room_key, room_uuid, username, data))
+            turn_tasks.add(task)
+            task.add_done_callback(turn_tasks.discard)
 
     except WebSocketDisconnect:
         logger.info(f"Room {room_id} (user={username}): client disconnected")
         print(f"Room {room_id} (user={username}): client disconnected")
+    finally:
+        sender.cancel()
+        await room_hub.unsubscribe(subscription)
+        lock = room_locks.get(room_key)
+        if lock is not None and not lock.locked() and not room_hub.subscriber_count(room_key):
+            room_locks.pop(room_key, None)
+        await asyncio.wrap_future(write_behind.flush())
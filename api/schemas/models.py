@@ -1,7 +1,7 @@
 import uuid
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, Text, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, Text, DateTime, LargeBinary, Index
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.dialects.postgresql import UUID
 
@@ -20,9 +20,25 @@ class Setting(Base):
     modelName    = Column(String, nullable=True, default=None)
     temperature  = Column(Float, nullable=True, default=0.7)
     systemPrompt = Column(Text, nullable=True, default=None)
+    draftModelName = Column(String, nullable=True, default=None)
+    loadProfile    = Column(String, nullable=True, default="auto")
+    compileModel   = Column(Boolean, nullable=True, default=False)
+    numThreads     = Column(Integer, nullable=True, default=None)
+    cpuAffinity    = Column(String, nullable=True, default=None)
+    apiBase         = Column(String, nullable=True, default=None)
+    hedgeDomainName = Column(String, nullable=True, default=None)
+    hedgeModelName  = Column(String, nullable=True, default=None)
+    hedgeApiKey     = Column(String, nullable=True, default=None)
+    hedgeApiBase    = Column(String, nullable=True, default=None)
+    hedgeDelayMs    = Column(Integer, nullable=True, default=None)
+    maxNewTokens    = Column(Integer, nullable=True, default=None)  # per-turn generation limit
+    dailyTokenQuota = Column(Integer, nullable=True, default=None)  # prompt + completion tokens per user per UTC day
 
     users = relationship("UserAccount", back_populates="setting")
 
+# Setting columns holding credentials, left out of traces and (unless asked for) bulk exports
+SETTING_SECRET_FIELDS = ("apiKey", "hedgeApiKey")
+
 class UserAccount(Base):
     __tablename__ = "useraccount"
     username   = Column(String, primary_key=True, index=True)
@@ -34,6 +50,7 @@ class UserAccount(Base):
 
 class Document(Base):
     __tablename__ = "document"
+    __table_args__ = (Index("ix_document_username_id", "username", "id"),)
     id = Column(Integer, primary_key=True, autoincrement=True)
     username = Column(String, ForeignKey("useraccount.username"))
     fileName = Column(String, nullable=False)
@@ -42,13 +59,24 @@ class Document(Base):
 
 class ChatRoom(Base):
     __tablename__ = "chatroom"
+    # Keyset pagination of room listings (router/chat.py)
+    __table_args__ = (
+        Index("ix_chatroom_username_recent", "username", "lastMessageAt", "id"),
+        Index("ix_chatroom_username_name", "username", "roomName"),
+    )
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     roomName = Column(String, unique=True, nullable=False)
     username = Column(String, ForeignKey("useraccount.username"), nullable=False)
+    # Listing aggregates maintained on each conversation write (libs/room_stats.py)
+    turnCount          = Column(Integer, nullable=True, default=0)
+    lastMessageAt      = Column(DateTime, nullable=True)
+    lastMessagePreview = Column(String, nullable=True)
     conversations = relationship("Conversation", back_populates="chatroom")
 
 class Conversation(Base):
     __tablename__ = "conversation"
+    # Never reuse ids of archived turns; summaries and archive segments rely on ids increasing
+    __table_args__ = {"sqlite_autoincrement": True}
     id = Column(Integer, primary_key=True, autoincrement=True)
     chatRoom_id = Column(UUID(as_uuid=True), ForeignKey("chatroom.id"))
     query       = Column(Text, nullable=False)
@@ -66,3 +94,50 @@ class Message(Base):
 
     conversation = relationship("Conversation", back_populates="messages")
     user         = relationship("UserAccount")
+
+class PromptTokenCache(Base):
+    __tablename__   = "prompttokencache"
+    conversation_id = Column(Integer, ForeignKey("conversation.id"), primary_key=True)
+    modelKey    = Column(String, nullable=False)
+    promptHash  = Column(String, nullable=False)
+    segmentText = Column(Text, nullable=False)
+    tokenIds    = Column(LargeBinary, nullable=False)  # native int32 array
+
+class RoomSummary(Base):
+    __tablename__ = "roomsummary"
+    chatRoom_id = Column(UUID(as_uuid=True), ForeignKey("chatroom.id"), primary_key=True)
+    summary     = Column(Text, nullable=False)
+    upToConversationId = Column(Integer, nullable=False)  # last conversation folded into the summary
+    tokenCount  = Column(Integer, nullable=True)
+    updatedAt   = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ArchivedSegment(Base):
+    __tablename__ = "archivedsegment"
+    id          = Column(Integer, primary_key=True, autoincrement=True)
+    chatRoom_id = Column(UUID(as_uuid=True), ForeignKey("chatroom.id"), index=True, nullable=False)
+    archivePath = Column(String, nullable=False)
+    offset      = Column(Integer, nullable=False)  # byte offset of the gzip member in archivePath
+    length      = Column(Integer, nullable=False)
+    firstConversationId = Column(Integer, nullable=False)
+    lastConversationId  = Column(Integer, nullable=False)
+    turnCount     = Column(Integer, nullable=False)
+    lastMessageAt = Column(DateTime, nullable=True)
+    archivedAt    = Column(DateTime, default=datetime.utcnow)
+
+class BulkImport(Base):
+    __tablename__ = "bulkimport"
+    id        = Column(String, primary_key=True)
+    username  = Column(String, ForeignKey("useraccount.username"), nullable=False)
+    records   = Column(Integer, nullable=False, default=0)  # records committed so far; a resumed import skips these
+    status    = Column(String, nullable=False, default="running")
+    updatedAt = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class UsageRollup(Base):
+    __tablename__ = "usagerollup"
+    username    = Column(String, ForeignKey("useraccount.username"), primary_key=True)
+    bucketStart = Column(DateTime, primary_key=True)  # start of the UTC hour
+    backend     = Column(String, primary_key=True)
+    requests    = Column(Integer, nullable=False, default=0)
+    promptTokens     = Column(Integer, nullable=False, default=0)
+    completionTokens = Column(Integer, nullable=False, default=0)
+    seconds     = Column(Float, nullable=False, default=0.0)